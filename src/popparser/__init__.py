@@ -1,7 +1,7 @@
 from .globals import ParseException
 from .parsers import Parser
 from .grammar import Grammar
-from .llparser import ParsePosition, ParseResult, ParseError
+from .llparser import ParsePosition, ParseResult, EmptyResult, ParseError
 from .tokenizer import Tokenizer
 
 
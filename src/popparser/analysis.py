@@ -0,0 +1,152 @@
+'''Grammar analysis: FIRST sets, FOLLOW sets, nullability and LL(1) conflicts.
+
+Created on 16 october 2026
+'''
+
+EOF_TOKEN_TYPE = '<<EOF>>'
+
+
+class GrammarAnalysis:
+    '''The FIRST/FOLLOW/nullable analysis of a grammar, or of the
+    parsers reachable from `roots`.
+
+    The analysis is a fixed point over the reachable parsers.  Each
+    parser contributes through its analysis methods (see
+    `Parser.sub_parsers`, `Parser.analyze_first`, `Parser.analyze_follow`
+    and `Parser.analyze_conflicts`).
+
+    A FIRST set containing `None` means that the parser may start with
+    a token that cannot be predicted (e.g. a parser of an unknown kind).
+    '''
+    def __init__(self, grammar=None, roots=()):
+        roots = list(roots)
+        if grammar is not None:
+            roots.extend(grammar.rules.values())
+        self.__parsers = self.__reachable(roots)
+        self.__nullable = {parser: False for parser in self.__parsers}
+        self.__first = {parser: frozenset() for parser in self.__parsers}
+        # the FIRST sets with the token types skipped by forget parsers
+        self.__lead = {parser: frozenset() for parser in self.__parsers}
+        self.__follow = {parser: frozenset() for parser in self.__parsers}
+        self.__changed = False
+        self.__leading = False  # whether `first` reads the lead sets
+        self.__compute_first()
+        self.__leading = True
+        self.__compute_first()
+        self.__leading = False
+        for root in roots:
+            self.add_follow(root, (EOF_TOKEN_TYPE,))
+        self.__compute_follow()
+        self.__conflicts = []
+        for parser in self.__parsers:
+            self.__conflicts.extend(parser.analyze_conflicts(self))
+
+    @staticmethod
+    def __reachable(roots):
+        parsers = []
+        seen = set()
+        todo = list(reversed(roots))
+        while todo:
+            parser = todo.pop()
+            if parser not in seen:
+                seen.add(parser)
+                parsers.append(parser)
+                todo.extend(reversed(parser.sub_parsers()))
+        return parsers
+
+    def __compute_first(self):
+        # the FIRST (or lead) sets, to their fixed point
+        firsts = self.__lead if self.__leading else self.__first
+        self.__changed = True
+        while self.__changed:
+            self.__changed = False
+            for parser in self.__parsers:
+                nullable, first = parser.analyze_first(self)
+                if self.__leading:
+                    first = frozenset(first).union(parser.forget_parsers)
+                nullable = nullable or self.__nullable[parser]
+                first = firsts[parser].union(first)
+                if nullable != self.__nullable[parser] \
+                   or first != firsts[parser]:
+                    self.__nullable[parser] = nullable
+                    firsts[parser] = first
+                    self.__changed = True
+
+    def __compute_follow(self):
+        self.__changed = True
+        while self.__changed:
+            self.__changed = False
+            for parser in self.__parsers:
+                parser.analyze_follow(self, self.__follow[parser])
+
+    @property
+    def parsers(self):
+        '''The analyzed parsers.'''
+        return list(self.__parsers)
+
+    @property
+    def conflicts(self):
+        '''The LL(1) conflicts (messages) of the analyzed parsers.'''
+        return list(self.__conflicts)
+
+    def nullable(self, parser):
+        return self.__nullable.get(parser, False)
+
+    def first(self, parser):
+        firsts = self.__lead if self.__leading else self.__first
+        return firsts.get(parser, frozenset((None,)))
+
+    def lead(self, parser):
+        '''Return the FIRST set of `parser`, with the token types that
+        its forget parsers may skip before it.
+        '''
+        return self.__lead.get(parser, frozenset((None,)))
+
+    def follow(self, parser):
+        return self.__follow.get(parser, frozenset())
+
+    def add_follow(self, parser, token_types):
+        follow = self.__follow.get(parser)
+        if follow is None:
+            return
+        if not follow.issuperset(token_types):
+            self.__follow[parser] = follow.union(token_types)
+            self.__changed = True
+
+    def predict_set(self, parser):
+        '''Return the lead set of `parser` (see `lead`) if it is enough
+        to decide whether to parse it (the parser is neither nullable nor
+        starts with unpredictable tokens), or None.
+        '''
+        lead = self.lead(parser)
+        if self.nullable(parser) or None in lead:
+            return None
+        return lead
+
+    def sequence_first(self, parsers):
+        '''Return the (nullable, FIRST set) of a sequence of parsers.'''
+        first = set()
+        for parser in parsers:
+            first.update(self.first(parser))
+            if not self.nullable(parser):
+                return (False, first)
+        return (True, first)
+
+    def sequence_follow(self, parsers, follow):
+        '''Propagate the FOLLOW set of a sequence to its parsers.'''
+        for parser in reversed(parsers):
+            self.add_follow(parser, follow)
+            if self.nullable(parser):
+                follow = self.first(parser) | follow
+            else:
+                follow = self.first(parser)
+
+    def first_conflict(self, parser, other, what):
+        '''Return the conflict messages (a list) if the FIRST set of
+        `parser` overlaps `other`, a set of token types.
+        '''
+        overlap = (self.first(parser) & frozenset(other)) - {None}
+        if not overlap:
+            return []
+        return ["{0} conflict on {1} in: {2}".format(
+            what, ", ".join(sorted(repr(t) for t in overlap)), parser)]
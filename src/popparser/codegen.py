@@ -0,0 +1,761 @@
+'''Code generation: a standalone recursive-descent parser for a grammar.
+
+Created on 16 october 2026
+'''
+
+import hashlib
+import importlib.util
+import os
+
+from popparser import ParseException
+from popparser.grammar import Grammar, RefParser
+from popparser.parsers import Parser, Token, EOF, Tuple, Repeat, List,\
+    Optional, Choice, OrderedChoice
+from popparser.expr.parsers import Embed
+from popparser.expr.popparser import ExprParser
+
+# bump when the generated code changes (it is part of the fingerprint)
+CODEGEN_VERSION = 5
+
+# above this number of token types, a choice dispatches with a dict
+MAX_INLINE_DISPATCH = 8
+
+
+def sorted_types(token_types):
+    '''Return the list of `token_types` in a deterministic order (or None
+    if there are none, e.g. no prediction).
+    '''
+    if token_types is None:
+        return None
+    return sorted(token_types, key=repr)
+
+
+class CodeGenerator:
+    '''Generate the source of the parser of a (compiled) grammar.
+
+    The parsers of a grammar are interpreted: each node goes through
+    `Parser.parse` before reaching its `do_parse`.  The generated module
+    has instead a specialised function per rule (and per composite
+    parser), where the token types are compared inline and the
+    sub-parsers are called directly.
+
+    The objects of the grammar that cannot be written as source (e.g.
+    the transformations of the results, or the expressions of the
+    `ExprParser` operator tables) are given to the generated module in an
+    environment: two grammars with the same structure have the same
+    source, that can be cached on disk, keyed by the fingerprint of the
+    structure (computed before generating the source).
+
+    Usage: `generate_grammar(grammar)` returns a grammar, whose rules are
+    the generated parsers, to give to an `LLParsing`.
+    '''
+    def __init__(self, grammar):
+        if not grammar.compiled:
+            grammar.compile()
+        self.__grammar = grammar
+        self.__env = []  # the objects given to the generated code
+        self.__env_names = {}  # id(object) -> name in the generated code
+        self.__literals = {}  # source of a constant -> name in the code
+        self.__functions = {}  # parser -> name of the generated function
+        self.__pending = []  # the parsers whose function is to generate
+        self.__lines = []
+        self.__source = None
+        self.__fingerprint = hashlib.sha256(
+            repr(self.__structure()).encode('utf-8')).hexdigest()
+
+    @property
+    def env(self):
+        '''The environment of the generated code.'''
+        return list(self.__env)
+
+    @property
+    def fingerprint(self):
+        '''The fingerprint of the structure of the grammar, computed
+        without generating the source: the grammars with the same
+        fingerprint have the same source (and environment layout).
+        '''
+        return self.__fingerprint
+
+    @property
+    def source(self):
+        if self.__source is None:
+            self.__source = self.__generate()
+        return self.__source
+
+    #  structure
+
+    def __structure(self):
+        '''Return the description of the grammar, as read by the
+        generator, and fill the environment with its objects.
+        '''
+        nodes = {}  # id(parser) -> index of its description
+        pending = []
+
+        def node(parser):
+            if parser is None:
+                return None
+            if not self.__generated(parser):
+                return self.__object(parser, 'parser')
+            index = nodes.get(id(parser))
+            if index is None:
+                index = nodes[id(parser)] = len(nodes)
+                pending.append(parser)
+            return index
+
+        structure = [CODEGEN_VERSION]
+        for (rule_name, parser) in sorted(self.__grammar.rules.items()):
+            structure.append((rule_name, node(parser)))
+        while pending:
+            structure.append(self.__describe(pending.pop(0), node))
+        return structure
+
+    def __describe(self, parser, node):
+        '''Return the description of a generated `parser`, with `node`
+        describing its sub-parsers.
+        '''
+        description = [type(parser).__module__, type(parser).__qualname__,
+                       [(token_type, node(forget_parser))
+                        for (token_type, forget_parser)
+                        in sorted(parser.forget_parsers.items(),
+                                  key=lambda item: repr(item[0]))]]
+        for xform in (parser.xform_result, parser.xform_content):
+            description.append(None if xform is None
+                               else self.__object(xform, 'xform'))
+        if isinstance(parser, Token):
+            description.append(parser.token_type)
+        elif isinstance(parser, Tuple):
+            description.append([([node(skip) for skip in skips],
+                                 node(element))
+                                for (skips, element) in parser.elements])
+            description.append([node(skip) for skip in parser.last_skips])
+        elif isinstance(parser, (Repeat, List, Optional)):
+            description.extend((node(parser.parser),
+                                sorted_types(parser.prediction)))
+            if isinstance(parser, (Repeat, List)):
+                description.append(parser.minimum)
+            if isinstance(parser, Repeat):
+                description.append(parser.commit)
+            elif isinstance(parser, List):
+                description.extend((parser.open_token, parser.close_token,
+                                    parser.sep_token))
+        elif isinstance(parser, Choice):
+            (dispatch, default) = parser.dispatch
+            description.extend(([node(branch) for branch in parser.branches],
+                                [(token_type, node(branch))
+                                 for (token_type, branch)
+                                 in dispatch.items()],
+                                node(default)))
+        elif isinstance(parser, OrderedChoice):
+            description.append([(sorted_types(first), node(branch))
+                                for (first, branch) in parser.candidates])
+        elif isinstance(parser, RefParser):
+            description.extend((parser.rule_name, node(parser.target)))
+        elif isinstance(parser, ExprParser):
+            description.append(sorted_types(parser.skip_tokens))
+            for token_type in sorted_types(parser.expressions):
+                expression = parser.expressions[token_type]
+                description.append((
+                    token_type, self.__object(expression, 'expr'),
+                    expression.isprefix and expression.prefix_operand,
+                    expression.isinfix and (expression.left_binding_power,
+                                            expression.infix_operand),
+                    node(self.__embedded(expression))))
+        return description
+
+    def __object(self, obj, prefix):
+        '''Return the name of `obj`, given in the environment.'''
+        name = self.__env_names.get(id(obj))
+        if name is None:
+            name = "{0}_{1}".format(prefix, len(self.__env))
+            self.__env.append(obj)
+            self.__env_names[id(obj)] = name
+        return name
+
+    #  names
+
+    def constant(self, obj, prefix='const'):
+        '''Return the name of `obj` in the code: an object of the
+        environment, or a constant (of token types, binding powers and
+        objects of the environment) written in the source.
+        '''
+        name = self.__env_names.get(id(obj))
+        if name is not None:
+            return name
+        source = self.__literal(obj)
+        name = self.__literals.get(source)
+        if name is None:
+            name = "{0}_{1}".format(prefix, len(self.__env)
+                                    + len(self.__literals))
+            self.__literals[source] = name
+        return name
+
+    def __literal(self, obj):
+        '''Return the source of `obj` (in a deterministic order).'''
+        if obj is None or isinstance(obj, (bool, int, float, str)):
+            return repr(obj)
+        name = self.__env_names.get(id(obj))
+        if name is not None:
+            return name
+        if isinstance(obj, tuple):
+            items = [self.__literal(item) for item in obj]
+            return "({0}{1})".format(", ".join(items),
+                                     "," if len(items) == 1 else "")
+        if isinstance(obj, frozenset):
+            if not obj:
+                return "frozenset()"
+            return "frozenset({{{0}}})".format(", ".join(
+                sorted(self.__literal(item) for item in obj)))
+        if isinstance(obj, dict):
+            return "{{{0}}}".format(", ".join(sorted(
+                "{0}: {1}".format(self.__literal(key), self.__literal(value))
+                for (key, value) in obj.items())))
+        raise ParseException("Cannot generate the constant: {0!r}"
+                             .format(obj))
+
+    def function(self, parser):
+        '''Return the name of the function parsing with `parser`.'''
+        name = self.__functions.get(parser)
+        if name is None:
+            name = "node_{0}".format(len(self.__functions))
+            self.__functions[parser] = name
+            self.__pending.append(parser)
+        return name
+
+    def call(self, parser):
+        '''Return the expression parsing with `parser`.'''
+        if self.__generated(parser):
+            return "{0}(llparser)".format(self.function(parser))
+        return "{0}.parse(llparser)".format(self.constant(parser, 'parser'))
+
+    @staticmethod
+    def __generated(parser):
+        return isinstance(parser, (Token, Tuple, Repeat, List, Optional,
+                                   Choice, OrderedChoice, RefParser,
+                                   ExprParser))
+
+    @staticmethod
+    def __plain_token(parser):
+        return type(parser) in (Token, EOF) and not parser.forget_parsers\
+            and parser.xform_result is None and parser.xform_content is None
+
+    @staticmethod
+    def __embedded(expression):
+        '''Return the parser of an `Embed` expression (whose operand is
+        parsed by a direct call), or None.
+        '''
+        if isinstance(expression, Embed)\
+           and type(expression).parse_prefix is Embed.parse_prefix:
+            return expression.parser
+        return None
+
+    #  emitting
+
+    def emit(self, indent, line):
+        self.__lines.append("    " * indent + line)
+
+    def __generate(self):
+        rules = self.__grammar.rules
+        for (rule_name, parser) in sorted(rules.items()):
+            if self.__generated(parser) and parser not in self.__functions:
+                self.__functions[parser] = "rule_{0}_{1}".format(
+                    len(self.__functions),
+                    "".join(c if c.isalnum() else '_' for c in rule_name))
+                self.__pending.append(parser)
+        while self.__pending:
+            self.__emit_function(self.__pending.pop(0))
+        entries = [(rule_name, self.function(parser)
+                    if self.__generated(parser) else
+                    "{0}.parse".format(self.constant(parser, 'parser')))
+                   for (rule_name, parser) in sorted(rules.items())]
+        body = self.__lines
+        self.__lines = []
+        self.emit(0, "'''Parser generated by popparser.codegen"
+                  " (version {0}): do not edit.'''".format(CODEGEN_VERSION))
+        self.emit(0, "")
+        self.emit(0, "from popparser.llparser import ParseResult, ParseError,"
+                  " EXPECTING_TOKEN,\\")
+        self.emit(1, "UNEXPECTED_TOKEN, EXPECTING_OPEN, EXPECTING_CLOSE,"
+                  " NOT_ENOUGH_ELEMENTS")
+        self.emit(0, "")
+        self.emit(0, "")
+        self.emit(0, "def make_parser(env):")
+        self.emit(1, "'''Return the dict of the rules, from the environment"
+                     " of the grammar.'''")
+        for (index, obj) in enumerate(self.__env):
+            self.emit(1, "{0} = env[{1}]".format(self.__env_names[id(obj)],
+                                                 index))
+        for (source, name) in self.__literals.items():
+            self.emit(1, "{0} = {1}".format(name, source))
+        self.__lines.extend(body)
+        self.emit(1, "return {")
+        for (rule_name, entry) in entries:
+            self.emit(2, "{0!r}: {1},".format(rule_name, entry))
+        self.emit(1, "}")
+        return "\n".join(self.__lines) + "\n"
+
+    def __emit_function(self, parser):
+        name = self.__functions[parser]
+        self.emit(0, "")
+        if isinstance(parser, ExprParser):
+            self.__emit_expr_class(parser, name, 1)
+        self.emit(1, "def {0}(llparser):".format(name))
+        self.emit(2, "# " + type(parser).__name__)
+        if parser.forget_parsers or parser.xform_result is not None\
+           or parser.xform_content is not None:
+            # the body, wrapped as in `Parser.parse`
+            self.__emit_forget(parser, 2)
+            self.emit(2, "result = {0}_body(llparser)".format(name))
+            self.__emit_forget(parser, 2, 'fresult')
+            if parser.xform_result is not None:
+                self.emit(2, "if not isinstance(result, ParseError):")
+                self.emit(3, "result = {0}(result)".format(
+                    self.constant(parser.xform_result, 'xform')))
+            elif parser.xform_content is not None:
+                self.emit(2, "if not isinstance(result, ParseError):")
+                self.emit(3, "result = ParseResult({0}(result),"
+                          " result.start_pos, result.end_pos)".format(
+                              self.constant(parser.xform_content, 'xform')))
+            self.emit(2, "return result")
+            self.emit(0, "")
+            self.emit(1, "def {0}_body(llparser):".format(name))
+        self.__emit_body(parser, 2)
+
+    def __emit_forget(self, parser, indent, result='result'):
+        '''Emit the loop of `Parser.forget_parse`.'''
+        if not parser.forget_parsers:
+            return
+        self.emit(indent, "while True:")
+        self.__emit_dispatch(
+            indent + 1, "llparser.peek_token().token_type",
+            [((token_type,), forget_parser) for (token_type, forget_parser)
+             in sorted(parser.forget_parsers.items(),
+                       key=lambda item: str(item[0]))],
+            lambda ind, forget_parser: self.emit(
+                ind, "{0} = {1}".format(result, self.call(forget_parser))),
+            lambda ind: self.emit(ind, "break"))
+        self.emit(indent + 1, "if isinstance({0}, ParseError):".format(
+            result))
+        self.emit(indent + 2, "return {0}".format(result))
+
+    def __emit_dispatch(self, indent, key, cases, emit_case, emit_default):
+        '''Emit a dispatch on `key` (a token type) among the `cases`, a
+        list of (token types, value) pairs.
+        '''
+        count = sum(len(token_types) for (token_types, _) in cases)
+        if count > MAX_INLINE_DISPATCH:
+            table = {token_type: index
+                     for (index, (token_types, _)) in enumerate(cases)
+                     for token_type in token_types}
+            self.emit(indent, "case = {0}.get({1})".format(
+                self.constant(table, 'table'), key))
+            key = "case"
+            cases = [((index,), value)
+                     for (index, (_, value)) in enumerate(cases)]
+        else:
+            self.emit(indent, "case = " + key)
+        keyword = "if"
+        for (token_types, value) in cases:
+            if len(token_types) == 1:
+                test = "case == {0!r}".format(token_types[0])
+            else:
+                test = "case in {0!r}".format(tuple(sorted(token_types)))
+            self.emit(indent, "{0} {1}:".format(keyword, test))
+            emit_case(indent + 1, value)
+            keyword = "elif"
+        if keyword == "if":
+            emit_default(indent)
+        else:
+            self.emit(indent, "else:")
+            emit_default(indent + 1)
+
+    def __emit_token(self, indent, token_type, result):
+        '''Emit the parse of a (plain) token, returning the error.'''
+        expected = (token_type,)
+        self.emit(indent, "token_pos = llparser.position")
+        self.emit(indent, "token = llparser.peek_token()")
+        self.emit(indent, "if token.token_type != {0!r}:".format(token_type))
+        self.emit(indent + 1, "llparser.expect(token.start, {0!r})".format(
+            expected))
+        self.emit(indent + 1, "return ParseError(EXPECTING_TOKEN, token_pos,"
+                  " llparser.position, {0!r}, expected={1!r})".format(
+                      token_type, expected))
+        self.emit(indent, "{0} = ParseResult(llparser.next_token(),"
+                  " token_pos, llparser.position)".format(result))
+
+    def __emit_element(self, indent, parser, result):
+        '''Emit the parse of an element, returning the error.'''
+        if self.__plain_token(parser):
+            self.__emit_token(indent, parser.token_type, result)
+            return
+        self.emit(indent, "{0} = {1}".format(result, self.call(parser)))
+        self.emit(indent, "if isinstance({0}, ParseError):".format(result))
+        self.emit(indent + 1, "return " + result)
+
+    def __emit_attempt(self, indent, parser, prediction, result):
+        '''Emit the attempt of `parser`, predicted or not: `result` is
+        None if the parser is not predicted.
+        '''
+        if prediction is None:
+            self.emit(indent, "{0} = {1}".format(result, self.call(parser)))
+            return
+        self.emit(indent, "token = llparser.peek_token()")
+        if len(prediction) == 1:
+            (token_type,) = prediction
+            self.emit(indent, "if token.token_type != {0!r}:".format(
+                token_type))
+        else:
+            self.emit(indent, "if token.token_type not in {0}:".format(
+                self.constant(frozenset(prediction), 'first')))
+        self.emit(indent + 1, "llparser.expect(token.start, {0})".format(
+            self.constant(frozenset(prediction), 'first')))
+        self.emit(indent + 1, "{0} = None".format(result))
+        self.emit(indent, "else:")
+        self.emit(indent + 1, "{0} = {1}".format(result, self.call(parser)))
+
+    def __emit_body(self, parser, indent):
+        if isinstance(parser, Token):
+            self.__emit_token(indent, parser.token_type, "result")
+            self.emit(indent, "return result")
+        elif isinstance(parser, Tuple):
+            self.__emit_tuple(parser, indent)
+        elif isinstance(parser, Repeat):
+            self.__emit_repeat(parser, indent)
+        elif isinstance(parser, List):
+            self.__emit_list(parser, indent)
+        elif isinstance(parser, Optional):
+            self.__emit_optional(parser, indent)
+        elif isinstance(parser, Choice):
+            self.__emit_choice(parser, indent)
+        elif isinstance(parser, OrderedChoice):
+            self.__emit_ordered_choice(parser, indent)
+        elif isinstance(parser, RefParser):
+            target = parser.target
+            if target is None:
+                raise ParseException("No such rule in grammar: "
+                                     + parser.rule_name)
+            self.emit(indent, "return " + self.call(target))
+        elif isinstance(parser, ExprParser):
+            self.emit(indent, "return {0}_parser(llparser).pop_parse(0)"
+                      .format(self.__functions[parser]))
+
+    def __emit_tuple(self, parser, indent):
+        self.emit(indent, "start_pos = llparser.position")
+        elements = parser.elements
+        for (index, (skips, element)) in enumerate(elements):
+            self.__emit_forget(parser, indent)
+            for skip in skips:
+                self.__emit_element(indent, skip, "result")
+            self.__emit_element(indent, element, "result_{0}".format(index))
+        for skip in parser.last_skips:
+            self.__emit_element(indent, skip, "result")
+        if len(elements) == 1:
+            results = "result_0"
+        else:
+            results = "[{0}]".format(", ".join(
+                "result_{0}".format(index) for index in range(len(elements))))
+        self.emit(indent, "return ParseResult({0}, start_pos,"
+                  " llparser.position)".format(results))
+
+    def __emit_repeat(self, parser, indent):
+        # as `Repeat.do_parse`: the count of repetitions stays at 0
+        self.emit(indent, "start_pos = llparser.position")
+        self.emit(indent, "results = []")
+        self.emit(indent, "while True:")
+        self.__emit_forget(parser, indent + 1)
+        self.__emit_attempt(indent + 1, parser.parser, parser.prediction,
+                            "result")
+        self.emit(indent + 1,
+                  "if result is None or isinstance(result, ParseError):")
+        if parser.minimum == 0:
+            self.emit(indent + 2, "return llparser.empty_result(start_pos)")
+        else:
+            self.emit(indent + 2, "return ParseResult(results, start_pos,"
+                      " llparser.position)")
+        self.emit(indent + 1, "results.append(result)")
+        if parser.commit:
+            self.emit(indent + 1, "llparser.commit()")
+
+    def __emit_list(self, parser, indent):
+        self.emit(indent, "start_pos = llparser.position")
+        self.emit(indent, "results = []")
+        for (token_type, code) in ((parser.open_token, "EXPECTING_OPEN"),):
+            if token_type is not None:
+                self.__emit_list_token(indent, token_type, code)
+        self.emit(indent, "while True:")
+        self.__emit_forget(parser, indent + 1)
+        self.__emit_attempt(indent + 1, parser.parser, parser.prediction,
+                            "result")
+        self.emit(indent + 1,
+                  "if result is None or isinstance(result, ParseError):")
+        self.emit(indent + 2, "break")
+        self.emit(indent + 1, "results.append(result)")
+        self.__emit_forget(parser, indent + 1)
+        if parser.sep_token is not None:
+            self.emit(indent + 1, "if llparser.peek_token().token_type"
+                      " != {0!r}:".format(parser.sep_token))
+            self.emit(indent + 2, "break")
+            self.emit(indent + 1, "llparser.next_token()")
+        if parser.close_token is not None:
+            self.__emit_list_token(indent, parser.close_token,
+                                   "EXPECTING_CLOSE")
+        self.emit(indent, "count = len(results)")
+        if parser.minimum == 0:
+            self.emit(indent, "if count == 0:")
+            self.emit(indent + 1, "return llparser.empty_result(start_pos)")
+        else:
+            self.emit(indent, "if 0 < count < {0!r}:".format(parser.minimum))
+            self.emit(indent + 1, "return ParseError(NOT_ENOUGH_ELEMENTS,"
+                      " start_pos, llparser.position, count, {0!r})"
+                      .format(parser.minimum))
+        self.emit(indent, "return ParseResult(results, start_pos,"
+                  " llparser.position)")
+
+    def __emit_list_token(self, indent, token_type, code):
+        expected = (token_type,)
+        self.emit(indent, "token = llparser.peek_token()")
+        self.emit(indent, "if token.token_type != {0!r}:".format(token_type))
+        self.emit(indent + 1, "llparser.expect(token.start, {0!r})".format(
+            expected))
+        self.emit(indent + 1, "return ParseError({0}, token.start_pos,"
+                  " token.end_pos, {1!r}, token.token_type,"
+                  " expected={2!r})".format(code, token_type, expected))
+        self.emit(indent, "llparser.next_token()")
+
+    def __emit_optional(self, parser, indent):
+        self.emit(indent, "start_pos = llparser.position")
+        self.__emit_attempt(indent, parser.parser, parser.prediction,
+                            "result")
+        self.emit(indent,
+                  "if result is None or isinstance(result, ParseError):")
+        self.emit(indent + 1, "return llparser.empty_result(start_pos)")
+        self.emit(indent, "return result")
+
+    def __emit_choice(self, parser, indent):
+        (dispatch, default) = parser.dispatch
+        expected = parser.expected
+        # List[(token types, branch)] in the order of the branches
+        branches = []
+        for branch in parser.branches:
+            token_types = sorted(token_type for (token_type, other)
+                                 in dispatch.items() if other is branch)
+            if token_types:
+                branches.append((token_types, branch))
+
+        def emit_branch(ind, branch):
+            self.emit(ind, "return " + self.call(branch))
+
+        def emit_default(ind):
+            if default is not None:
+                self.emit(ind, "return " + self.call(default))
+                return
+            self.emit(ind, "llparser.expect(token.start, {0})".format(
+                self.constant(expected, 'expected')))
+            self.emit(ind, "return ParseError(UNEXPECTED_TOKEN,"
+                      " token.start_pos, token.end_pos, token.token_type,"
+                      " expected={0})".format(
+                          self.constant(expected, 'expected')))
+
+        self.emit(indent, "token = llparser.peek_token()")
+        self.__emit_dispatch(indent, "token.token_type",
+                             [(tuple(token_types), branch)
+                              for (token_types, branch) in branches],
+                             emit_branch, emit_default)
+
+    def __emit_ordered_choice(self, parser, indent):
+        expected = parser.expected
+        self.emit(indent, "token = llparser.peek_token()")
+        self.emit(indent, "error = None")
+        for (first, branch) in parser.candidates:
+            ind = indent
+            if first is not None:
+                self.emit(indent, "if token.token_type in {0}:".format(
+                    self.constant(frozenset(first), 'first')))
+                ind += 1
+            self.emit(ind, "mark = llparser.speculate()")
+            self.emit(ind, "result = " + self.call(branch))
+            self.emit(ind, "if not isinstance(result, ParseError):")
+            self.emit(ind + 1, "llparser.end_speculation(mark)")
+            self.emit(ind + 1, "return result")
+            self.emit(ind, "llparser.end_speculation(mark, rollback=True)")
+            self.emit(ind, "if error is None or result.end_pos.offset"
+                      " > error.end_pos.offset:")
+            self.emit(ind + 1, "error = result")
+        self.emit(indent, "if error is None:")
+        self.emit(indent + 1, "llparser.expect(token.start, {0})".format(
+            self.constant(expected, 'expected')))
+        self.emit(indent + 1, "return ParseError(UNEXPECTED_TOKEN,"
+                  " token.start_pos, token.end_pos, token.token_type,"
+                  " expected={0})".format(self.constant(expected,
+                                                         'expected')))
+        self.emit(indent, "return error")
+
+    def __emit_expr_class(self, parser, name, indent):
+        '''Emit a specialised precedence-operated parser, with the
+        interface of `ExprParser` expected by the expressions.
+        '''
+        expressions = self.constant(parser.expressions, 'exprs')
+        prefix = self.constant({
+            token_type: expression.prefix_operand for
+            (token_type, expression) in parser.expressions.items()
+            if expression.isprefix}, 'prefix')
+        infix = self.constant({
+            token_type: (expression.left_binding_power,
+                         expression.infix_operand) for
+            (token_type, expression) in parser.expressions.items()
+            if expression.isinfix}, 'infix')
+        # the embedded operands, parsed by the generated functions
+        embeds = []
+        for token_type in sorted_types(parser.expressions):
+            expression = parser.expressions[token_type]
+            embedded = self.__embedded(expression)
+            if embedded is not None and self.__generated(embedded):
+                embeds.append((token_type, expression, embedded))
+        self.emit(indent, "class {0}_parser:".format(name))
+        self.emit(indent + 1, "__slots__ = ('llparser', 'token')")
+        self.emit(0, "")
+        self.emit(indent + 1, "def __init__(self, llparser):")
+        self.emit(indent + 2, "self.llparser = llparser")
+        self.emit(indent + 2, "self.token = None")
+        self.emit(0, "")
+        self.emit(indent + 1, "@staticmethod")
+        self.emit(indent + 1, "def next_token(llparser):")
+        if parser.skip_tokens:
+            skips = self.constant(frozenset(parser.skip_tokens), 'skips')
+            self.emit(indent + 2, "while llparser.peek_token().token_type"
+                      " in {0}:".format(skips))
+            self.emit(indent + 3, "llparser.next_token()")
+        self.emit(indent + 2, "return llparser.next_token()")
+        self.emit(0, "")
+        self.emit(indent + 1, "def consume_token(self, token_type):")
+        self.emit(indent + 2, "if self.token.token_type != token_type:")
+        self.emit(indent + 3, "return ParseError(\"Expecting '{0}' but got"
+                  " '{1}'\", self.token.start_pos, self.token.end_pos,"
+                  " token_type, self.token.token_type)")
+        self.emit(indent + 2, "self.token = self.next_token(self.llparser)")
+        self.emit(0, "")
+        # as `ExprParser.pop_parse`
+        self.emit(indent + 1, "def pop_parse(self, rbp, left=None):")
+        ind = indent + 2
+        self.emit(ind, "llparser = self.llparser")
+        self.emit(ind, "operators = []")
+        self.emit(ind, "while True:")
+        ind += 1
+        self.emit(ind, "if left is None:")
+        self.emit(ind + 1, "token = self.token = self.next_token(llparser)")
+        self.emit(ind + 1, "if token.iserror:")
+        self.emit(ind + 2, "left = ParseError(str(token.value),"
+                  " llparser.position, llparser.position)")
+        self.emit(ind + 1, "elif token.iseof:")
+        self.emit(ind + 2, "left = ParseError('Unexpected end of file',"
+                  " llparser.position, llparser.position)")
+        self.emit(ind + 1, "elif token.token_type not in {0}:".format(
+            expressions))
+        self.emit(ind + 2, "left = ParseError('Unexpected token type: {0}',"
+                  " token.start_pos, token.end_pos, token.token_type)")
+        self.emit(ind + 1, "elif token.token_type not in {0}:".format(prefix))
+        self.emit(ind + 2, "left = ParseError('No left operand in"
+                  " expression', token.start_pos, llparser.position)")
+        for (token_type, expression, embedded) in embeds:
+            self.emit(ind + 1, "elif token.token_type == {0!r}:".format(
+                token_type))
+            self.emit(ind + 2, "left = {0}.parse_embedded(self, token, {1})"
+                      .format(self.constant(expression),
+                              self.function(embedded)))
+        self.emit(ind + 1, "else:")
+        self.emit(ind + 2, "expr = {0}[token.token_type]".format(expressions))
+        self.emit(ind + 2, "operand = {0}[token.token_type]".format(prefix))
+        self.emit(ind + 2, "if operand is not None:")
+        self.emit(ind + 3, "operators.append((expr, token, None, rbp))")
+        self.emit(ind + 3, "rbp = operand")
+        self.emit(ind + 3, "continue")
+        self.emit(ind + 2, "left = expr.parse_prefix(self, token)")
+        self.emit(ind, "while not left.iserror and"
+                  " not llparser.peek_token().iseof:")
+        self.emit(ind + 1, "token = self.token = self.next_token(llparser)")
+        self.emit(ind + 1, "if token.iserror:")
+        self.emit(ind + 2, "left = ParseError(str(token.value),"
+                  " llparser.position, llparser.position)")
+        self.emit(ind + 2, "break")
+        self.emit(ind + 1, "operator = {0}.get(token.token_type)".format(
+            infix))
+        self.emit(ind + 1, "if operator is None or rbp >= operator[0]:")
+        self.emit(ind + 2, "llparser.put_back_token(token)")
+        self.emit(ind + 2, "break")
+        self.emit(ind + 1, "expr = {0}[token.token_type]".format(expressions))
+        self.emit(ind + 1, "if operator[1] is not None:")
+        self.emit(ind + 2, "operators.append((expr, token, left, rbp))")
+        self.emit(ind + 2, "rbp = operator[1]")
+        self.emit(ind + 2, "left = None")
+        self.emit(ind + 2, "break")
+        self.emit(ind + 1, "left = expr.parse_infix(self, left, token)")
+        self.emit(ind, "if left is None:")
+        self.emit(ind + 1, "continue")
+        self.emit(ind, "if not operators:")
+        self.emit(ind + 1, "return left")
+        self.emit(ind, "(expr, token, operand, rbp) = operators.pop()")
+        self.emit(ind, "if not left.iserror:")
+        self.emit(ind + 1, "if operand is None:")
+        self.emit(ind + 2, "left = expr.reduce_prefix(self, token, left)")
+        self.emit(ind + 1, "else:")
+        self.emit(ind + 2, "left = expr.reduce_infix(self, operand, token,"
+                  " left)")
+        self.emit(0, "")
+
+
+class GeneratedParser(Parser):
+    '''A parser generated for a rule (see `generate_grammar`).'''
+    def __init__(self, rule_name, function, token_type):
+        Parser.__init__(self)
+        self.rule_name = rule_name
+        self.function = function
+        self.__token_type = token_type
+
+    @property
+    def token_type(self):
+        return self.__token_type
+
+    def do_parse(self, llparsing):
+        return self.function(llparsing)
+
+    def __str__(self):
+        return "<generated {0}>".format(self.rule_name)
+
+
+def load_module(generator, cache_dir=None):
+    '''Return the module generated by `generator`, cached (with its
+    bytecode) in `cache_dir` if given: the source is only generated if
+    it is not in the cache.
+    '''
+    name = "popgen_" + generator.fingerprint[:32]
+    if cache_dir is None:
+        module = type(os)(name)
+        exec(compile(generator.source, "<" + name + ">", 'exec'),
+             module.__dict__)
+        return module
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, name + ".py")
+    if not os.path.exists(path):
+        # the name is the fingerprint: an existing file is up to date
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+            cache_file.write(generator.source)
+        os.replace(tmp_path, path)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate_grammar(grammar, cache_dir=None):
+    '''Return a grammar with the generated parsers of the rules of
+    `grammar` (that is compiled if it is not), the generated module being
+    cached in `cache_dir` if given.
+    '''
+    generator = CodeGenerator(grammar)
+    module = load_module(generator, cache_dir)
+    functions = module.make_parser(generator.env)
+    generated = Grammar()
+    for (rule_name, parser) in grammar.rules.items():
+        generated.register(rule_name, GeneratedParser(
+            rule_name, functions[rule_name], parser.token_type))
+    return generated.compile()
@@ -1,5 +1,5 @@
 
-from .popparser import ExprParser
+from .popparser import ExprParser, ExprParsing
 
 from .parsers import Expression,\
                      Prefix, Atom, Embed, Bracket,\
@@ -5,6 +5,9 @@ Created on 25 august 2012
 @author: F. Peschanski
 '''
 
+import threading
+import warnings
+
 from popparser import ParseError
 
 
@@ -28,6 +31,59 @@ class Expression:
     def isinfix(self):
         return False
 
+    def compile(self, resolve):
+        '''Resolve the parsers of the expression (see `Parser.compile`),
+        and return them.
+        '''
+        return []
+
+    def sub_parsers(self):
+        '''Return the parsers of the expression (see `Parser.sub_parsers`).
+        '''
+        return []
+
+    #  operands (see `ExprParser.pop_parse`)
+
+    @property
+    def prefix_operand(self):
+        '''The binding power of the operand of the expression in prefix
+        position, or None if the expression parses itself (with its own
+        `parse_prefix`).
+        '''
+        return None
+
+    @property
+    def infix_operand(self):
+        '''The binding power of the right operand of the expression in
+        infix position, or None if the expression parses itself (with its
+        own `parse_infix`).
+        '''
+        return None
+
+    def reduce_prefix(self, pop_parser, token, argument):
+        '''Return the result of the expression in prefix position, once
+        its operand (`argument`) is parsed.
+        '''
+        raise NotImplementedError("Abstract method")
+
+    def reduce_infix(self, pop_parser, left, token, right):
+        '''Return the result of the expression in infix position, once
+        its right operand is parsed.
+        '''
+        raise NotImplementedError("Abstract method")
+
+    def parse_prefix(self, pop_parser, token):
+        argument = pop_parser.pop_parse(rbp=self.prefix_operand)
+        if argument.iserror:
+            return argument
+        return self.reduce_prefix(pop_parser, token, argument)
+
+    def parse_infix(self, pop_parser, left, token):
+        right = pop_parser.pop_parse(rbp=self.infix_operand)
+        if right.iserror:
+            return right
+        return self.reduce_infix(pop_parser, left, token, right)
+
 
 #==============================================================================
 # PARSERS IN PREFIX POSITION
@@ -45,10 +101,11 @@ class Prefix(Expression):
     def priority(self):
         return self.right_binding_power
 
-    def parse_prefix(self, pop_parser, token):
-        argument = pop_parser.pop_parse(rbp=self.right_binding_power)
-        if argument.iserror:
-            return argument
+    @property
+    def prefix_operand(self):
+        return self.right_binding_power
+
+    def reduce_prefix(self, pop_parser, token, argument):
         return self.on_prefix(token, argument)
 
     def on_prefix(self, token, argument, start_pos, end_pos):
@@ -84,10 +141,11 @@ class Bracket(Expression):
     def token_type(self):
         return self.open_token
 
-    def parse_prefix(self, pop_parser, _):
-        expr = pop_parser.pop_parse(rbp=self.right_binding_power)
-        if expr.iserror:
-            return expr
+    @property
+    def prefix_operand(self):
+        return self.right_binding_power
+
+    def reduce_prefix(self, pop_parser, _, expr):
         pop_parser.consume_token(self.close_token)
         return expr
 
@@ -96,22 +154,104 @@ class Embed(Expression):
     def __init__(self, parser):
         Expression.__init__(self, rbp=0)
         self.parser = parser
-        self.expr_parser = None
+        # the stacks of the embedding expression parsers, by thread (only
+        # for the deprecated `expr_parser` attribute)
+        self.__threads = threading.local()
 
     @property
     def isprefix(self):
         return True
 
+    def compile(self, resolve):
+        self.parser = resolve(self.parser)
+        return [self.parser]
+
+    def sub_parsers(self):
+        return [self.parser]
+
+    @property
+    def expr_parser(self):
+        '''The expression parser (e.g. an `ExprParsing`) whose parse of
+        `llparser` is embedding the parser, or None, as
+        `embed.expr_parser(llparser)`.
+
+        Using it as the expression parser itself (the former attribute,
+        for the current parse of the thread) is deprecated.
+        '''
+        return EmbeddingParser(self)
+
+    def embedding(self, llparser):
+        '''Return the expression parser whose parse of `llparser` is
+        embedding the parser, or None.
+        '''
+        embedding = llparser.context.state(self, list)
+        return embedding[-1] if embedding else None
+
+    def current_embedding(self):
+        '''Return the innermost expression parser embedding the parser in
+        the current thread, or None.
+        '''
+        stack = getattr(self.__threads, 'stack', None)
+        return stack[-1] if stack else None
+
     def parse_prefix(self, pop_parser, token):
+        return self.parse_embedded(pop_parser, token, self.parser.parse)
+
+    def parse_embedded(self, pop_parser, token, parse):
+        '''Parse the operand with `parse` (e.g. the generated function
+        of the parser), embedded in `pop_parser`.
+        '''
         if token.token_type != self.parser.token_type:
-            return ParseError("Mismatch token type '{0}' expecting: {1}"\
-                            .format(token.token_type, self.parser.token_type),
-                              token.start_pos, token.start_pos)
-        pop_parser.llparser.put_back_token(token)
-        self.expr_parser = pop_parser
-        result = self.parser.parse(pop_parser.llparser)
-        self.expr_parser = None
-        return result
+            return ParseError("Mismatch token type '{0}' expecting: {1}",
+                              token.start_pos, token.start_pos,
+                              token.token_type, self.parser.token_type)
+        llparser = pop_parser.llparser
+        llparser.put_back_token(token)
+        self.enter(pop_parser)
+        try:
+            return parse(llparser)
+        finally:
+            self.leave(pop_parser)
+
+    def enter(self, pop_parser):
+        '''Push `pop_parser` as the innermost expression parser embedding
+        the parser (to `leave` once the operand is parsed).
+        '''
+        # the stack of the expression parsers embedding the parser
+        pop_parser.llparser.context.state(self, list).append(pop_parser)
+        stack = getattr(self.__threads, 'stack', None)
+        if stack is None:
+            stack = self.__threads.stack = []
+        stack.append(pop_parser)
+
+    def leave(self, pop_parser):
+        '''Pop `pop_parser`, the innermost expression parser embedding the
+        parser (see `enter`).
+        '''
+        pop_parser.llparser.context.state(self, list).pop()
+        self.__threads.stack.pop()
+
+
+class EmbeddingParser:
+    '''The `expr_parser` of an `Embed`: called with an llparser, or
+    standing (deprecated) for the innermost embedding expression parser of
+    the current thread.
+    '''
+    __slots__ = ('embed',)
+
+    def __init__(self, embed):
+        self.embed = embed
+
+    def __call__(self, llparser):
+        return self.embed.embedding(llparser)
+
+    def __getattr__(self, name):
+        warnings.warn("Embed.expr_parser is to be called with the llparser",
+                      DeprecationWarning, stacklevel=2)
+        expr_parser = self.embed.current_embedding()
+        if expr_parser is None:
+            raise AttributeError(name)
+        return getattr(expr_parser, name)
 
 
 #==============================================================================
@@ -132,15 +272,14 @@ class InfixGen(Expression):
     def isinfix(self):
         return True
 
-    def parse_infix(self, pop_parser, left, token):
+    @property
+    def infix_operand(self):
         if self.assoc == 'RIGHT':
-            precedence = self.left_binding_power - 1
+            return self.left_binding_power - 1
         else:  # LEFT or NONASSOC
-            precedence = self.right_binding_power
+            return self.right_binding_power
 
-        right = pop_parser.pop_parse(rbp=precedence)
-        if right.iserror:
-            return right
+    def reduce_infix(self, pop_parser, left, token, right):
         return self.on_infix(left, token, right)
 
     def on_infix(self, left, token, right):
@@ -180,24 +319,24 @@ class MixfixGen(Expression):
     def isinfix(self):
         return True
 
-    def parse_prefix(self, pop_parser, token):
-        argument = pop_parser.pop_parse(rbp=self.prefix_rbp)
-        if argument.iserror:
-            return argument
+    @property
+    def prefix_operand(self):
+        return self.prefix_rbp
+
+    @property
+    def infix_operand(self):
+        if self.infix_assoc == 'RIGHT':
+            return self.infix_lbp - 1
+        else:  # LEFT or NONASSOC
+            return self.infix_rbp
+
+    def reduce_prefix(self, pop_parser, token, argument):
         return self.on_prefix(token, argument)
 
     def on_prefix(self, token, argument):
         raise NotImplementedError("Abstract method")
 
-    def parse_infix(self, pop_parser, left, token):
-        if self.infix_assoc == 'RIGHT':
-            precedence = self.infix_lbp - 1
-        else:  # LEFT or NONASSOC
-            precedence = self.infix_rbp
-
-        right = pop_parser.pop_parse(rbp=precedence)
-        if right.iserror:
-            return right
+    def reduce_infix(self, pop_parser, left, token, right):
         return self.on_infix(left, token, right)
 
     def on_infix(self, left, token, right):
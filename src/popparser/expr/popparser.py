@@ -6,15 +6,15 @@ Created on 25 august 2012
 '''
 
 from popparser import Parser, ParseError
+from popparser.tokenizer import TOKEN_TYPES
 
 
 class ExprParser(Parser):
     def __init__(self):
         Parser.__init__(self)
         self.expressions = {}
-        self.token = None
-        self.llparser = None
         self.skip_tokens = set()
+        self.__expression_table = None  # built on demand
 
     @property
     def token_type(self):
@@ -22,6 +22,7 @@ class ExprParser(Parser):
 
     def register(self, token_type, expression):
         self.expressions[token_type] = expression
+        self.__expression_table = None
         return self
 
     def unregister(self, expr_type):
@@ -33,11 +34,72 @@ class ExprParser(Parser):
 
         if del_tok_type:
             del self.expressions[del_tok_type]
+            self.__expression_table = None
+
+    @property
+    def expression_table(self):
+        '''The expressions indexed by the type ids of their token types
+        (see `TokenTypes.table`).
+        '''
+        table = self.__expression_table
+        if table is None:
+            table = TOKEN_TYPES.table(self.expressions)
+            self.__expression_table = table
+        return table
+
+    def compile(self, resolve):
+        parsers = Parser.compile(self, resolve)
+        for expression in self.expressions.values():
+            parsers.extend(expression.compile(resolve))
+        return parsers
+
+    def sub_parsers(self):
+        parsers = Parser.sub_parsers(self)
+        for expression in self.expressions.values():
+            parsers.extend(expression.sub_parsers())
+        return parsers
+
+    def analyze_first(self, analysis):
+        first = {token_type for (token_type, expression)
+                 in self.expressions.items() if expression.isprefix}
+        return (False, first | self.skip_tokens)
+
+    def analyze_follow(self, analysis, follow):
+        # an embedded parser may be followed by any (infix) operator
+        follow = follow | set(self.expressions) | self.skip_tokens
+        for expression in self.expressions.values():
+            for parser in expression.sub_parsers():
+                analysis.add_follow(parser, follow)
 
     def skip_token(self, token_type):
         self.skip_tokens.add(token_type)
         return self
 
+    def parsing(self, llparser):
+        '''Return the state of the parser (an `ExprParsing`) for the
+        current parse of `llparser`.
+        '''
+        return llparser.context.state(self, ExprParsing, self, llparser)
+
+    def do_parse(self, llparser):
+        assert llparser is not None
+
+        return self.parsing(llparser).pop_parse(rbp=0)
+
+
+class ExprParsing:
+    '''The state of an `ExprParser` during a parse: it is the parser
+    given to the expressions (e.g. as `pop_parser` in
+    `Expression.parse_prefix`).
+    '''
+    def __init__(self, expr_parser, llparser):
+        self.expr_parser = expr_parser
+        self.llparser = llparser
+        self.expressions = expr_parser.expressions
+        self.expression_table = expr_parser.expression_table
+        self.skip_tokens = expr_parser.skip_tokens
+        self.token = None
+
     def _tokens_skip(self, llparser):
         if not self.skip_tokens:
             return
@@ -50,9 +112,9 @@ class ExprParser(Parser):
 
     def consume_token(self, token_type):
         if self.token.token_type != token_type:
-            return ParseError("Expecting '" + token_type + "' but got '"\
-                              + self.token.token_type + "'",\
-                              self.token.start_pos, self.token.end_pos)
+            return ParseError("Expecting '{0}' but got '{1}'",
+                              self.token.start_pos, self.token.end_pos,
+                              token_type, self.token.token_type)
         self._tokens_skip(self.llparser)
         self.token = self.llparser.next_token()
 
@@ -69,70 +131,76 @@ class ExprParser(Parser):
 
         return None
 
-    def do_parse(self, llparser):
-        assert llparser is not None
-
-        self.llparser = llparser
-
-        return self.pop_parse(rbp=0)
-
-    def pop_parse(self, rbp):
-        err = self._next_token(self.llparser)
-        if err is not None:
-            return err
-
-        if self.token.token_type not in self.expressions:
-            return ParseError("Unexpected token type: "\
-                              + self.token.token_type,
-                              self.token.start_pos, self.token.end_pos)
-
-        expr = self.expressions[self.token.token_type]
-
-        # advance
-        prev_token = self.token
-
-        if expr.isprefix:
-            left = expr.parse_prefix(self, prev_token)
-            if left.iserror or self.llparser.peek_token().iseof:
-                return left
-        elif expr.isinfix:
-            return ParseError("No left operand in expression",
-                              prev_token.start_pos, self.llparser.position)
-
-        # continue, from here we know there is a left operand
-        self._tokens_skip(self.llparser)
-        self.token = self.llparser.next_token()
-        if self.token.iserror:
-            return ParseError(str(self.token.content),
-                              self.llparser.position, self.llparser.position)
-
-        if self.token.token_type not in self.expressions:
-            self.llparser.put_back_token(self.token)
-            return left  # end of expression at left
-
-        next_expr = self.expressions[self.token.token_type]
-
-        right_binding_power = rbp
+    def pop_parse(self, rbp, left=None):
+        '''Parse an expression whose operators bind tighter than `rbp`
+        (starting from its `left` operand, if it is already parsed).
+
+        The operands of the expressions (see `Expression.prefix_operand`
+        and `Expression.infix_operand`) are parsed by the same loop, with
+        a stack of the operators waiting for them: the nesting of the
+        input is not bounded by the recursion limit.
+        '''
+        llparser = self.llparser
+        expression_table = self.expression_table
+        # the operators waiting for their operand: (expression, token,
+        # left operand (None in prefix position), rbp of the operator)
+        operators = []
         while True:
-            prev_token = self.token
-
-            left = next_expr.parse_infix(self, left, prev_token)
-            if self.llparser.peek_token().iseof:
-                return left
-
-            err = self._next_token(self.llparser)
-            if err is not None:
-                return err
-
-            if self.token.token_type not in self.expressions:
-                self.llparser.put_back_token(self.token)
+            if left is None:  # prefix position
+                err = self._next_token(llparser)
+                if err is not None:
+                    left = err
+                else:
+                    token = self.token
+                    try:
+                        expr = expression_table[token.type_id]
+                    except IndexError:  # a token type registered afterwards
+                        expr = None
+                    if expr is None:
+                        left = ParseError("Unexpected token type: {0}",
+                                          token.start_pos, token.end_pos,
+                                          token.token_type)
+                    elif not expr.isprefix:
+                        left = ParseError("No left operand in expression",
+                                          token.start_pos, llparser.position)
+                    elif expr.prefix_operand is not None:
+                        operators.append((expr, token, None, rbp))
+                        rbp = expr.prefix_operand
+                        continue
+                    else:
+                        left = expr.parse_prefix(self, token)
+
+            # infix position
+            while not left.iserror and not llparser.peek_token().iseof:
+                self._tokens_skip(llparser)
+                token = self.token = llparser.next_token()
+                if token.iserror:
+                    left = ParseError(str(token.value),
+                                      llparser.position, llparser.position)
+                    break
+                try:
+                    expr = expression_table[token.type_id]
+                except IndexError:
+                    expr = None
+                if expr is None or not expr.isinfix\
+                   or rbp >= expr.left_binding_power:
+                    llparser.put_back_token(token)
+                    break
+                if expr.infix_operand is not None:
+                    operators.append((expr, token, left, rbp))
+                    rbp = expr.infix_operand
+                    left = None
+                    break
+                left = expr.parse_infix(self, left, token)
+            if left is None:
+                continue
+
+            # the operand is parsed: reduce the operator waiting for it
+            if not operators:
                 return left
-
-            next_expr = self.expressions[self.token.token_type]
-
-            if (not next_expr.isinfix)\
-               or right_binding_power >= next_expr.left_binding_power:
-                self.llparser.put_back_token(self.token)
-                return left
-
-        # (never) ending while
+            (expr, token, operand, rbp) = operators.pop()
+            if not left.iserror:
+                if operand is None:
+                    left = expr.reduce_prefix(self, token, left)
+                else:
+                    left = expr.reduce_infix(self, operand, token, left)
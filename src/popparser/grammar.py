@@ -5,15 +5,25 @@ Created on 24 août 2012
 @author: F. Peschanski
 '''
 
+import threading
+
 from popparser import ParseException, Parser
+from popparser.analysis import GrammarAnalysis
+from popparser.tokenizer import TOKEN_TYPES
 
 
 class Grammar:
     def __init__(self):
         self.__rules = {}  # dict[str,parser]
+        self.__compiled = False
+        self.__analysis = None
+        self.__lock = threading.Lock()  # the grammar is compiled once
 
     def register(self, rule_name, parser):
         assert isinstance(parser, Parser)
+        if self.__compiled:
+            raise ParseException("Cannot register rule '{0}' in a "
+                                 "compiled grammar".format(rule_name))
         self.__rules[rule_name] = parser
 
     def fetch(self, rule_name):
@@ -30,7 +40,78 @@ class Grammar:
 
     @entry.setter
     def entry(self, parser):
-        self.__rules['init'] = parser
+        self.register('init', parser)
+
+    @property
+    def rules(self):
+        '''The rules of the grammar (a read-only view).'''
+        return self.__rules.copy()
+
+    @property
+    def compiled(self):
+        return self.__compiled
+
+    @property
+    def token_types(self):
+        '''The registry of the token types (see `TokenTypes`), shared
+        with the tokenizers.
+        '''
+        return TOKEN_TYPES
+
+    @property
+    def analysis(self):
+        '''The FIRST/FOLLOW analysis of the grammar, once compiled.'''
+        return self.__analysis
+
+    def resolve(self, parser):
+        '''Return the parser referenced by `parser`, skipping the
+        (plain) references to rules.
+        '''
+        rule_names = []
+        while isinstance(parser, RefParser) and parser.isplain:
+            if parser.rule_name in rule_names:
+                raise ParseException("Cyclic rule reference: "
+                                     + " -> ".join(rule_names
+                                                   + [parser.rule_name]))
+            rule_names.append(parser.rule_name)
+            target = self.fetch(parser.rule_name)
+            if target is None:
+                raise ParseException("No such rule in grammar: "
+                                     + parser.rule_name)
+            parser = target
+        return parser
+
+    def compile(self, strict=False):
+        '''Compile the grammar, ahead of any parse: all the references
+        to rules are checked and (unless they transform their result)
+        replaced by the referenced parsers, then the grammar is analyzed
+        (see `popparser.analysis`) and the prediction tables of the
+        parsers are built, indexed by the type ids of the tokens.  In
+        `strict` mode, the LL(1) conflicts of the grammar are errors.
+
+        The grammar is immutable afterwards.  Return the grammar.
+        '''
+        with self.__lock:
+            if self.__compiled:
+                return self
+            self.__rules = {rule_name: self.resolve(parser)
+                            for (rule_name, parser) in self.__rules.items()}
+            compiled = set()  # the ids of the compiled parsers
+            parsers = list(self.__rules.values())
+            while parsers:
+                parser = parsers.pop()
+                if id(parser) not in compiled:
+                    compiled.add(id(parser))
+                    parsers.extend(parser.compile(self.resolve))
+            analysis = GrammarAnalysis(self)
+            if strict and analysis.conflicts:
+                raise ParseException("LL(1) conflicts in grammar:\n"
+                                     + "\n".join(analysis.conflicts))
+            for parser in analysis.parsers:
+                parser.predict(analysis)
+            self.__analysis = analysis
+            self.__compiled = True
+        return self
 
     def __str(self):
         msg = 'Grammar:\n'
@@ -44,17 +125,56 @@ class RefParser(Parser):
         Parser.__init__(self)
         self.grammar = grammar
         self.rule_name = rule_name
+        self.__parser = None  # the referenced parser, once compiled
+
+    @property
+    def isplain(self):
+        '''True if the reference can be replaced by the referenced parser,
+        i.e. it neither transforms nor forgets anything.
+        '''
+        return self.xform_result is None and self.xform_content is None\
+            and not self.forget_parsers
 
     @property
     def token_type(self):
-        parser = self.grammar.fetch(self.rule_name)
+        parser = self.__parser or self.grammar.fetch(self.rule_name)
         if parser is None:
             return None
         else:
             return parser.token_type
 
+    def compile(self, resolve):
+        parsers = Parser.compile(self, resolve)
+        self.__parser = resolve(RefParser(self.grammar, self.rule_name))
+        return parsers + [self.__parser]
+
+    def __target(self):
+        return self.__parser or self.grammar.fetch(self.rule_name)
+
+    @property
+    def target(self):
+        '''The referenced parser (or None if there is no such rule).'''
+        return self.__target()
+
+    def sub_parsers(self):
+        parser = self.__target()
+        if parser is None:
+            return Parser.sub_parsers(self)
+        return Parser.sub_parsers(self) + [parser]
+
+    def analyze_first(self, analysis):
+        parser = self.__target()
+        if parser is None:
+            return (False, {None})
+        return (analysis.nullable(parser), analysis.first(parser))
+
+    def analyze_follow(self, analysis, follow):
+        parser = self.__target()
+        if parser is not None:
+            analysis.add_follow(parser, follow)
+
     def do_parse(self, llparser):
-        parser = self.grammar.fetch(self.rule_name)
+        parser = self.__parser or self.grammar.fetch(self.rule_name)
         if parser is None:
             raise ParseException("No such rule in grammar: " + self.rule_name)
         return parser.parse(llparser)
@@ -5,15 +5,96 @@ Created on 7 august 2012
 @author: F. Peschanski
 '''
 
+from bisect import bisect_left
+from collections import OrderedDict
+
 from popparser.debug import ParseDebug
 
 
 class LLParsing:
-    def __init__(self, grammar, debug_mode=False):
+    # number of slots of the lookahead ring buffer
+    LOOKAHEAD_SIZE = 8
+    # default capacity (number of entries) of the packrat memo
+    MEMO_SIZE = 4096
+
+    def __init__(self, grammar, debug_mode=False, memo=False,
+                 memo_size=MEMO_SIZE):
         self.__grammar = grammar
         self.__debug_mode = debug_mode
+        self.__memo_mode = memo
+        self.__memo_size = memo_size
+        # the rule parsers memoized by the current parse (None if the
+        # memo mode is off), checked by `Parser.parse`
+        self.memo_rules = None
+        self.__memo = None
         self.__debug = None
         self.__tokenizer = None
+        self.__lookahead = None
+        self.__pushback = None
+        self.__empty = None  # the last empty result
+        self.__context = None
+        self.reset_lookahead()
+
+    def reset_lookahead(self):
+        '''Forget the buffered lookahead and put back tokens, and the
+        furthest failure (e.g. for a new input).
+        '''
+        self.__failure_offset = -1
+        self.__failure_expected = set()
+        self.__pushback = []  # stack of put back tokens
+        self.__speculation = 0  # depth of the speculative parses
+        # ring buffer of (offset, token, end mark) keyed by offset
+        self.__lookahead = [None] * LLParsing.LOOKAHEAD_SIZE
+        self.__lookahead_hits = 0
+        self.__lookahead_misses = 0
+        # LRU memo of (rule parser, offset) -> (result, end mark, pushback)
+        self.__memo = OrderedDict()
+        self.__memo_cut = 0  # the offset before which the memo is discarded
+        self.__memo_hits = 0
+        self.__memo_misses = 0
+        self.__memo_evictions = 0
+        self.__context = ParseContext()
+
+    @property
+    def lookahead_hits(self):
+        '''Number of tokens served from the lookahead buffer.'''
+        return self.__lookahead_hits
+
+    @property
+    def lookahead_misses(self):
+        '''Number of tokens that had to be recognized by the tokenizer.'''
+        return self.__lookahead_misses
+
+    @property
+    def memo_mode(self):
+        '''True if the results of the grammar rules are memoized.'''
+        return self.__memo_mode
+
+    @property
+    def memo_hits(self):
+        '''Number of rule results replayed from the memo.'''
+        return self.__memo_hits
+
+    @property
+    def memo_misses(self):
+        '''Number of rule results that had to be parsed (in memo mode).'''
+        return self.__memo_misses
+
+    @property
+    def memo_evictions(self):
+        '''Number of memo entries evicted to respect the memo size.'''
+        return self.__memo_evictions
+
+    @property
+    def memo_entries(self):
+        '''Number of entries in the memo.'''
+        return len(self.__memo)
+
+    @property
+    def context(self):
+        '''The state of the parsers for the current parse (the parsers
+        of a grammar are shared, e.g. between threads).'''
+        return self.__context
 
     @property
     def debug_mode(self):
@@ -34,6 +115,7 @@ class LLParsing:
     @tokenizer.setter
     def tokenizer(self, ntokenizer):
         self.__tokenizer = ntokenizer
+        self.reset_lookahead()
 
     @property
     def grammar(self):
@@ -41,24 +123,169 @@ class LLParsing:
 
     @property
     def position(self):
+        if self.__pushback:
+            return self.__pushback[-1].start_pos
         return self.__tokenizer.position
 
+    def _lookahead(self, offset):
+        entry = self.__lookahead[offset % LLParsing.LOOKAHEAD_SIZE]
+        if entry is not None and entry[0] == offset:
+            self.__lookahead_hits += 1
+            return entry
+        self.__lookahead_misses += 1
+        return None
+
+    def _recognize(self, offset):
+        tokenizer = self.__tokenizer
+        token = tokenizer.next()
+        entry = (offset, token, tokenizer.mark())
+        self.__lookahead[offset % LLParsing.LOOKAHEAD_SIZE] = entry
+        return entry
+
     def peek_token(self):
         assert(self.__tokenizer)
-        token = self.__tokenizer.peek()
+        if self.__pushback:
+            token = self.__pushback[-1]
+        else:
+            tokenizer = self.__tokenizer
+            offset = tokenizer.offset
+            entry = self._lookahead(offset)
+            if entry is None:
+                mark = tokenizer.mark()
+                entry = self._recognize(offset)
+                tokenizer.restore(mark)
+            token = entry[1]
         if self.__debug_mode:
             self.__debug.peek_token(self, token)
         return token
 
     def next_token(self):
         assert(self.__tokenizer)
-        token = self.__tokenizer.next()
+        if self.__pushback:
+            token = self.__pushback.pop()
+        else:
+            tokenizer = self.__tokenizer
+            offset = tokenizer.offset
+            entry = self._lookahead(offset)
+            if entry is None:
+                entry = self._recognize(offset)
+            else:
+                tokenizer.restore(entry[2])
+            token = entry[1]
         if self.__debug_mode:
             self.__debug.next_token(self, token)
         return token
 
     def put_back_token(self, token):
-        self.__tokenizer.put_back(token)
+        '''Put back `token` so that it is the next one to be read.
+
+        The token is stacked and the tokenizer cursor does not move.
+        '''
+        self.__pushback.append(token)
+
+    def expect(self, offset, expected):
+        '''Record a failure at `offset`, expecting one of the `expected`
+        token types: the expected types are aggregated at the furthest
+        failure offset.
+        '''
+        if offset > self.__failure_offset:
+            self.__failure_offset = offset
+            self.__failure_expected = set(expected)
+        elif offset == self.__failure_offset:
+            self.__failure_expected.update(expected)
+
+    @property
+    def furthest_failure(self):
+        '''The (offset, expected token types) of the furthest failure,
+        or None.
+        '''
+        if self.__failure_offset < 0:
+            return None
+        return (self.__failure_offset, frozenset(self.__failure_expected))
+
+    def empty_result(self, start_pos):
+        '''Return an empty result, from `start_pos` to the current
+        position.
+
+        The result is shared, thus immutable (see `EmptyResult`):
+        successive empty results at the same positions are the same
+        object.
+        '''
+        end_pos = self.position
+        empty = self.__empty
+        if empty is None or empty.start_pos is not start_pos\
+           or empty.end_pos is not end_pos:
+            empty = EmptyResult(start_pos, end_pos)
+            self.__empty = empty
+        return empty
+
+    @property
+    def speculation(self):
+        '''The depth of the speculative parses (0 if none).'''
+        return self.__speculation
+
+    def speculate(self):
+        '''Start a speculative parse, that may be rolled back: return the
+        checkpoint to give back to `end_speculation`.
+
+        The commits are ignored until the (outermost) speculation ends.
+        '''
+        self.__speculation += 1
+        return (self.__tokenizer.mark(), tuple(self.__pushback))
+
+    def end_speculation(self, mark, rollback=False):
+        '''End the speculative parse started at checkpoint `mark`, and
+        roll the parse back to the checkpoint if `rollback` is True.
+        '''
+        self.__speculation -= 1
+        if rollback:
+            (tokenizer_mark, pushback) = mark
+            self.__tokenizer.restore(tokenizer_mark)
+            self.__pushback[:] = pushback
+
+    def commit(self):
+        '''Commit the parse up to the tokenizer cursor, that will not be
+        rewound before it: a streaming input may release what precedes.
+        Nothing is committed during a speculative parse.
+        '''
+        if self.__speculation:
+            return
+        tokenizer = self.__tokenizer
+        mark = tokenizer.mark()
+        tokenizer.commit(mark)
+        memo = self.__memo
+        if memo:
+            # the entries before the mark are never replayed, those at
+            # the LRU end are dropped right away, the others are evicted
+            self.__memo_cut = mark
+            while memo and next(iter(memo))[1] < mark:
+                memo.popitem(last=False)
+
+    def memo_parse(self, parser):
+        '''Parse the grammar rule `parser`, or replay the result of a
+        previous parse of the rule at the same offset.
+        '''
+        if self.__pushback:  # the position is not the tokenizer offset
+            return parser.parse_rule(self)
+        tokenizer = self.__tokenizer
+        key = (parser, tokenizer.offset)
+        memo = self.__memo
+        entry = memo.get(key)
+        if entry is not None:
+            self.__memo_hits += 1
+            memo.move_to_end(key)
+            (result, end_mark, pushback) = entry
+            tokenizer.restore(end_mark)
+            self.__pushback.extend(pushback)
+            return result
+        self.__memo_misses += 1
+        result = parser.parse_rule(self)
+        if key[1] >= self.__memo_cut:
+            memo[key] = (result, tokenizer.mark(), tuple(self.__pushback))
+            if len(memo) > self.__memo_size:
+                memo.popitem(last=False)
+                self.__memo_evictions += 1
+        return result
 
     def parse(self):
         if not self.__tokenizer:
@@ -71,16 +298,45 @@ class LLParsing:
             raise AttributeError("No start parser in grammar")
 
         self.__debug = ParseDebug()
+        self.reset_lookahead()
+        if self.__memo_mode:
+            self.memo_rules = frozenset(self.__grammar.rules.values())
 
-        result = start_parser.parse(self)
+        result = self.parse_entry(start_parser)
 
         return result
 
+    def parse_entry(self, start_parser):
+        '''Parse the input with the entry parser of the grammar.'''
+        return start_parser.parse(self)
+
     def __repr__(self):
         return "<LLParsing:" + str(self.__tokenizer)
 
 
+class ParseContext:
+    '''The per-parse states of the parsers (and expressions) of a
+    grammar, keyed by their owner.
+    '''
+    __slots__ = ('__states',)
+
+    def __init__(self):
+        self.__states = {}
+
+    def state(self, owner, factory, *args):
+        '''Return the state of `owner`, created by `factory(*args)` the
+        first time it is needed.
+        '''
+        state = self.__states.get(owner)
+        if state is None:
+            state = factory(*args)
+            self.__states[owner] = state
+        return state
+
+
 class ParseResult:
+    __slots__ = ('content', 'start_pos', 'end_pos')
+
     def __init__(self, content, start_pos, end_pos):
         self.content = content
         self.start_pos = start_pos
@@ -100,9 +356,74 @@ class ParseResult:
                     repr(self.end_pos))
 
 
+class EmptyResult(ParseResult):
+    '''An empty result (without content), shared by the parsers (see
+    `LLParsing.empty_result`): it cannot be modified, a transformation
+    returns a new result instead.
+    '''
+    __slots__ = ()
+
+    def __init__(self, start_pos, end_pos):
+        object.__setattr__(self, 'content', None)
+        object.__setattr__(self, 'start_pos', start_pos)
+        object.__setattr__(self, 'end_pos', end_pos)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("An empty result is shared: it cannot be"
+                             " modified")
+
+    def __delattr__(self, name):
+        raise AttributeError("An empty result is shared: it cannot be"
+                             " modified")
+
+
+# error codes, i.e. the formats of the error messages
+EXPECTING_TOKEN = "Expecting '{0}' token"
+UNEXPECTED_TOKEN = "Unexpected token type '{0}' expecting: {expected}"
+EXPECTING_OPEN = "Expecting open list token '{0}' got: {1}"
+EXPECTING_CLOSE = "Expecting close list token '{0}' got: {1}"
+NOT_ENOUGH_REPETITIONS = "{0} repetition(s) is not enough (minimum={1})"
+NOT_ENOUGH_ELEMENTS = "{0} element(s) is not enough (minimum={1})"
+
+
+def explain_token_types(token_types):
+    return ", or ".join("'" + str(token_type) + "'"
+                        for token_type in token_types)
+
+
 class ParseError(ParseResult):
-    def __init__(self, msg, start_pos, end_pos):
-        ParseResult.__init__(self, msg, start_pos, end_pos)
+    '''A parse error, whose message `msg` (the error code) is only
+    formatted, with the `args` and the `expected` token types, when the
+    content of the error is accessed: most errors are discarded by the
+    parsers trying alternatives.  The formatted message is kept.
+    '''
+    __slots__ = ('code', 'args', 'expected', '__message')
+
+    def __init__(self, msg, start_pos, end_pos, *args, expected=None):
+        self.start_pos = start_pos
+        self.end_pos = end_pos
+        self.code = msg
+        self.args = args
+        self.expected = expected
+
+    @property
+    def content(self):
+        try:
+            return self.__message
+        except AttributeError:  # not formatted yet
+            pass
+        if not self.args and self.expected is None:
+            message = self.code
+        else:
+            expected = None if self.expected is None\
+                else explain_token_types(self.expected)
+            message = self.code.format(*self.args, expected=expected)
+        self.__message = message
+        return message
+
+    @content.setter
+    def content(self, content):
+        self.__message = content
 
     @property
     def iserror(self):
@@ -118,11 +439,67 @@ class ParseError(ParseResult):
                     repr(self.end_pos))
 
 
+class LineIndex:
+    '''The sorted offsets of the newline characters of an input,
+    used to turn an offset into a line/char position.
+    '''
+    def __init__(self, newlines=None):
+        self.newlines = newlines if newlines is not None else []
+
+    @staticmethod
+    def from_string(string):
+        newlines = []
+        offset = string.find('\n')
+        while offset != -1:
+            newlines.append(offset)
+            offset = string.find('\n', offset + 1)
+        return LineIndex(newlines)
+
+    def locate(self, offset):
+        '''Return the (line_pos, char_pos) pair of `offset`.'''
+        line = bisect_left(self.newlines, offset)
+        if line == 0:
+            return (1, offset + 1)
+        return (line + 1, offset - self.newlines[line - 1])
+
+
 class ParsePosition:
-    def __init__(self, offset=0, line_pos=1, char_pos=1):
+    '''A position in the input.
+
+    The line and char positions are either given explicitly or computed
+    lazily, from the offset and the line `index` of the input, the
+    first time they are needed.
+    '''
+    __slots__ = ('offset', '__line_pos', '__char_pos', '__index')
+
+    def __init__(self, offset=0, line_pos=1, char_pos=1, index=None):
         self.offset = offset
-        self.line_pos = line_pos
-        self.char_pos = char_pos
+        self.__index = index
+        if index is None:
+            self.__line_pos = line_pos
+            self.__char_pos = char_pos
+        else:
+            self.__line_pos = None
+            self.__char_pos = None
+
+    def __locate(self):
+        self.__line_pos, self.__char_pos = self.__index.locate(self.offset)
+
+    @property
+    def line_pos(self):
+        if self.__line_pos is None:
+            self.__locate()
+        return self.__line_pos
+
+    @property
+    def char_pos(self):
+        if self.__char_pos is None:
+            self.__locate()
+        return self.__char_pos
+
+    @property
+    def index(self):
+        return self.__index
 
     def next_line(self):
         return ParsePosition(self.offset + 1, self.line_pos + 1, 1)
@@ -6,8 +6,23 @@ Created on 7 august 2012
 '''
 
 from collections import defaultdict
+import threading
 
-from popparser.llparser import ParseResult, ParseError
+from popparser.analysis import GrammarAnalysis
+
+from popparser.llparser import ParseResult, ParseError, EXPECTING_TOKEN,\
+    UNEXPECTED_TOKEN, EXPECTING_OPEN, EXPECTING_CLOSE,\
+    NOT_ENOUGH_REPETITIONS, NOT_ENOUGH_ELEMENTS, explain_token_types
+from popparser.tokenizer import TOKEN_TYPES
+
+# the tables built on demand (e.g. by a choice outside of a compiled
+# grammar) are built by one thread at a time
+_build_lock = threading.Lock()
+
+
+def _type_id(token_type):
+    '''The type id of `token_type` (see `TokenTypes`), or None.'''
+    return None if token_type is None else TOKEN_TYPES.intern(token_type)
 
 
 #==============================================================================
@@ -31,16 +46,26 @@ class Parser:
         self.xform_result = None
         self.xform_content = None
         self.forget_parsers = {}
+        self.__forget_table = None  # indexed by type id, built on demand
 
     def forget(self, parser):
         self.forget_parsers[parser.token_type] = parser
+        self.__forget_table = None
         return self
 
     def forget_parse(self, llparsing):
+        if not self.forget_parsers:
+            return None
+        forget_table = self.__forget_table
+        if forget_table is None:
+            forget_table = TOKEN_TYPES.table(self.forget_parsers)
+            self.__forget_table = forget_table
         while True:
-            next_token = llparsing.peek_token()
-            if next_token.token_type in self.forget_parsers:
-                forget_parser = self.forget_parsers[next_token.token_type]
+            try:
+                forget_parser = forget_table[llparsing.peek_token().type_id]
+            except IndexError:  # a token type registered afterwards
+                forget_parser = None
+            if forget_parser is not None:
                 result = forget_parser.parse(llparsing)
                 if result.iserror:
                     return result # ?
@@ -51,19 +76,72 @@ class Parser:
     def token_type(self):
         raise NotImplementedError("Abstract method")
 
+    def compile(self, resolve):
+        '''Prepare the parser for a compiled grammar: the sub-parsers are
+        replaced by `resolve(sub_parser)`, that skips the references to
+        rules, and the dispatch tables are built.
+
+        Return the list of the (resolved) sub-parsers.
+        '''
+        self.forget_parsers = {token_type: resolve(parser)
+                               for (token_type, parser)
+                               in self.forget_parsers.items()}
+        self.__forget_table = None
+        return list(self.forget_parsers.values())
+
+    #  grammar analysis (see popparser.analysis)
+
+    def sub_parsers(self):
+        '''Return the list of the sub-parsers.'''
+        return list(self.forget_parsers.values())
+
+    def analyze_first(self, analysis):
+        '''Return the pair (nullable, FIRST set) of the parser, given the
+        current `analysis` of its sub-parsers (the token types skipped by
+        the forget parsers are kept apart by the analysis, see
+        `GrammarAnalysis.lead`).
+        '''
+        token_type = self.token_type
+        if isinstance(token_type, str):
+            return (False, {token_type})
+        return (False, {None})
+
+    def analyze_follow(self, analysis, follow):
+        '''Propagate the `follow` set of the parser to its sub-parsers.'''
+        pass
+
+    def analyze_conflicts(self, analysis):
+        '''Return the LL(1) conflicts (messages) of the parser.'''
+        return []
+
+    def predict(self, analysis):
+        '''Build the prediction tables of the parser, from the
+        `analysis` of its (compiled) grammar.
+        '''
+        pass
+
     def parse(self, llparsing):
+        memo_rules = llparsing.memo_rules
+        if memo_rules is not None and self in memo_rules:
+            return llparsing.memo_parse(self)
+        return self.parse_rule(llparsing)
+
+    def parse_rule(self, llparsing):
+        '''Parse, bypassing the memo (see `LLParsing.memo_parse`).'''
         if llparsing.debug_mode:
             llparsing.debug.enter(llparsing, self)
 
-        result = self.forget_parse(llparsing)
-        if result is not None and result.iserror:
-            return result
+        if self.forget_parsers:
+            result = self.forget_parse(llparsing)
+            if result is not None and result.iserror:
+                return result
 
         result = self.do_parse(llparsing)
 
-        fresult = self.forget_parse(llparsing)
-        if fresult is not None and fresult.iserror:
-            return fresult
+        if self.forget_parsers:
+            fresult = self.forget_parse(llparsing)
+            if fresult is not None and fresult.iserror:
+                return fresult
 
         if llparsing.debug_mode:
             llparsing.debug.leave(llparsing, self)
@@ -91,21 +169,27 @@ class Token(Parser):
     def __init__(self, token_type):
         Parser.__init__(self)
         self.__token_type = token_type
+        self.__type_id = TOKEN_TYPES.intern(token_type)
+        self.__expected = (token_type,)
 
     @property
     def token_type(self):
         return self.__token_type
 
+    @property
+    def type_id(self):
+        return self.__type_id
+
     def do_parse(self, llparsing):
         start_pos = llparsing.position
         token = llparsing.peek_token()
-        if token.token_type == self.__token_type:
+        if token.type_id == self.__type_id:
             return ParseResult(llparsing.next_token(),
                                start_pos, llparsing.position)
         else:
-            return ParseError("Expecting '{0}' token"\
-                              .format(self.__token_type),
-                              start_pos, llparsing.position)
+            llparsing.expect(token.start, self.__expected)
+            return ParseError(EXPECTING_TOKEN, start_pos, llparsing.position,
+                              self.__token_type, expected=self.__expected)
 
 
 class EOF(Token):
@@ -126,9 +210,12 @@ class Tuple(Parser):
         Parser.__init__(self)
         self.__parsers = []
         self.__skips = defaultdict()
+        # List[(List[Parser],Parser)] the skips before each element
+        self.__schedule = None
 
     def element(self, parser):
         self.__parsers.append(parser)
+        self.__schedule = None
         return self  # chaining API
 
     def skip(self, parser):
@@ -136,8 +223,52 @@ class Tuple(Parser):
             self.__skips[len(self.__parsers)] = []
         skips = self.__skips[len(self.__parsers)]
         skips.append(parser)
+        self.__schedule = None
         return self
 
+    def _build_schedule(self):
+        self.__schedule = [(self.__skips.get(i, []), parser)
+                           for (i, parser) in enumerate(self.__parsers)]
+        return self.__schedule
+
+    def compile(self, resolve):
+        parsers = Parser.compile(self, resolve)
+        self.__parsers = [resolve(parser) for parser in self.__parsers]
+        for skips in self.__skips.values():
+            skips[:] = [resolve(skip) for skip in skips]
+        parsers.extend(self.__parsers)
+        parsers.extend(skip for skips in self.__skips.values()
+                       for skip in skips)
+        self._build_schedule()
+        return parsers
+
+    @property
+    def elements(self):
+        '''The list of the (skips, element) pairs of the tuple.'''
+        return list(self.__schedule or self._build_schedule())
+
+    @property
+    def last_skips(self):
+        '''The skip parsers after the last element.'''
+        return list(self.__skips.get(len(self.__parsers), []))
+
+    def __sequence(self):
+        sequence = []
+        for (i, parser) in enumerate(self.__parsers):
+            sequence.extend(self.__skips.get(i, []))
+            sequence.append(parser)
+        sequence.extend(self.__skips.get(len(self.__parsers), []))
+        return sequence
+
+    def sub_parsers(self):
+        return Parser.sub_parsers(self) + self.__sequence()
+
+    def analyze_first(self, analysis):
+        return analysis.sequence_first(self.__sequence())
+
+    def analyze_follow(self, analysis, follow):
+        analysis.sequence_follow(self.__sequence(), follow)
+
     @property
     def token_type(self):
         if 0 in self.__skips:
@@ -152,23 +283,21 @@ class Tuple(Parser):
     def do_parse(self, llparser):
         start_pos = llparser.position
         results = []
-        for i in range(len(self.__parsers)):
+        schedule = self.__schedule
+        if schedule is None:
+            schedule = self._build_schedule()
+        for (skips, parser) in schedule:
             # forget parsers
             result = self.forget_parse(llparser)
             if result is not None and result.iserror:
                 return result
 
             # skip parsers
-            skips = None
-            if i in self.__skips:
-                skips = self.__skips[i]
-            if skips:
-                for skip in skips:
-                    result = skip.parse(llparser)
-                    if result.iserror:
-                        return result
+            for skip in skips:
+                result = skip.parse(llparser)
+                if result.iserror:
+                    return result
             # element
-            parser = self.__parsers[i]
             result = parser.parse(llparser)
             if result.iserror:
                 return result
@@ -196,16 +325,53 @@ class Tuple(Parser):
 
 class Repeat(Parser):
     '''Repeat parser.
+
+    A repetition declared as a `commit` point (e.g. the top-level
+    repetition of a streamed input) commits the parse after each element
+    (see `LLParsing.commit`): the positions in the committed input may
+    no longer be located, they should be read by the transformations of
+    the elements.
     '''
-    def __init__(self, parser, minimum=0):
+    def __init__(self, parser, minimum=0, commit=False):
         Parser.__init__(self)
         self.minimum = minimum
         self.parser = parser
+        self.commit = commit
+        self.__first = None  # the predicted token types, once compiled
 
     @property
     def token_type(self):
         return self.parser.token_type
 
+    def compile(self, resolve):
+        parsers = Parser.compile(self, resolve)
+        self.parser = resolve(self.parser)
+        return parsers + [self.parser]
+
+    def sub_parsers(self):
+        return Parser.sub_parsers(self) + [self.parser]
+
+    def analyze_first(self, analysis):
+        return (self.minimum == 0 or analysis.nullable(self.parser),
+                analysis.first(self.parser))
+
+    def analyze_follow(self, analysis, follow):
+        analysis.add_follow(self.parser, analysis.first(self.parser) | follow)
+
+    def analyze_conflicts(self, analysis):
+        return analysis.first_conflict(self.parser, analysis.follow(self),
+                                       "FIRST/FOLLOW")
+
+    def predict(self, analysis):
+        self.__first = analysis.predict_set(self.parser)
+
+    @property
+    def prediction(self):
+        '''The token types that can start an element (once compiled), or
+        None if the element must be attempted.
+        '''
+        return self.__first
+
     def do_parse(self, llparser):
         start_pos = llparser.position
         count = 0
@@ -216,20 +382,28 @@ class Repeat(Parser):
             if result is not None and result.iserror:
                 return result
 
-            result = self.parser.parse(llparser)
-            if result.iserror:
+            result = None  # no more element, unless predicted
+            if self.__first is not None:
+                token = llparser.peek_token()
+                if token.token_type not in self.__first:
+                    llparser.expect(token.start, self.__first)
+                else:
+                    result = self.parser.parse(llparser)
+            else:
+                result = self.parser.parse(llparser)
+            if result is None or result.iserror:
                 if count == 0 and self.minimum == 0:
-                    return ParseResult(None, start_pos, llparser.position)
+                    return llparser.empty_result(start_pos)
                 elif 0 < count < self.minimum:
-                    return ParseError('{0} repetition(s) is not enough '
-                                      '(minimum={1})'\
-                                      .format(count, self.minimum),\
-                                      start_pos,\
-                                      llparser.position)
+                    return ParseError(NOT_ENOUGH_REPETITIONS, start_pos,
+                                      llparser.position, count, self.minimum)
                     # TODO: stacking errors ?
                 else:
                     return ParseResult(results, start_pos, llparser.position)
             results.append(result)
+            if self.commit:
+                # the element is parsed, the input is no longer needed
+                llparser.commit()
 
 
 #==============================================================================
@@ -246,6 +420,36 @@ class List(Parser):
         self.close_token = close
         self.sep_token = sep
         self.parser = of
+        self.__first = None  # the predicted token types, once compiled
+
+    # the delimiters are compared by type id
+
+    @property
+    def open_token(self):
+        return self.__open_token
+
+    @open_token.setter
+    def open_token(self, token_type):
+        self.__open_token = token_type
+        self.__open_id = _type_id(token_type)
+
+    @property
+    def close_token(self):
+        return self.__close_token
+
+    @close_token.setter
+    def close_token(self, token_type):
+        self.__close_token = token_type
+        self.__close_id = _type_id(token_type)
+
+    @property
+    def sep_token(self):
+        return self.__sep_token
+
+    @sep_token.setter
+    def sep_token(self, token_type):
+        self.__sep_token = token_type
+        self.__sep_id = _type_id(token_type)
 
     @property
     def token_type(self):
@@ -254,17 +458,68 @@ class List(Parser):
         else:
             return self.open_token
 
+    def compile(self, resolve):
+        parsers = Parser.compile(self, resolve)
+        self.parser = resolve(self.parser)
+        return parsers + [self.parser]
+
+    def sub_parsers(self):
+        return Parser.sub_parsers(self) + [self.parser]
+
+    def __element_follow(self, analysis):
+        if self.sep_token is not None:
+            follow = {self.sep_token}
+        else:
+            follow = set(analysis.first(self.parser))
+        if self.close_token is not None:
+            follow.add(self.close_token)
+        else:
+            follow.update(analysis.follow(self))
+        return follow
+
+    def analyze_first(self, analysis):
+        if self.open_token is not None:
+            return (False, {self.open_token})
+        return (self.minimum == 0 or analysis.nullable(self.parser),
+                analysis.first(self.parser))
+
+    def analyze_follow(self, analysis, follow):
+        analysis.add_follow(self.parser, self.__element_follow(analysis))
+
+    def analyze_conflicts(self, analysis):
+        if self.close_token is not None:
+            end = {self.close_token}
+        else:
+            end = analysis.follow(self)
+        if self.sep_token is None:
+            return analysis.first_conflict(self.parser, end, "FIRST/FOLLOW")
+        elif self.sep_token in end:
+            return ["FIRST/FOLLOW conflict on {0} in: {1}".format(
+                repr(self.sep_token), self)]
+        return []
+
+    def predict(self, analysis):
+        self.__first = analysis.predict_set(self.parser)
+
+    @property
+    def prediction(self):
+        '''The token types that can start an element (once compiled), or
+        None if the element must be attempted.
+        '''
+        return self.__first
+
     def do_parse(self, llparser):
         start_pos = llparser.position
         count = 0
         results = []
-        if self.open_token is not None:
+        if self.__open_id is not None:
             next_token = llparser.peek_token()
-            if next_token.token_type != self.open_token:
-                return ParseError("Expecting open list token '{0}' got: {1}"\
-                        .format(self.open_token, next_token.token_type),
-                        next_token.start_pos,
-                        next_token.end_pos)
+            if next_token.type_id != self.__open_id:
+                llparser.expect(next_token.start, (self.open_token,))
+                return ParseError(EXPECTING_OPEN, next_token.start_pos,
+                                  next_token.end_pos, self.open_token,
+                                  next_token.token_type,
+                                  expected=(self.open_token,))
             llparser.next_token()
         while True:
             # forget parsers
@@ -272,6 +527,11 @@ class List(Parser):
             if result is not None and result.iserror:
                 return result
 
+            if self.__first is not None:
+                token = llparser.peek_token()
+                if token.token_type not in self.__first:
+                    llparser.expect(token.start, self.__first)
+                    break
             result = self.parser.parse(llparser)
             if result.iserror:
                 break
@@ -285,31 +545,28 @@ class List(Parser):
                 return result
 
             # separator
-            if self.sep_token is not None:
+            if self.__sep_id is not None:
                 next_token = llparser.peek_token()
-                if next_token.token_type != self.sep_token:
+                if next_token.type_id != self.__sep_id:
                     break
                 llparser.next_token()
         # end of loop
-        if self.close_token is not None: 
+        if self.__close_id is not None:
             next_token = llparser.peek_token()
-            if next_token.token_type != self.close_token:
-                return ParseError("Expecting close list token "
-                                              "'{0}' got: {1}"\
-                        .format(self.close_token, next_token.token_type),
-                        next_token.start_pos,
-                        next_token.end_pos)
+            if next_token.type_id != self.__close_id:
+                llparser.expect(next_token.start, (self.close_token,))
+                return ParseError(EXPECTING_CLOSE, next_token.start_pos,
+                                  next_token.end_pos, self.close_token,
+                                  next_token.token_type,
+                                  expected=(self.close_token,))
 
             llparser.next_token()
 
         if count == 0 and self.minimum == 0:
-            return ParseResult(None, start_pos, llparser.position)
+            return llparser.empty_result(start_pos)
         elif 0 < count < self.minimum:
-            return ParseError('{0} element(s) is not enough '
-                                  '(minimum={1})'\
-                                  .format(count, self.minimum),\
-                                  start_pos,\
-                                  llparser.position)
+            return ParseError(NOT_ENOUGH_ELEMENTS, start_pos,
+                              llparser.position, count, self.minimum)
 
         return ParseResult(results, start_pos, llparser.position)
 
@@ -323,16 +580,50 @@ class Optional(Parser):
     def __init__(self, parser):
         Parser.__init__(self)
         self.parser = parser
+        self.__first = None  # the predicted token types, once compiled
 
     @property
     def token_type(self):
         return self.parser.token_type
 
+    def compile(self, resolve):
+        parsers = Parser.compile(self, resolve)
+        self.parser = resolve(self.parser)
+        return parsers + [self.parser]
+
+    def sub_parsers(self):
+        return Parser.sub_parsers(self) + [self.parser]
+
+    def analyze_first(self, analysis):
+        return (True, analysis.first(self.parser))
+
+    def analyze_follow(self, analysis, follow):
+        analysis.add_follow(self.parser, follow)
+
+    def analyze_conflicts(self, analysis):
+        return analysis.first_conflict(self.parser, analysis.follow(self),
+                                       "FIRST/FOLLOW")
+
+    def predict(self, analysis):
+        self.__first = analysis.predict_set(self.parser)
+
+    @property
+    def prediction(self):
+        '''The token types that can start an element (once compiled), or
+        None if the element must be attempted.
+        '''
+        return self.__first
+
     def do_parse(self, llparser):
         start_pos = llparser.position
+        if self.__first is not None:
+            token = llparser.peek_token()
+            if token.token_type not in self.__first:
+                llparser.expect(token.start, self.__first)
+                return llparser.empty_result(start_pos)
         result = self.parser.parse(llparser)
         if result.iserror:
-            return ParseResult(None, start_pos, llparser.position)
+            return llparser.empty_result(start_pos)
         # ok, parsed
         return result
 
@@ -345,7 +636,10 @@ class Choice(Parser):
     def __init__(self):
         Parser.__init__(self)
         self.__branches = []
-        self.__dispatch = None
+        # the dispatch table, the default branch (parsed if no token type
+        # matches), the expected token types and the dense dispatch table
+        # (indexed by type id, with the default branch), once built
+        self.__table = None
         self.__static_token_types = set()
 
     class StateError(Exception):
@@ -357,49 +651,127 @@ class Choice(Parser):
         return self.orelse(parser)
 
     def orelse(self, parser):
-        if not isinstance(parser.token_type, str):
-            raise Choice.StateError("Token type must be a string, provided:" + repr(parser.token_type))
-        if parser.token_type in self.__static_token_types:
-            raise Choice.StateError("Token type '" + parser.token_type \
-                                    + "' ambiguous")
-        self.__static_token_types.add(parser.token_type)
+        # branches starting with a single token are checked right away,
+        # the others when the dispatch table is built (from FIRST sets)
+        token_type = parser.token_type
+        if isinstance(token_type, str):
+            if token_type in self.__static_token_types:
+                raise Choice.StateError("Token type '" + token_type \
+                                        + "' ambiguous")
+            self.__static_token_types.add(token_type)
         self.__branches.append(parser)
+        self.__table = None
         return self
 
-    def _build_dispatch(self):
-        self.__dispatch = {}
+    @property
+    def token_type(self):
+        if len(self.__branches) == 1:
+            return self.__branches[0].token_type
+        return None
+
+    def compile(self, resolve):
+        parsers = Parser.compile(self, resolve)
+        self.__branches = [resolve(branch) for branch in self.__branches]
+        return parsers + self.__branches
+
+    def sub_parsers(self):
+        return Parser.sub_parsers(self) + self.__branches
+
+    def analyze_first(self, analysis):
+        nullable = False
+        first = set()
         for branch in self.__branches:
-            token_type = branch.token_type
-            if not isinstance(token_type, str):
-                raise Choice.StateError("Token type must be a string, provided:" + repr(token_type) + "\nParser is: "
-                                        + str(branch))
-            if token_type in self.__dispatch:
-                raise Choice.StateError("Token type '" + token_type \
-                                        + "' ambigous")
-            self.__dispatch[token_type] = branch
+            nullable = nullable or analysis.nullable(branch)
+            first.update(analysis.first(branch))
+        return (nullable, first)
 
-    def explain_token_types(self):
-        msg = ""
-        count = 0
-        for token_type in self.__dispatch:
-            msg += "'" + str(token_type) + "'"
-            if count < len(self.__dispatch) - 1:
-                msg += ", or "
-            count += 1
+    def analyze_follow(self, analysis, follow):
+        for branch in self.__branches:
+            analysis.add_follow(branch, follow)
 
-        return msg
+    def analyze_conflicts(self, analysis):
+        try:
+            self.__dispatch_table(analysis)
+        except Choice.StateError as err:
+            return ["FIRST/FIRST conflict in: {0}\n  {1}".format(self, err)]
+        return []
+
+    def predict(self, analysis):
+        self._build_dispatch(analysis)
+
+    @property
+    def branches(self):
+        return list(self.__branches)
+
+    @property
+    def dispatch(self):
+        '''The pair of the dispatch table (token type -> branch) and the
+        default branch (or None).
+        '''
+        (dispatch, default, _, _) = self.__table or self._build_dispatch()
+        return (dict(dispatch), default)
+
+    @property
+    def expected(self):
+        '''The tuple of the expected token types (of the dispatch table),
+        in the order of the branches.
+        '''
+        return (self.__table or self._build_dispatch())[2]
+
+    def __dispatch_table(self, analysis):
+        '''Return the dispatch table (from the FIRST sets of the branches)
+        and the default branch, i.e. the branch that is nullable or starts
+        with unpredictable tokens: there can be at most one.
+        '''
+        dispatch = {}
+        default = None
+        for branch in self.__branches:
+            first = analysis.first(branch)
+            if analysis.nullable(branch) or None in first:
+                if default is not None:
+                    raise Choice.StateError("Branches cannot be predicted: "
+                                            + str(default) + " and "
+                                            + str(branch))
+                default = branch
+            # in a deterministic order (the one of the expected types)
+            for token_type in sorted(first, key=repr):
+                if token_type is None:
+                    continue
+                if token_type in dispatch:
+                    raise Choice.StateError("Token type '" + token_type \
+                                            + "' ambigous")
+                dispatch[token_type] = branch
+        return (dispatch, default)
+
+    def _build_dispatch(self, analysis=None):
+        with _build_lock:
+            if analysis is None:
+                if self.__table is not None:  # built by another thread
+                    return self.__table
+                analysis = GrammarAnalysis(roots=[self])
+            (dispatch, default) = self.__dispatch_table(analysis)
+            self.__table = (dispatch, default, tuple(dispatch),
+                            TOKEN_TYPES.table(dispatch, default))
+            return self.__table
+
+    def explain_token_types(self):
+        return explain_token_types(self.dispatch[0])
 
     def do_parse(self, llparser):
-        if not self.__dispatch:
-            self._build_dispatch()
+        (_, default, expected, branches) = self.__table \
+            or self._build_dispatch()
 
         token = llparser.peek_token()
+        try:
+            branch = branches[token.type_id]
+        except IndexError:  # a token type registered afterwards
+            branch = default
 
-        if token.token_type not in self.__dispatch:
-            return ParseError("Unexpected token type '"\
-                              + str(token.token_type) + "' expecting: "\
-                              + self.explain_token_types())
-        branch = self.__dispatch[token.token_type]
+        if branch is None:
+            llparser.expect(token.start, expected)
+            return ParseError(UNEXPECTED_TOKEN, token.start_pos,
+                              token.end_pos, token.token_type,
+                              expected=expected)
 
         result = branch.parse(llparser)
         return result
@@ -413,3 +785,124 @@ class Choice(Parser):
                 msg += " | "
             count += 1
         return msg
+
+
+#==============================================================================
+# ORDERED CHOICE PARSER
+#==============================================================================
+
+class OrderedChoice(Parser):
+    '''Ordered choice (as in PEGs): the branches are tried in order, the
+    parse being rolled back after each failed branch, but a branch is
+    skipped if its FIRST set excludes the next token.
+
+    The branches need not be disjoint, the first to succeed is chosen.
+    With the memo of the parser (see `LLParsing.memo_parse`), the rules
+    parsed by a failed branch are not parsed again by the next ones.
+    '''
+    def __init__(self):
+        Parser.__init__(self)
+        self.__branches = []
+        # (List[(Set[str],Parser)], Tuple[str]) the FIRST sets of the
+        # branches (None if the branch cannot be predicted) and the
+        # branches, and the expected token types, once built
+        self.__candidates = None
+
+    def either(self, parser):
+        if self.__branches:
+            raise Choice.StateError("Branch 'either' on as first choice")
+        return self.orelse(parser)
+
+    def orelse(self, parser):
+        self.__branches.append(parser)
+        self.__candidates = None
+        return self
+
+    @property
+    def token_type(self):
+        if len(self.__branches) == 1:
+            return self.__branches[0].token_type
+        return None
+
+    def compile(self, resolve):
+        parsers = Parser.compile(self, resolve)
+        self.__branches = [resolve(branch) for branch in self.__branches]
+        return parsers + self.__branches
+
+    def sub_parsers(self):
+        return Parser.sub_parsers(self) + self.__branches
+
+    def analyze_first(self, analysis):
+        nullable = False
+        first = set()
+        for branch in self.__branches:
+            nullable = nullable or analysis.nullable(branch)
+            first.update(analysis.first(branch))
+        return (nullable, first)
+
+    def analyze_follow(self, analysis, follow):
+        for branch in self.__branches:
+            analysis.add_follow(branch, follow)
+
+    def predict(self, analysis):
+        self._build_candidates(analysis)
+
+    @property
+    def branches(self):
+        return list(self.__branches)
+
+    @property
+    def candidates(self):
+        '''The list of the (FIRST set or None, branch) pairs.'''
+        return list((self.__candidates or self._build_candidates())[0])
+
+    @property
+    def expected(self):
+        '''The tuple of the expected token types (of the FIRST sets of the
+        branches), in the order of the branches.
+        '''
+        return (self.__candidates or self._build_candidates())[1]
+
+    def _build_candidates(self, analysis=None):
+        with _build_lock:
+            if analysis is None:
+                if self.__candidates is not None:  # built by another thread
+                    return self.__candidates
+                analysis = GrammarAnalysis(roots=[self])
+            candidates = [(analysis.predict_set(branch), branch)
+                          for branch in self.__branches]
+            expected = {}  # ordered as the branches, and deterministic
+            for (first, _) in candidates:
+                if first is not None:
+                    expected.update(dict.fromkeys(sorted(first, key=repr)))
+            self.__candidates = (candidates, tuple(expected))
+            return self.__candidates
+
+    def do_parse(self, llparser):
+        (candidates, expected) = self.__candidates \
+            or self._build_candidates()
+
+        token = llparser.peek_token()
+        error = None
+        for (first, branch) in candidates:
+            if first is not None and token.token_type not in first:
+                continue
+            mark = llparser.speculate()
+            result = branch.parse(llparser)
+            if not result.iserror:
+                llparser.end_speculation(mark)
+                return result
+            llparser.end_speculation(mark, rollback=True)
+            # report the error of the branch that went the furthest
+            if error is None or result.end_pos.offset > error.end_pos.offset:
+                error = result
+
+        if error is None:
+            llparser.expect(token.start, expected)
+            return ParseError(UNEXPECTED_TOKEN, token.start_pos,
+                              token.end_pos, token.token_type,
+                              expected=expected)
+        return error
+
+    def __str__(self):
+        return " / ".join(str(branch) for branch in self.__branches)
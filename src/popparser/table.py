@@ -0,0 +1,566 @@
+'''Table-driven LL(1) parsing, with an explicit stack.
+
+Created on 16 october 2026
+'''
+
+import threading
+import weakref
+
+from popparser.grammar import RefParser
+from popparser.llparser import LLParsing, ParseResult, ParseError,\
+    EXPECTING_TOKEN, UNEXPECTED_TOKEN, EXPECTING_OPEN, EXPECTING_CLOSE,\
+    NOT_ENOUGH_ELEMENTS
+from popparser.parsers import Token, Tuple, Repeat, List, Optional,\
+    Choice, OrderedChoice
+from popparser.expr.parsers import Embed
+from popparser.expr.popparser import ExprParser
+from popparser.tokenizer import TOKEN_TYPES
+
+# the kinds of the nodes of the table, whose dispatch tables are indexed
+# by the type ids of the tokens (see `TokenTypes.table`)
+TOKEN = 0     # [TOKEN, token type, expected, type id]
+TUPLE = 1     # [TUPLE, [(node, is element)]]
+REPEAT = 2    # [REPEAT, node, FIRST set, minimum, forget node, commit]
+LIST = 3      # [LIST, node, FIRST set, minimum, forget node, open, close,
+              #  separator, open id, close id, separator id]
+OPTIONAL = 4  # [OPTIONAL, node, FIRST set]
+CHOICE = 5    # [CHOICE, [node or default node], default node, expected]
+ORDERED = 6   # [ORDERED, [(FIRST set, node)], expected]
+REF = 7       # [REF, node]
+EXPR = 8      # [EXPR, expression parser, [(embed, token type, node,
+              #  type id)]]
+WRAP = 9      # [WRAP, node, forget node, xform result, xform content]
+FORGET = 10   # [FORGET, [node]]
+OTHER = 11    # [OTHER, parser]
+
+
+def _type_id(token_type):
+    return None if token_type is None else TOKEN_TYPES.intern(token_type)
+
+
+class ParseTable:
+    '''The parse table of a (compiled) grammar.
+    '''
+    __tables = weakref.WeakKeyDictionary()  # grammar -> table
+    __tables_lock = threading.Lock()
+
+    def __init__(self, grammar):
+        if not grammar.compiled:
+            grammar.compile()
+        self.__grammar = grammar
+        self.__nodes = {}  # parser -> node
+        self.__forget_nodes = {}  # parser -> node of its forget parsers
+        parsers = grammar.analysis.parsers
+        for parser in parsers:
+            self.__nodes[parser] = [None]
+        for parser in parsers:
+            self.__build(parser)
+
+    @staticmethod
+    def of(grammar):
+        '''Return the (shared) parse table of `grammar`.'''
+        with ParseTable.__tables_lock:
+            table = ParseTable.__tables.get(grammar)
+            if table is None:
+                table = ParseTable(grammar)
+                ParseTable.__tables[grammar] = table
+            return table
+
+    @property
+    def grammar(self):
+        return self.__grammar
+
+    def __len__(self):
+        return len(self.__nodes)
+
+    def node(self, parser):
+        '''Return the node of `parser` (parsed by its own methods if it
+        is not in the table).
+        '''
+        node = self.__nodes.get(parser)
+        if node is None and isinstance(parser, RefParser):
+            # a reference read before the grammar was compiled (e.g. the
+            # entry of the grammar), resolved as in the compiled grammar
+            node = self.__nodes.get(self.__grammar.resolve(parser))
+        if node is None:
+            node = [OTHER, parser]
+        return node
+
+    def __forget(self, parser):
+        if not parser.forget_parsers:
+            return None
+        node = self.__forget_nodes.get(parser)
+        if node is None:
+            node = [FORGET, TOKEN_TYPES.table(
+                {token_type: self.node(forget_parser)
+                 for (token_type, forget_parser)
+                 in parser.forget_parsers.items()})]
+            self.__forget_nodes[parser] = node
+        return node
+
+    def __build(self, parser):
+        node = self.__nodes[parser]
+        body = self.__body(parser)
+        if body[0] != OTHER and (parser.forget_parsers
+                                 or parser.xform_result is not None
+                                 or parser.xform_content is not None):
+            # wrapped as in `Parser.parse`
+            node[:] = [WRAP, body, self.__forget(parser),
+                       parser.xform_result, parser.xform_content]
+        else:
+            node[:] = body
+
+    def __body(self, parser):
+        if isinstance(parser, Token):
+            return [TOKEN, parser.token_type, (parser.token_type,),
+                    parser.type_id]
+        elif isinstance(parser, Tuple):
+            steps = []
+            forget = self.__forget(parser)
+            for (skips, element) in parser.elements:
+                if forget is not None:
+                    steps.append((forget, False))
+                steps.extend((self.node(skip), False) for skip in skips)
+                steps.append((self.node(element), True))
+            steps.extend((self.node(skip), False)
+                         for skip in parser.last_skips)
+            return [TUPLE, steps]
+        elif isinstance(parser, Repeat):
+            return [REPEAT, self.node(parser.parser), parser.prediction,
+                    parser.minimum, self.__forget(parser), parser.commit]
+        elif isinstance(parser, List):
+            return [LIST, self.node(parser.parser), parser.prediction,
+                    parser.minimum, self.__forget(parser), parser.open_token,
+                    parser.close_token, parser.sep_token,
+                    _type_id(parser.open_token), _type_id(parser.close_token),
+                    _type_id(parser.sep_token)]
+        elif isinstance(parser, Optional):
+            return [OPTIONAL, self.node(parser.parser), parser.prediction]
+        elif isinstance(parser, Choice):
+            (dispatch, default) = parser.dispatch
+            default = None if default is None else self.node(default)
+            return [CHOICE, TOKEN_TYPES.table(
+                        {token_type: self.node(branch)
+                         for (token_type, branch) in dispatch.items()},
+                        default),
+                    default, parser.expected]
+        elif isinstance(parser, OrderedChoice):
+            return [ORDERED, [(first, self.node(branch))
+                              for (first, branch) in parser.candidates],
+                    parser.expected]
+        elif isinstance(parser, RefParser):
+            if parser.target is None:
+                return [OTHER, parser]  # raises the error when parsed
+            return [REF, self.node(parser.target)]
+        elif isinstance(parser, ExprParser):
+            embeds = {token_type: (expression,
+                                   expression.parser.token_type,
+                                   self.node(expression.parser),
+                                   _type_id(expression.parser.token_type))
+                      for (token_type, expression)
+                      in parser.expressions.items()
+                      if type(expression) is Embed}
+            return [EXPR, parser, TOKEN_TYPES.table(embeds)]
+        return [OTHER, parser]
+
+    def parse(self, llparser, parser):
+        '''Parse with `parser`, from the tokens of `llparser`.'''
+        stack = []  # the frames: [node, state, start position, results]
+        try:
+            return self.__run(llparser, parser, stack)
+        except BaseException:
+            # the expression parsers still embedding a parser are left
+            for frame in reversed(stack):
+                if frame[0][0] == EXPR and frame[1] == 1\
+                   and frame[2] is not None:
+                    frame[2].leave(frame[0][1].parsing(llparser))
+            raise
+
+    def __run(self, llparser, parser, stack):
+        child = self.node(parser)  # the node to parse next, if any
+        result = None  # the result of the last parsed node
+        while True:
+            if child is not None:
+                if child[0] == TOKEN:
+                    # as `Token.do_parse`, without a frame
+                    start_pos = llparser.position
+                    token = llparser.peek_token()
+                    if token.type_id == child[3]:
+                        result = ParseResult(llparser.next_token(),
+                                             start_pos, llparser.position)
+                    else:
+                        llparser.expect(token.start, child[2])
+                        result = ParseError(EXPECTING_TOKEN, start_pos,
+                                            llparser.position, child[1],
+                                            expected=child[2])
+                else:
+                    stack.append([child, 0, None, None])
+                child = None
+            if not stack:
+                return result
+
+            frame = stack[-1]
+            node = frame[0]
+            kind = node[0]
+            state = frame[1]
+
+            if kind == TUPLE:
+                steps = node[1]
+                if state == 0:
+                    frame[2] = llparser.position
+                    frame[3] = []
+                elif result is not None and result.iserror:
+                    stack.pop()
+                    continue
+                elif steps[state - 1][1]:
+                    frame[3].append(result)
+                if state < len(steps):
+                    frame[1] = state + 1
+                    child = steps[state][0]
+                    continue
+                results = frame[3]
+                if len(results) == 1:
+                    results = results[0]
+                result = ParseResult(results, frame[2], llparser.position)
+
+            elif kind == CHOICE:
+                # the branch replaces the choice on the stack
+                token = llparser.peek_token()
+                try:
+                    child = node[1][token.type_id]
+                except IndexError:  # a token type registered afterwards
+                    child = node[2]
+                if child is None:
+                    llparser.expect(token.start, node[3])
+                    result = ParseError(UNEXPECTED_TOKEN,
+                                        token.start_pos, token.end_pos,
+                                        token.token_type, expected=node[3])
+                stack.pop()
+                continue
+
+            elif kind == WRAP:
+                # as `Parser.parse`
+                if state == 0:
+                    frame[1] = 1
+                    if node[2] is not None:
+                        child = node[2]
+                        continue
+                    result = None
+                    state = 1
+                if state == 1:
+                    if result is not None and result.iserror:
+                        stack.pop()
+                        continue
+                    frame[1] = 2
+                    child = node[1]
+                    continue
+                if state == 2:
+                    frame[3] = result
+                    frame[1] = 3
+                    if node[2] is not None:
+                        child = node[2]
+                        continue
+                    result = None
+                if result is None or not result.iserror:
+                    result = frame[3]
+                    if not result.iserror:
+                        if node[3]:
+                            result = node[3](result)
+                        elif node[4]:
+                            result = ParseResult(node[4](result),
+                                                 result.start_pos,
+                                                 result.end_pos)
+
+            elif kind == FORGET:
+                # as `Parser.forget_parse`
+                if state == 0 or not result.iserror:
+                    try:
+                        child = node[1][llparser.peek_token().type_id]
+                    except IndexError:
+                        child = None
+                    if child is not None:
+                        frame[1] = 1
+                        continue
+                    result = None
+
+            elif kind == REPEAT:
+                # as `Repeat.do_parse` (the count of repetitions stays at 0)
+                if state == 0:
+                    frame[2] = llparser.position
+                    frame[3] = []
+                    state = 1
+                elif state == 3:
+                    if not result.iserror:
+                        frame[3].append(result)
+                        if node[5]:
+                            llparser.commit()
+                        state = 1
+                if state == 1:
+                    if node[4] is not None:
+                        frame[1] = 2
+                        child = node[4]
+                        continue
+                    state = 2
+                elif state == 2 and result is not None and result.iserror:
+                    stack.pop()
+                    continue
+                if state == 2:
+                    first = node[2]
+                    token = None
+                    if first is not None:
+                        token = llparser.peek_token()
+                        if token.token_type not in first:
+                            llparser.expect(token.start, first)
+                    if token is None or token.token_type in first:
+                        frame[1] = 3
+                        child = node[1]
+                        continue
+                if node[3] == 0:
+                    result = llparser.empty_result(frame[2])
+                else:
+                    result = ParseResult(frame[3], frame[2],
+                                         llparser.position)
+
+            elif kind == OPTIONAL:
+                # as `Optional.do_parse`
+                if state == 0:
+                    frame[2] = llparser.position
+                    first = node[2]
+                    if first is not None:
+                        token = llparser.peek_token()
+                        if token.token_type not in first:
+                            llparser.expect(token.start, first)
+                            result = llparser.empty_result(frame[2])
+                            stack.pop()
+                            continue
+                    frame[1] = 1
+                    child = node[1]
+                    continue
+                if result.iserror:
+                    result = llparser.empty_result(frame[2])
+
+            elif kind == LIST:
+                child = self.__list_step(llparser, frame, result)
+                if child is not None:
+                    continue
+                result = frame[3]
+
+            elif kind == ORDERED:
+                # as `OrderedChoice.do_parse`
+                if state == 0:
+                    frame[2] = llparser.peek_token()
+                elif not result.iserror:
+                    llparser.end_speculation(frame[3][0])
+                    stack.pop()
+                    continue
+                else:
+                    llparser.end_speculation(frame[3][0], rollback=True)
+                    error = frame[3][1]
+                    if error is None\
+                       or result.end_pos.offset > error.end_pos.offset:
+                        frame[3] = (None, result)
+                error = None if frame[3] is None else frame[3][1]
+                token = frame[2]
+                candidates = node[1]
+                while state < len(candidates):
+                    (first, branch) = candidates[state]
+                    state += 1
+                    if first is None or token.token_type in first:
+                        frame[1] = state
+                        frame[3] = (llparser.speculate(), error)
+                        child = branch
+                        break
+                if child is not None:
+                    continue
+                if error is None:
+                    llparser.expect(token.start, node[2])
+                    result = ParseError(UNEXPECTED_TOKEN, token.start_pos,
+                                        token.end_pos, token.token_type,
+                                        expected=node[2])
+                else:
+                    result = error
+
+            elif kind == EXPR:
+                child = self.__expr_step(llparser, frame, result)
+                if child is not None:
+                    continue
+                result = frame[3]
+
+            elif kind == REF:
+                stack.pop()
+                child = node[1]
+                continue
+
+            else:  # OTHER (the tokens are parsed without a frame)
+                result = node[1].parse(llparser)
+
+            stack.pop()
+
+    @staticmethod
+    def __list_step(llparser, frame, result):
+        '''Run the frame of a list (as `List.do_parse`) until it parses
+        an element or a forget parser (returned), or until its result is
+        computed (stored in the frame).
+        '''
+        node = frame[0]
+        state = frame[1]
+        if state == 0:
+            frame[2] = llparser.position
+            frame[3] = []
+            open_token = node[5]
+            if open_token is not None:
+                token = llparser.peek_token()
+                if token.type_id != node[8]:
+                    llparser.expect(token.start, (open_token,))
+                    frame[3] = ParseError(EXPECTING_OPEN, token.start_pos,
+                                          token.end_pos, open_token,
+                                          token.token_type,
+                                          expected=(open_token,))
+                    return None
+                llparser.next_token()
+            state = 1
+        results = frame[3]
+        while True:
+            if state == 1:  # next element, forget parsers
+                if node[4] is not None:
+                    frame[1] = 2
+                    return node[4]
+                result = None
+                state = 2
+            elif state == 2:  # forget parsers parsed, element
+                if result is not None and result.iserror:
+                    frame[3] = result
+                    return None
+                first = node[2]
+                if first is not None:
+                    token = llparser.peek_token()
+                    if token.token_type not in first:
+                        llparser.expect(token.start, first)
+                        break
+                frame[1] = 3
+                return node[1]
+            elif state == 3:  # element parsed, forget parsers
+                if result.iserror:
+                    break
+                results.append(result)
+                if node[4] is not None:
+                    frame[1] = 4
+                    return node[4]
+                result = None
+                state = 4
+            else:  # forget parsers parsed, separator
+                if result is not None and result.iserror:
+                    frame[3] = result
+                    return None
+                sep_id = node[10]
+                if sep_id is not None:
+                    if llparser.peek_token().type_id != sep_id:
+                        break
+                    llparser.next_token()
+                state = 1
+        # end of loop
+        close_token = node[6]
+        if close_token is not None:
+            token = llparser.peek_token()
+            if token.type_id != node[9]:
+                llparser.expect(token.start, (close_token,))
+                frame[3] = ParseError(EXPECTING_CLOSE, token.start_pos,
+                                      token.end_pos, close_token,
+                                      token.token_type,
+                                      expected=(close_token,))
+                return None
+            llparser.next_token()
+        count = len(results)
+        if count == 0 and node[3] == 0:
+            frame[3] = llparser.empty_result(frame[2])
+        elif 0 < count < node[3]:
+            frame[3] = ParseError(NOT_ENOUGH_ELEMENTS, frame[2],
+                                  llparser.position, count, node[3])
+        else:
+            frame[3] = ParseResult(results, frame[2], llparser.position)
+        return None
+
+    @staticmethod
+    def __expr_step(llparser, frame, result):
+        '''Run the frame of an expression parser (as `ExprParser.do_parse`)
+        until it parses an embedded parser (returned), or until its result
+        is computed (stored in the frame).
+        '''
+        pop_parser = frame[0][1].parsing(llparser)
+        if frame[1] == 0:
+            # as `ExprParsing.pop_parse`, with the embedded parsers
+            err = pop_parser._next_token(llparser)
+            if err is not None:
+                frame[3] = err
+                return None
+            token = pop_parser.token
+            try:
+                expr = pop_parser.expression_table[token.type_id]
+            except IndexError:  # a token type registered afterwards
+                expr = None
+            if expr is None:
+                frame[3] = ParseError("Unexpected token type: {0}",
+                                      token.start_pos, token.end_pos,
+                                      token.token_type)
+                return None
+            if not expr.isprefix:
+                frame[3] = ParseError("No left operand in expression",
+                                      token.start_pos, llparser.position)
+                return None
+            try:
+                embed = frame[0][2][token.type_id]
+            except IndexError:
+                embed = None
+            if embed is None or embed[0] is not expr:
+                left = expr.parse_prefix(pop_parser, token)
+            elif token.type_id != embed[3]:
+                # as `Embed.parse_prefix`
+                left = ParseError("Mismatch token type '{0}' expecting:"
+                                  " {1}", token.start_pos,
+                                  token.start_pos, token.token_type,
+                                  embed[1])
+            else:
+                llparser.put_back_token(token)
+                expr.enter(pop_parser)
+                frame[1] = 1
+                frame[2] = expr
+                return embed[2]
+        else:  # the embedded parser is parsed
+            frame[2].leave(pop_parser)
+            frame[2] = None
+            left = result
+        frame[3] = pop_parser.pop_parse(0, left)
+        return None
+
+
+class TableParsing(LLParsing):
+    '''An `LLParsing` whose parse is driven by the parse table of the
+    grammar (see `ParseTable`): the nesting of the input is not bounded
+    by the recursion limit.
+
+    The parsers of a grammar call each other recursively (through
+    `Parser.parse`), bounded by the recursion limit of Python.  The
+    grammar is compiled instead into a parse table, whose nodes are the
+    parsers with their prediction tables (the dispatch tables of the
+    choices, the FIRST sets of the repetitions), and the parse is run by
+    a loop over an explicit stack of frames.  The results are the same
+    (and the same transformations are applied).
+
+    The expressions embedded in an `ExprParser` (see
+    `expr.parsers.Embed`) are parsed on the stack, the other expressions
+    and the parsers of an unknown kind are parsed by their own
+    (recursive) methods.  The memo of the rules (see
+    `LLParsing.memo_parse`) is not used.
+    '''
+    def __init__(self, grammar, table=None):
+        LLParsing.__init__(self, grammar)
+        self.__table = table  # the table of the grammar, once needed
+
+    @property
+    def table(self):
+        if self.__table is None:
+            self.__table = ParseTable.of(self.grammar)
+        return self.__table
+
+    def parse_entry(self, start_parser):
+        return self.table.parse(self, start_parser)
@@ -5,18 +5,137 @@ Created on 24 august 2012
 @author: F. Peschanski
 '''
 
-from copy import deepcopy
-from collections import defaultdict
+import codecs
+import mmap
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
 
-from popparser.llparser import ParsePosition
+from popparser.llparser import ParsePosition, LineIndex
+
+
+class TokenTypes:
+    '''A registry of token types, interned as small integers.
+
+    The integer of a token type (its type id) is its rank in the registry,
+    it never changes: the parsers dispatch on the `type_id` of the tokens
+    by indexing dense tables (see `table`), the names of the token types
+    are kept for the error messages.
+    '''
+    def __init__(self, token_types=()):
+        self.__ids = {}  # dict[str,int]
+        self.__names = []  # List[str] indexed by type id
+        self.__lock = threading.Lock()
+        for token_type in token_types:
+            self.intern(token_type)
+
+    def intern(self, token_type):
+        '''Return the type id of `token_type`, registered if needed.'''
+        type_id = self.__ids.get(token_type)
+        if type_id is None:
+            with self.__lock:
+                type_id = self.__ids.get(token_type)
+                if type_id is None:
+                    type_id = len(self.__names)
+                    self.__names.append(token_type)
+                    self.__ids[token_type] = type_id
+        return type_id
+
+    def name(self, type_id):
+        '''Return the token type of `type_id`.'''
+        return self.__names[type_id]
+
+    def __len__(self):
+        return len(self.__names)
+
+    def __contains__(self, token_type):
+        return token_type in self.__ids
+
+    def table(self, entries, default=None):
+        '''Return the dense table of `entries`, a dict from token types to
+        values: a list indexed by type id, with `default` for the other
+        token types.
+
+        The token types registered afterwards are beyond the end of the
+        table, an `IndexError` stands for the `default`.
+        '''
+        entries = [(self.intern(token_type), value)
+                   for (token_type, value) in entries.items()
+                   if token_type is not None]
+        table = [default] * len(self.__names)
+        for (type_id, value) in entries:
+            table[type_id] = value
+        return table
+
+
+# the registry shared by the tokenizers and the grammars
+TOKEN_TYPES = TokenTypes(('<<EOF>>', '<<ERROR>>'))
+EOF_TYPE_ID = TOKEN_TYPES.intern('<<EOF>>')
+ERROR_TYPE_ID = TOKEN_TYPES.intern('<<ERROR>>')
+
+
+class PositionIndex:
+    '''The line index of the positions given explicitly to a token (see
+    `Token`).
+    '''
+    __slots__ = ('positions',)
+
+    def __init__(self, *positions):
+        self.positions = {position.offset:
+                          (position.line_pos, position.char_pos)
+                          for position in positions}
+
+    def locate(self, offset):
+        return self.positions[offset]
 
 
 class Token:
-    def __init__(self, token_type, value, start_pos, end_pos):
+    '''A token, spanning the offsets `start` (included) to `end`
+    (excluded) of the input.
+
+    The `start_pos` and `end_pos` positions are built on demand from
+    the line `index` of the input.  If the `value` is None it is
+    extracted from the `source` backend, on first access.  The
+    `type_id` is the interned `token_type` (see `TokenTypes`), given
+    by the token rules that know it already.
+
+    The former signature, with the `ParsePosition`s `start_pos` and
+    `end_pos` instead of offsets, is still accepted.
+    '''
+    __slots__ = ('token_type', 'type_id', '__value', 'start', 'end', 'index',
+                 'source', 'trivia')
+
+    def __init__(self, token_type, value, start, end, index=None,
+                 source=None, type_id=None):
+        if isinstance(start, ParsePosition):
+            if index is None:
+                index = start.index if start.index is not None\
+                    else PositionIndex(start, end)
+            (start, end) = (start.offset, end.offset)
         self.token_type = token_type
-        self.value = value
-        self.start_pos = start_pos
-        self.end_pos = end_pos
+        self.type_id = TOKEN_TYPES.intern(token_type) if type_id is None\
+            else type_id
+        self.__value = value
+        self.start = start
+        self.end = end
+        self.index = index
+        self.source = source
+        self.trivia = ()  # the skipped trivia tokens (if kept) before
+
+    @property
+    def value(self):
+        if self.__value is None:
+            self.__value = self.source.substring(self.start, self.end)
+        return self.__value
+
+    @property
+    def start_pos(self):
+        return ParsePosition(self.start, index=self.index)
+
+    @property
+    def end_pos(self):
+        return ParsePosition(self.end, index=self.index)
 
     @property
     def iseof(self):
@@ -37,8 +156,11 @@ class Token:
 
 
 class EOFToken(Token):
-    def __init__(self, pos):
-        Token.__init__(self, '<<EOF>>', '<<EOF>>', pos, pos)
+    __slots__ = ()
+
+    def __init__(self, offset, index=None):
+        Token.__init__(self, '<<EOF>>', '<<EOF>>', offset, offset, index,
+                       type_id=EOF_TYPE_ID)
 
     @property
     def iseof(self):
@@ -57,8 +179,11 @@ class EOFToken(Token):
 
 
 class ErrorToken(Token):
-    def __init__(self, message, pos):
-        Token.__init__(self, '<<ERROR>>', message, pos, pos)
+    __slots__ = ()
+
+    def __init__(self, message, offset, index=None):
+        Token.__init__(self, '<<ERROR>>', message, offset, offset, index,
+                       type_id=ERROR_TYPE_ID)
 
     @property
     def message(self):
@@ -82,13 +207,34 @@ class Tokenizer:
     def __init__(self):
         self.__token_rules = {}  # dict[str,List[TokenRule]]
         self.__none_rules = []  # rules with no lookup available
+        # rules with code point ranges as lookups: List[(int,int,TokenRule)]
+        self.__range_rules = []
+        self.__range_index = None  # (bounds, segments) built on demand
+        self.__rule_ranks = {}  # dict[TokenRule,int] registration order
+        self.__candidates = {}  # dict[str,List[TokenRule]]
+        self.__literal_tables = {}  # dict[tuple,LiteralTable]
+        self.__compiled = False
+        self.__matchers = {}  # dict[str,RuleMatcher]
+        self.__shared_matchers = {}  # dict[tuple,RuleMatcher]
+        self.__trivia_rules = []  # List[TokenRule]
+        self.__trivia_skipper = None  # compiled regexp, False if none
+        # attach the skipped trivia tokens to the next token
+        self.keep_trivia = False
         self.__backend = None
+        self.__binary = False  # the backend lexes (UTF-8) bytes
+        self.__binary_ready = True  # all the rules can lex bytes
+        # all the rules lex the same on the UTF-8 bytes of any input
+        self.__utf8_ready = True
+        self.__line_index = LineIndex()
+        self.__position = None  # the last position, shared
+        self.__eof = None  # the EOF token, shared
 
         self.reset()
 
     def reset(self):
-        self.pos = ParsePosition()
-        self.lines = defaultdict()  # dict[int,ParsePosition]
+        # the cursor is a plain offset, line/char positions are
+        # only computed (from the line index) when they are needed
+        self.offset = 0
 
     @property
     def backend(self):
@@ -96,18 +242,143 @@ class Tokenizer:
 
     @backend.setter
     def backend(self, backend_):
-        self.backend = backend_
+        if backend_.binary and not self.__binary_ready:
+            raise ValueError("A rule of the tokenizer cannot lex bytes")
+        if backend_.binary != self.__binary:
+            # the master regexps are compiled for str or for bytes
+            self.__binary = backend_.binary
+            self.__matchers = {}
+            self.__shared_matchers = {}
+            self.__trivia_skipper = None
+        self.__backend = backend_
+        self.__line_index = backend_.line_index
+        self.__position = None
+        self.__eof = None
+        self.reset()
 
     def from_string(self, string):
-        self.__backend = StrTokenizer(self, string)
-        self.reset()
+        if string.isascii() and self.__binary_ready:
+            # the offsets are the same, but without str indexing
+            self.backend = BytesTokenizer(self, string.encode('ascii'))
+        else:
+            self.backend = StrTokenizer(self, string)
+
+    def from_bytes(self, data):
+        '''Tokenize the UTF-8 `data` without decoding it.
+
+        The offsets (and char positions) of the tokens count bytes.  If
+        a rule does not lex the same on bytes (see `TokenRule.utf8_ready`)
+        and the data is not ASCII, it is decoded instead: the offsets then
+        count characters.
+        '''
+        if self.__utf8_ready or data.isascii():
+            self.backend = BytesTokenizer(self, data)
+        else:
+            self.backend = StrTokenizer(self, data.decode('utf-8',
+                                                          'surrogateescape'))
+
+    def from_file(self, path):
+        '''Tokenize the (UTF-8) file at `path`, memory-mapped rather
+        than read in a string, and return the backend.
+
+        The offsets (and char positions) of the tokens count bytes.  As
+        with `from_bytes`, a non-ASCII file is read and decoded instead
+        if a rule does not lex the same on bytes.  The mapping is closed
+        by the `close` of the backend, which is also a context manager:
+        `with tokenizer.from_file(path): ...` (the lazy values of its
+        tokens cannot be accessed afterwards).
+        '''
+        backend_ = MmapTokenizerBackend(self, path)
+        if not self.__utf8_ready and NON_ASCII.search(backend_.data):
+            backend_.close()
+            with open(path, encoding='utf-8', errors='surrogateescape',
+                      newline='') as input_file:
+                backend_ = StrTokenizer(self, input_file.read())
+        self.backend = backend_
+        return backend_
+
+    def from_stream(self, stream, chunk_size=65536, encoding='utf-8',
+                    lookahead=4096):
+        '''Tokenize the file-like `stream` (of text, or bytes decoded
+        with `encoding`), read by chunks of `chunk_size`.
+
+        Only a window of the input is kept in memory: the input preceding
+        a committed checkpoint is released (see `commit`), and a match is
+        decided with `lookahead` characters after the cursor (and after
+        the end of the match), even on a line without end.
+        '''
+        self.backend = StreamTokenizer(self, stream, chunk_size, encoding,
+                                       lookahead)
+
+    @property
+    def line_index(self):
+        return self.__line_index
+
+    @property
+    def token_types(self):
+        '''The registry of the token types (see `TokenTypes`).'''
+        return TOKEN_TYPES
 
     @property
     def position(self):
-        return self.pos
+        # positions are immutable, the one of the cursor is built once
+        position = self.__position
+        if position is None or position.offset != self.offset:
+            position = ParsePosition(self.offset, index=self.__line_index)
+            self.__position = position
+        return position
+
+    def mark(self):
+        '''Return a checkpoint of the current cursor state.
+
+        The checkpoint is immutable and costs O(1), it can be given back
+        to `restore` (to backtrack) or to `commit` (to accept the
+        speculation).
+        '''
+        return self.offset
+
+    def restore(self, mark):
+        '''Move the cursor back (or forth) to the checkpoint `mark`.
+        '''
+        self.offset = mark
+
+    def commit(self, mark):
+        '''Accept the input consumed since the checkpoint `mark`.
+
+        Nothing needs to be undone, but the cursor can no longer be
+        restored before `mark`: a streaming backend releases the input
+        that precedes it.
+        '''
+        self.__backend.release(mark)
+
+    def _check_binary(self, token_rule):
+        if not token_rule.binary_ready:
+            if self.__binary:
+                raise ValueError("The rule cannot lex the bytes input")
+            self.__binary_ready = False
+        if not token_rule.utf8_ready:
+            self.__utf8_ready = False
+
+    @property
+    def utf8_ready(self):
+        '''True if all the rules lex the same on the UTF-8 bytes of any
+        input as on its string (see `from_bytes`).
+        '''
+        return self.__utf8_ready
 
     def add_rule(self, token_rule):
-        if token_rule.lookups is None:
+        self._check_binary(token_rule)
+        self.__candidates = {}
+        self.__matchers = {}
+        self.__shared_matchers = {}
+        self.__literal_tables = {}
+        self.__rule_ranks.setdefault(token_rule, len(self.__rule_ranks))
+        lookup_ranges = token_rule.lookup_ranges
+        if lookup_ranges is not None:
+            for (min_code, max_code) in lookup_ranges:
+                self.__range_rules.append((min_code, max_code, token_rule))
+            self.__range_index = None
+        elif token_rule.lookups is None:
             self.__none_rules.append(token_rule)
         else:
             for lookup in token_rule.lookups:
@@ -118,63 +389,228 @@ class Tokenizer:
                     rules = self.__token_rules[lookup]
                 rules.append(token_rule)
 
+    def add_trivia(self, token_rule):
+        '''Add a trivia rule (e.g. for spaces or comments).
+
+        Trivia tokens are skipped by `next` and thus never reach the
+        parsers. If `keep_trivia` is set they are attached, as a list, to
+        the `trivia` of the next token.
+        '''
+        self._check_binary(token_rule)
+        self.__trivia_rules.append(token_rule)
+        self.__trivia_skipper = None
+
+    def _build_trivia_skipper(self):
+        # all the trivia is skipped by a single match, if possible
+        patterns = []
+        for rule in self.__trivia_rules:
+            pattern = rule.binary_pattern if self.__binary else rule.pattern
+            if pattern is None or not getattr(rule, 'span_lines', True):
+                return False
+            patterns.append(pattern)
+        source = '(?:' + '|'.join(patterns) + ')+'
+        try:
+            if self.__binary:
+                return re.compile(source.encode('utf-8'))
+            return re.compile(source)
+        except re.error:
+            return False
+
+    def _next_trivia(self):
+        if self.peek_char() is None:
+            return None
+        for rule in self.__trivia_rules:
+            start = self.offset
+            token = rule.recognize(self)
+            if token is not None:
+                if self.offset > start:
+                    return token
+                self.offset = start  # an empty trivia would loop
+        return None
+
+    def skip_trivia(self):
+        '''Skip the trivia at the cursor, and return the list of trivia
+        tokens if `keep_trivia` is set (or None).
+        '''
+        if self.keep_trivia:
+            trivia = []
+            token = self._next_trivia()
+            while token is not None:
+                trivia.append(token)
+                token = self._next_trivia()
+            return trivia
+
+        if self.__trivia_skipper is None:
+            self.__trivia_skipper = self._build_trivia_skipper()
+        if self.__trivia_skipper is False:
+            while self._next_trivia() is not None:
+                pass
+        elif self.peek_char() is not None:
+            match_obj = self.__backend.match(self.__trivia_skipper,
+                                             self.offset, True)
+            if match_obj is not None:
+                self.offset = self.match_end(match_obj)
+        return None
+
+    def compile(self):
+        '''Switch to the compiled mode: the candidate rules for a lookup
+        character are merged in a single master regular expression, so
+        that recognizing a token is a single match call.
+
+        The priority between rules is unchanged (the first candidate that
+        matches wins).  A single candidate, or candidates involving a rule
+        without `pattern`, are still tried one by one: the master regexp
+        only pays when several rules compete for the lookup.
+        '''
+        self.__compiled = True
+        for lookup in self.__token_rules:
+            self._matcher(lookup)
+        return self
+
+    @property
+    def compiled(self):
+        return self.__compiled
+
+    def _build_range_index(self):
+        # the bounds split the code points in segments covered by the
+        # same range rules
+        bounds = set()
+        for (min_code, max_code, _) in self.__range_rules:
+            bounds.add(min_code)
+            bounds.add(max_code + 1)
+        bounds = sorted(bounds)
+        segments = [[] for _ in bounds]
+        for (min_code, max_code, rule) in self.__range_rules:
+            for i in range(bisect_left(bounds, min_code),
+                           bisect_left(bounds, max_code + 1)):
+                if rule not in segments[i]:
+                    segments[i].append(rule)
+        return (bounds, segments)
+
+    def _range_rules(self, code):
+        if not self.__range_rules:
+            return []
+        if self.__range_index is None:
+            self.__range_index = self._build_range_index()
+        (bounds, segments) = self.__range_index
+        i = bisect_right(bounds, code) - 1
+        if i < 0:
+            return []
+        return segments[i]
+
+    def _candidates(self, lookup):
+        rules = self.__candidates.get(lookup)
+        if rules is None:
+            rules = self.__token_rules.get(lookup, [])
+            range_rules = self._range_rules(ord(lookup))
+            if range_rules:
+                rules = sorted(rules + range_rules,
+                               key=self.__rule_ranks.__getitem__)
+            if rules:
+                rules = self._merge_literals(rules) + self.__none_rules
+            else:
+                rules = self.__none_rules
+            self.__candidates[lookup] = rules
+        return rules
+
+    def _merge_literals(self, rules):
+        # adjacent literal rules are recognized by longest match
+        merged = []
+        literal_rules = []
+        for rule in rules + [None]:
+            if rule is not None and rule.literal_types is not None:
+                literal_rules.append(rule)
+                continue
+            if len(literal_rules) > 1:
+                merged.append(self._literal_table(tuple(literal_rules)))
+            else:
+                merged.extend(literal_rules)
+            literal_rules = []
+            if rule is not None:
+                merged.append(rule)
+        return merged
+
+    def _literal_table(self, literal_rules):
+        table = self.__literal_tables.get(literal_rules)
+        if table is None:
+            from popparser.tokens import LiteralTable
+            table = LiteralTable([literal_type for rule in literal_rules
+                                  for literal_type in rule.literal_types])
+            self.__literal_tables[literal_rules] = table
+        return table
+
+    def _matcher(self, lookup):
+        if lookup in self.__matchers:
+            return self.__matchers[lookup]
+        # characters sharing the same candidates share the same matcher
+        rules = tuple(self._candidates(lookup))
+        if len(rules) < 2:
+            matcher = None  # the rule is as fast as its regexp
+        elif rules in self.__shared_matchers:
+            matcher = self.__shared_matchers[rules]
+        else:
+            matcher = RuleMatcher.build(rules, self.__binary)
+            self.__shared_matchers[rules] = matcher
+        self.__matchers[lookup] = matcher
+        return matcher
+
     def forward(self):
         char = self.peek_char()
         if char is None:
             return False  # cannot advance forward
-        if char == '\n':
-            self.lines[self.pos.offset] = self.pos
-            self.pos = self.pos.next_line()
-        else:
-            self.pos = self.pos.next_char()
+        self.offset += self.__backend.char_width(char)
         return True
 
     def forwards(self, nb):
+        '''Advance the cursor by `nb` characters (whatever their width in
+        the input), if there are as many.
+        '''
         if nb < 0:
             return self.backwards(-nb)
-        saved_pos = self.pos
-        saved_lines = deepcopy(self.lines)
+        backend = self.__backend
+        if not backend.binary:
+            if nb > 0 and backend.char_at(self.offset + nb - 1) is None:
+                return False
+            self.offset += nb
+            return True
+        offset = self.offset
         for _ in range(nb):
-            moved = self.forward()
-            if not moved:
-                self.pos = saved_pos
-                self.lines = saved_lines
+            char = backend.char_at(offset)
+            if char is None:
                 return False
-        # end of for
+            offset += backend.char_width(char)
+        self.offset = offset
         return True
 
     def backward(self):
-        if self.pos.offset == 0:
+        if self.offset == 0:
             return False
-        try:
-            prev = self.lines[self.pos.offset - 1]
-            self.pos = prev
-            del self.lines[self.pos.offset]
-            return True
-        except KeyError:
-            # not an end of line
-            self.pos = self.pos.prev_char()
-            return True
+        self.offset = self.__backend.char_before(self.offset)
+        return True
 
     def backwards(self, nb):
+        '''Move the cursor back by `nb` characters, if there are as many.'''
         if nb < 0:
             return self.forwards(-nb)
-        saved_pos = self.pos
-        saved_lines = deepcopy(self.lines)
+        backend = self.__backend
+        if not backend.binary:
+            if nb > self.offset:
+                return False
+            self.offset -= nb
+            return True
+        offset = self.offset
         for _ in range(nb):
-            moved = self.backward()
-            if not moved:
-                self.pos = saved_pos
-                self.lines = saved_lines
+            if offset == 0:
                 return False
-        # end of for
+            offset = backend.char_before(offset)
+        self.offset = offset
         return True
 
     def peek_char(self):
         if not self.__backend:
             raise NotImplementedError("No backend")
         else:
-            return self.__backend.peek_char()
+            return self.__backend.char_at(self.offset)
 
     def peek_line(self):
         if not self.__backend:
@@ -182,6 +618,27 @@ class Tokenizer:
         else:
             return self.__backend.peek_line()
 
+    def match(self, regexp, span_lines=False):
+        '''Match the compiled `regexp` at the cursor, without moving it.
+
+        Unless `span_lines` is set the match cannot go past the end of
+        the current line.  The `regexp` of a binary backend is compiled
+        for bytes.
+        '''
+        if not self.__backend:
+            raise NotImplementedError("No backend")
+        if self.peek_char() is None:
+            return None
+        return self.__backend.match(regexp, self.offset, span_lines)
+
+    def match_end(self, match_obj):
+        '''Return the end offset of `match_obj`, matched at the cursor.
+
+        The positions of the match object itself are relative to the
+        buffer of the backend, which may be a window of the input.
+        '''
+        return self.offset + match_obj.end() - match_obj.start()
+
     @property
     def at_eof(self):
         return self.peek_char() is None
@@ -190,69 +647,78 @@ class Tokenizer:
         char = self.peek_char()
         if char is None:
             return None
-        self.forward()
+        self.offset += self.__backend.char_width(char)
         return char
 
     def consume(self, string):
-        saved_pos = self.pos
-        saved_lines = deepcopy(self.lines)
-        for char in string:
-            next_char = self.peek_char()
-            if (next_char is None) or (next_char != char):
-                self.pos = saved_pos
-                self.lines = saved_lines
-                return False
-            # ok, same char
-            self.forward()
-        # end of for, the string has been consumed
+        if not self.__backend.startswith(string, self.offset):
+            return False
+        self.offset += self.__backend.width(string)
         return True
 
     def put_back(self, token):
-        self.backwards(token.end_pos.offset - token.start_pos.offset)
+        self.offset = token.start
         #XXX: check needed ?
         #if self.peek() != token:
         #    raise ValueError("Wrong token to put back")
 
     def next(self):
-        '''Return the next token.
+        '''Return the next token, skipping the trivia.
+        '''
+        if not self.__trivia_rules:
+            return self.next_token()
+        trivia = self.skip_trivia()
+        token = self.next_token()
+        if trivia:
+            token.trivia = trivia
+        return token
+
+    def next_token(self):
+        '''Return the next token, trivia included.
         '''
         lookup = self.peek_char()
         if lookup is None:
-            return EOFToken(self.pos)
-        if lookup in self.__token_rules:
-            rules = self.__token_rules[lookup] + self.__none_rules
-        else:
-            rules = self.__none_rules
+            if self.__eof is None or self.__eof.start != self.offset:
+                self.__eof = EOFToken(self.offset, self.__line_index)
+            return self.__eof
 
+        if self.__compiled:
+            matcher = self.__matchers.get(lookup)
+            if matcher is None and lookup not in self.__matchers:
+                matcher = self._matcher(lookup)
+            if matcher is not None:
+                token = matcher.recognize(self, self.__backend, self.offset)
+                if token is not None:
+                    return token
+                return ErrorToken(repr(lookup), self.offset,
+                                  self.__line_index)
+
+        rules = self.__candidates.get(lookup)
+        if rules is None:
+            rules = self._candidates(lookup)
         for rule in rules:
             token = rule.recognize(self)
             if token is not None:
                 return token
 
-        return ErrorToken(repr(lookup), self.pos)
+        return ErrorToken(repr(lookup), self.offset, self.__line_index)
 
     def peek(self):
-        saved_pos = self.pos
-        saved_lines = deepcopy(self.lines)
+        mark = self.mark()
         token = self.next()
-        self.pos = saved_pos
-        self.lines = saved_lines
+        self.restore(mark)
         return token
 
     def substring(self, start_offset, end_offset):
         return self.__backend.substring(start_offset, end_offset)
 
     def __str__(self):
+        position = self.position
         msg = ""
-        msg += str(self.pos.line_pos)
+        msg += str(position.line_pos)
         msg += ": "
-        if self.pos.line_pos in self.lines:
-            start_offset = self.lines[self.pos.line_pos]
-        else:
-            start_offset = 0
-
-        end_offset = self.pos.offset
-        msg += self.substring(start_offset, end_offset)
+        start_offset = self.offset - position.char_pos + 1
+        msg += self.substring(start_offset, self.offset)
         msg += "_"
         msg += self.peek_line()
         return msg
@@ -261,36 +727,430 @@ class Tokenizer:
         return "<Tokenizer: " + str(self) + ">"
 
 
+class RuleMatcher:
+    '''A list of token rules merged in a master regular expression,
+    with one (capturing) alternative per rule in priority order.
+    '''
+    def __init__(self, rules, regexp, group_rules):
+        self.rules = rules
+        self.regexp = regexp
+        self.group_rules = group_rules  # dict[int,int] group -> rule index
+
+    @staticmethod
+    def build(rules, binary=False):
+        '''Return the matcher for `rules`, or None if one of the rules
+        cannot be compiled.  A `binary` matcher matches UTF-8 bytes.
+        '''
+        if not rules:
+            return None
+        alternatives = []
+        group_rules = {}
+        group = 1
+        for (index, rule) in enumerate(rules):
+            pattern = rule.binary_pattern if binary else rule.pattern
+            if pattern is None:
+                return None
+            try:
+                nb_groups = re.compile(pattern).groups
+            except re.error:
+                return None
+            alternatives.append('(' + pattern + ')')
+            group_rules[group] = index
+            group += 1 + nb_groups
+        source = '|'.join(alternatives)
+        try:
+            if binary:
+                regexp = re.compile(source.encode('utf-8'))
+            else:
+                regexp = re.compile(source)
+        except re.error:
+            return None
+        return RuleMatcher(rules, regexp, group_rules)
+
+    def recognize(self, tokenizer, backend, offset):
+        '''Recognize a token at `offset`, the cursor of `tokenizer`.'''
+        match_obj = backend.match(self.regexp, offset, True)
+        if match_obj is None:
+            return None
+        index = self.group_rules[match_obj.lastindex]
+        # (see `Tokenizer.match_end`)
+        token = self.rules[index].accept(
+            tokenizer, offset + match_obj.end() - match_obj.start())
+        if token is not None:
+            return token
+        # the winning rule finally rejects the input, try the next ones
+        for rule in self.rules[index + 1:]:
+            token = rule.recognize(tokenizer)
+            if token is not None:
+                return token
+        return None
+
+
 class TokenizerBackend:
-    pass
+    '''The input of a tokenizer.
+
+    The offsets are counted in the units of the backend: characters
+    for a `str` input, bytes for a `binary` one (whose regexps are
+    compiled for, and matched on, the UTF-8 bytes).  The tokens of an
+    input with `lazy_values` only extract their value when accessed.
+    '''
+    binary = False
+    lazy_values = True
+
+    def char_width(self, char):
+        '''The number of units of `char` in the input.'''
+        return 1
+
+    def width(self, string):
+        '''The number of units of `string` in the input.'''
+        return len(string)
+
+    def char_before(self, offset):
+        '''The offset of the character ending at `offset`.'''
+        return offset - 1
+
+    def find_newline(self, start_offset, end_offset):
+        '''The offset of the first newline between the offsets, or -1.'''
+        raise NotImplementedError("Abstract method")
+
+    def release(self, offset):
+        '''The input before `offset` will no longer be accessed.'''
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+        return False
 
 
 class StrTokenizer(TokenizerBackend):
     def __init__(self, tokenizer, string):
         self.tokenizer = tokenizer
         self.string = string
+        self.line_index = LineIndex.from_string(string)
+
+    def char_at(self, offset):
+        if offset > len(self.string) - 1:
+            return None
+        return self.string[offset]
 
     def peek_char(self):
-        if self.tokenizer.pos.offset > len(self.string) - 1:
+        return self.char_at(self.tokenizer.offset)
+
+    def startswith(self, string, offset):
+        return self.string.startswith(string, offset)
+
+    def find_newline(self, start_offset, end_offset):
+        return self.string.find('\n', start_offset, end_offset)
+
+    def slice(self, start_offset, end_offset):
+        return self.string[start_offset:end_offset]
+
+    def peek_line(self):
+        offset = self.tokenizer.offset
+        if offset >= len(self.string):
             return None
-        return self.string[self.tokenizer.pos.offset]
+        end = self.string.find('\n', offset)
+        if end == -1:
+            return self.string[offset:]
+        return self.string[offset:end]
+
+    def match(self, regexp, offset, span_lines=False):
+        match_obj = regexp.match(self.string, offset)
+        if match_obj is None or span_lines:
+            return match_obj
+        newline = self.string.find('\n', offset, match_obj.end())
+        if newline == -1:
+            return match_obj
+        # the match must stop at the end of the current line
+        return regexp.match(self.string, offset, newline)
+
+    def substring(self, start_offset, end_offset):
+        return self.string[start_offset:end_offset]
+
+
+# a byte of a multi-byte UTF-8 sequence
+NON_ASCII = re.compile(b'[\x80-\xff]')
+
+# the characters of the bytes (None if not a single-byte UTF-8 sequence)
+BYTE_CHARS = tuple(chr(code) if code < 0x80 else None for code in range(256))
+
+
+class LazyLineIndex(LineIndex):
+    '''The line index of a bytes input, only extended (by scanning the
+    input for newlines) as far as the located offsets.
+    '''
+    def __init__(self, data):
+        LineIndex.__init__(self, array('q'))
+        self.data = data
+        self.scanned = 0  # the newlines before this offset are indexed
+
+    def locate(self, offset):
+        if offset > self.scanned:
+            newline = self.data.find(b'\n', self.scanned, offset)
+            while newline != -1:
+                self.newlines.append(newline)
+                newline = self.data.find(b'\n', newline + 1, offset)
+            self.scanned = offset
+        return LineIndex.locate(self, offset)
+
+
+class StreamLineIndex(LineIndex):
+    '''The line index of a streamed input: the newlines of the released
+    input are dropped, only their number and the offset of the last one
+    are kept.  The offsets before that newline can no longer be located.
+    '''
+    def __init__(self):
+        LineIndex.__init__(self, array('q'))
+        self.dropped = 0  # the number of dropped newlines
+        self.last_dropped = -1  # the offset of the last dropped newline
+
+    def release(self, offset):
+        '''Drop the newlines before `offset`.'''
+        count = bisect_left(self.newlines, offset)
+        if count:
+            self.last_dropped = self.newlines[count - 1]
+            self.dropped += count
+            del self.newlines[:count]
+
+    def locate(self, offset):
+        if offset <= self.last_dropped:
+            raise ValueError("The input before offset {0} is released"
+                             .format(self.last_dropped + 1))
+        line = bisect_left(self.newlines, offset)
+        previous = self.newlines[line - 1] if line else self.last_dropped
+        return (self.dropped + line + 1, offset - previous)
+
+
+class BytesTokenizer(TokenizerBackend):
+    '''A UTF-8 (or ASCII) bytes input, lexed without decoding it: only
+    the peeked characters, and the token values when they are accessed,
+    are decoded.
+
+    The offsets are byte offsets.  The regexp rules are matched on the
+    bytes, hence a character class (or `.`) only matches the single-byte
+    (ASCII) characters.
+    '''
+    binary = True
+
+    def __init__(self, tokenizer, data):
+        self.tokenizer = tokenizer
+        self.data = data
+        self.size = len(data)
+        self.line_index = LazyLineIndex(data)
+
+    def char_at(self, offset):
+        if offset >= self.size:
+            return None
+        byte = self.data[offset]
+        char = BYTE_CHARS[byte]
+        if char is not None:
+            return char
+        # the length of the sequence is given by its leading byte
+        width = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+        return self.data[offset:offset + width]\
+                   .decode('utf-8', 'surrogateescape')[0]
+
+    def char_width(self, char):
+        if char < '\x80':
+            return 1
+        return len(char.encode('utf-8', 'surrogateescape'))
+
+    def width(self, string):
+        return len(string.encode('utf-8', 'surrogateescape'))
+
+    def char_before(self, offset):
+        start = offset - 1
+        # the continuation bytes (0b10xxxxxx) follow the leading byte
+        while start > 0 and offset - start < 4\
+              and self.data[start] & 0xC0 == 0x80:
+            start -= 1
+        if start < offset - 1\
+           and self.char_width(self.char_at(start)) != offset - start:
+            return offset - 1  # not a sequence: its bytes are characters
+        return start
+
+    def peek_char(self):
+        return self.char_at(self.tokenizer.offset)
+
+    def startswith(self, string, offset):
+        prefix = string.encode('utf-8', 'surrogateescape')
+        return self.data[offset:offset + len(prefix)] == prefix
+
+    def find_newline(self, start_offset, end_offset):
+        return self.data.find(b'\n', start_offset, end_offset)
+
+    def peek_line(self):
+        offset = self.tokenizer.offset
+        if offset >= self.size:
+            return None
+        end = self.data.find(b'\n', offset)
+        if end == -1:
+            end = self.size
+        return self.substring(offset, end)
+
+    def match(self, regexp, offset, span_lines=False):
+        match_obj = regexp.match(self.data, offset)
+        if match_obj is None or span_lines:
+            return match_obj
+        newline = self.data.find(b'\n', offset, match_obj.end())
+        if newline == -1:
+            return match_obj
+        # the match must stop at the end of the current line
+        return regexp.match(self.data, offset, newline)
+
+    def slice(self, start_offset, end_offset):
+        return self.data[start_offset:end_offset]
+
+    def substring(self, start_offset, end_offset):
+        return self.data[start_offset:end_offset]\
+                   .decode('utf-8', 'surrogateescape')
+
+
+class MmapTokenizerBackend(BytesTokenizer):
+    '''A (UTF-8) file, memory-mapped rather than read: the pages of the
+    file are loaded (and decoded) on demand.
+    '''
+    def __init__(self, tokenizer, path):
+        with open(path, 'rb') as input_file:
+            try:
+                data = mmap.mmap(input_file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            except ValueError:  # an empty file cannot be mapped
+                data = b''
+        BytesTokenizer.__init__(self, tokenizer, data)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+class StreamTokenizer(TokenizerBackend):
+    '''A file-like input, read and decoded by chunks.
+
+    Only a window of the input is kept: it starts at the released offset
+    (as of the last chunk read) and grows by chunks as the tokenizer peeks
+    further.  A regexp is matched on a window of at least `lookahead`
+    characters after the cursor (whatever the length of the line), and
+    retried on a larger window while its match ends less than `lookahead`
+    characters before the end of the window.
+    '''
+    lazy_values = False  # the window may be released before an access
+    def __init__(self, tokenizer, stream, chunk_size=65536, encoding='utf-8',
+                 lookahead=4096):
+        self.tokenizer = tokenizer
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.lookahead = lookahead
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.window = ''
+        self.start = 0  # the offset of the window in the input
+        self.released = 0  # the input before is no longer needed
+        self.eof = False
+        self.line_index = StreamLineIndex()
+
+    def _read(self):
+        # extend the window by a chunk, return False at the end of stream
+        while not self.eof:
+            chunk = self.stream.read(self.chunk_size)
+            if isinstance(chunk, bytes):
+                text = self.decoder.decode(chunk, not chunk)
+            else:
+                text = chunk
+            if not chunk:
+                self.eof = True
+            if text:
+                self._append(text)
+                return True
+        return False
+
+    def _append(self, text):
+        end = self.start + len(self.window)
+        newline = text.find('\n')
+        while newline != -1:
+            self.line_index.newlines.append(end + newline)
+            newline = text.find('\n', newline + 1)
+        # the released prefix is dropped once per chunk
+        self.window = self.window[self.released - self.start:] + text
+        self.start = self.released
+        self.line_index.release(self.released)
+
+    def _fill(self, offset):
+        # read the input up to `offset` (excluded), if possible
+        while offset > self.start + len(self.window):
+            if not self._read():
+                return False
+        return True
+
+    def _index(self, offset):
+        if offset < self.start:
+            raise ValueError("The input before offset {0} is released"
+                             .format(self.start))
+        return offset - self.start
+
+    def release(self, offset):
+        if offset > self.released:
+            self.released = offset
+
+    def char_at(self, offset):
+        if not self._fill(offset + 1):
+            return None
+        return self.window[self._index(offset)]
+
+    def peek_char(self):
+        return self.char_at(self.tokenizer.offset)
+
+    def startswith(self, string, offset):
+        self._fill(offset + len(string))
+        return self.window.startswith(string, self._index(offset))
+
+    def find_newline(self, start_offset, end_offset):
+        self._fill(end_offset)
+        newline = self.window.find('\n', self._index(start_offset),
+                                   self._index(end_offset))
+        return newline if newline == -1 else self.start + newline
 
     def peek_line(self):
-        line = None
-        offset = self.tokenizer.pos.offset
-        lenstr = len(self.string)
+        offset = self.tokenizer.offset
+        if not self._fill(offset + 1):
+            return None
+        # the rest of the line, up to `lookahead` characters
+        self._fill(offset + self.lookahead)
+        index = self._index(offset)
+        end = self.window.find('\n', index, index + self.lookahead)
+        if end == -1:
+            return self.window[index:index + self.lookahead]
+        return self.window[index:end]
+
+    def match(self, regexp, offset, span_lines=False):
+        # the match is decided with `lookahead` characters (past the
+        # cursor, then past the end of the match)
+        self._fill(offset + self.lookahead)
         while True:
-            if offset >= lenstr:
+            index = self._index(offset)
+            match_obj = regexp.match(self.window, index)
+            if match_obj is None\
+               or match_obj.end() + self.lookahead <= len(self.window)\
+               or not self._read():
                 break
-            if line is None:
-                line = ""
-            char = self.string[offset]
-            if char == '\n':
-                break
-            line += char
-            offset += 1
-        # at the end of the line
-        return line
+            # the match may go on in the next chunk
+        if match_obj is None or span_lines:
+            return match_obj
+        newline = self.window.find('\n', index, match_obj.end())
+        if newline == -1:
+            return match_obj
+        # the match must stop at the end of the current line
+        return regexp.match(self.window, index, newline)
+
+    def slice(self, start_offset, end_offset):
+        self._fill(end_offset)
+        return self.window[self._index(start_offset):
+                           self._index(end_offset)]
 
     def substring(self, start_offset, end_offset):
-        return self.string[start_offset:end_offset]
+        return self.slice(start_offset, end_offset)
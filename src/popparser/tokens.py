@@ -5,22 +5,150 @@ Created on 24 august 2012
 @author: F. Peschanski
 '''
 
-from popparser.tokenizer import Token
+from popparser.llparser import ParsePosition
+from popparser.tokenizer import Token, TOKEN_TYPES
 
+import inspect
 import re
+import sys
+import unicodedata
+
+# references to numbered or named groups, cannot be merged in master patterns
+BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+INLINE_FLAGS = ((re.IGNORECASE, 'i'), (re.MULTILINE, 'm'),
+                (re.DOTALL, 's'), (re.VERBOSE, 'x'), (re.ASCII, 'a'))
+
+# the escapes whose meaning differs between str and UTF-8 bytes patterns:
+# the non-ASCII code points, and the Unicode classes (unless re.ASCII)
+NON_ASCII_ESCAPE = re.compile(r'(?<!\\)(?:\\\\)*\\x[89a-fA-F]')
+UNICODE_CLASS = re.compile(r'(?<!\\)(?:\\\\)*\\[wWdDsSbB]')
+
+# dict[str,List[(int,int)]] the code point ranges of each Unicode category
+CATEGORY_RANGES = None
+
+
+def category_ranges():
+    '''Return the code point ranges of all the (minor) Unicode
+    categories, computed once.
+    '''
+    global CATEGORY_RANGES
+    if CATEGORY_RANGES is None:
+        ranges = {}
+        category = None
+        start = 0
+        for code in range(sys.maxunicode + 1):
+            code_category = unicodedata.category(chr(code))
+            if code_category != category:
+                if category is not None:
+                    ranges.setdefault(category, []).append((start, code - 1))
+                category = code_category
+                start = code
+        ranges.setdefault(category, []).append((start, sys.maxunicode))
+        CATEGORY_RANGES = ranges
+    return CATEGORY_RANGES
+
+
+def positional_build_token(rule_class):
+    '''Return True if the `build_token` method of `rule_class` has the
+    former signature `(match_obj, parsed_str, start_pos, end_pos)`, with
+    positions instead of the offsets and line index.
+    '''
+    parameters = inspect.signature(rule_class.build_token).parameters
+    kinds = [parameter.kind for parameter in parameters.values()]
+    return inspect.Parameter.VAR_POSITIONAL not in kinds\
+        and kinds.count(inspect.Parameter.POSITIONAL_OR_KEYWORD) == 5
+
+
+def utf8_equivalent(regexp):
+    '''True if the compiled `regexp` matches the same text on the UTF-8
+    bytes of any input as on its string.
+    '''
+    source = regexp.pattern
+    if not source.isascii() or NON_ASCII_ESCAPE.search(source):
+        return False
+    if regexp.flags & re.ASCII:
+        return True
+    return not regexp.flags & re.IGNORECASE\
+        and UNICODE_CLASS.search(source) is None
 
 
 class TokenRule:
     def __init__(self, token_type):
         self.token_type = token_type
+        # the type id of the tokens (see `TokenTypes`)
+        self.type_id = None if token_type is None\
+            else TOKEN_TYPES.intern(token_type)
 
     @property
     def lookups(self):
         raise NotImplementedError("Abstract method")
 
+    @property
+    def lookup_ranges(self):
+        '''The lookups as a list of (min, max) code point intervals,
+        registered by the tokenizer without enumerating every character,
+        or None to use `lookups` instead.
+        '''
+        return None
+
+    @property
+    def literal_types(self):
+        '''The list of (literal, token type) pairs if the rule only
+        recognizes literals, or None.  Adjacent literal rules are merged
+        by the tokenizer in a longest match table.
+        '''
+        return None
+
+    @property
+    def pattern(self):
+        '''The regular expression (source) equivalent to the rule,
+        used by the compiled mode of the tokenizer, or None if the rule
+        cannot be compiled.
+        '''
+        return None
+
+    @property
+    def binary_ready(self):
+        '''True if the rule can recognize tokens on a binary backend (at
+        least for an ASCII input).
+        '''
+        return True
+
+    @property
+    def utf8_ready(self):
+        '''True if the rule recognizes the same tokens on the UTF-8 bytes
+        of any input as on its string.
+        '''
+        return self.binary_ready
+
+    @property
+    def binary_pattern(self):
+        '''The pattern matched on the UTF-8 bytes of a binary backend,
+        or None if its encoding would not be equivalent (e.g. for a class
+        of non-ASCII characters).
+        '''
+        pattern = self.pattern
+        if pattern is None or not pattern.isascii():
+            return None
+        return pattern
+
     def recognize(self, tokenizer):
         raise NotImplementedError("Abstract method")
 
+    def accept(self, tokenizer, end):
+        '''Build the token up to `end`, matched at the cursor by the
+        `pattern` of the rule (in compiled mode).
+        '''
+        start = tokenizer.offset
+        tokenizer.offset = end
+        backend = tokenizer.backend
+        if backend.lazy_values:  # the value is extracted on demand
+            return Token(self.token_type, None, start, end,
+                         tokenizer.line_index, backend, self.type_id)
+        return Token(self.token_type, backend.slice(start, end),
+                     start, end, tokenizer.line_index, None, self.type_id)
+
 
 class CharPredicate(TokenRule):
     def __init__(self, token_type):
@@ -30,12 +158,13 @@ class CharPredicate(TokenRule):
         raise NotImplementedError("Abstract methods")
 
     def recognize(self, tokenizer):
-        start_pos = tokenizer.position
+        start = tokenizer.offset
         next_ = tokenizer.peek_char()
         if (next_ is None) or (not self.predicate(next_)):
             return None
         tokenizer.forward()
-        return Token(self.token_type, next_, start_pos, tokenizer.position)
+        return Token(self.token_type, next_, start, tokenizer.offset,
+                     tokenizer.line_index, None, self.type_id)
 
 
 class Char(CharPredicate):
@@ -47,6 +176,14 @@ class Char(CharPredicate):
     def lookups(self):
         return {self.char}
 
+    @property
+    def pattern(self):
+        return re.escape(self.char)
+
+    @property
+    def binary_pattern(self):
+        return self.pattern
+
     def predicate(self, char):
         return char == self.char
 
@@ -60,6 +197,19 @@ class CharSet(CharPredicate):
     def lookups(self):
         return self.charset
 
+    @property
+    def pattern(self):
+        if all(char.isascii() for char in self.charset):
+            return '[' + ''.join(re.escape(char)
+                                 for char in self.charset) + ']'
+        # an alternative of characters is also valid on UTF-8 bytes
+        return '(?:' + '|'.join(re.escape(char)
+                                for char in self.charset) + ')'
+
+    @property
+    def binary_pattern(self):
+        return self.pattern
+
     def predicate(self, char):
         return char in self.charset
 
@@ -77,8 +227,55 @@ class CharInterval(CharPredicate):
                           in range(ord(self.min_char),
                                    ord(self.max_char) + 1)}
 
+    @property
+    def lookup_ranges(self):
+        return [(ord(self.min_char), ord(self.max_char))]
+
+    @property
+    def pattern(self):
+        return '[{0}-{1}]'.format(re.escape(self.min_char),
+                                  re.escape(self.max_char))
+
+    def predicate(self, char):
+        return self.min_char <= char <= self.max_char
+
+
+class CharCategory(CharPredicate):
+    '''Characters of the given Unicode categories, either major
+    (e.g. 'L' for letters) or minor (e.g. 'Lu' for uppercase letters).
+    '''
+    def __init__(self, token_type, *categories):
+        CharPredicate.__init__(self, token_type)
+        self.categories = frozenset(categories)
+        self.__ranges = None
+
+    @property
+    def lookups(self):
+        return {chr(code) for (min_code, max_code) in self.lookup_ranges
+                for code in range(min_code, max_code + 1)}
+
+    @property
+    def lookup_ranges(self):
+        if self.__ranges is None:
+            self.__ranges = sorted(code_range
+                                   for (category, ranges)
+                                   in category_ranges().items()
+                                   if category in self.categories
+                                   or category[0] in self.categories
+                                   for code_range in ranges)
+        return self.__ranges
+
+    @property
+    def pattern(self):
+        return '[' + ''.join('{0}-{1}'.format(re.escape(chr(min_code)),
+                                              re.escape(chr(max_code)))
+                             for (min_code, max_code)
+                             in self.lookup_ranges) + ']'
+
     def predicate(self, char):
-        return ord(self.min_char) <= ord(char) <= ord(self.max_char)
+        category = unicodedata.category(char)
+        return category in self.categories\
+            or category[0] in self.categories
 
 
 class Literal(TokenRule):
@@ -92,71 +289,281 @@ class Literal(TokenRule):
     def lookups(self):
         return {self.literal[0]}
 
+    @property
+    def literal_types(self):
+        return [(self.literal, self.token_type)]
+
+    @property
+    def pattern(self):
+        return re.escape(self.literal)
+
+    @property
+    def binary_pattern(self):
+        return self.pattern
+
     def recognize(self, tokenizer):
-        start_pos = tokenizer.position
+        start = tokenizer.offset
         if tokenizer.consume(self.literal):
             return Token(self.token_type, self.literal,
-                         start_pos, tokenizer.position)
+                         start, tokenizer.offset, tokenizer.line_index,
+                         None, self.type_id)
         else:
             return None
 
 
-class LiteralSet(TokenRule):
-    def __init__(self, token_type, *literals):
-        TokenRule.__init__(self, token_type)
-        self.literals = literals
+class LiteralTable(TokenRule):
+    '''A table of literals, possibly of distinct token types, recognized
+    by longest match.
+
+    The literals are bucketed by length, so that each distinct length
+    costs a single dict lookup.  If a literal is given more than once the
+    first token type wins.  A second table, by UTF-8 length, serves the
+    binary backends.
+    '''
+    def __init__(self, literal_types):
+        TokenRule.__init__(self, None)
+        self.__literal_types = []  # List[(str,str)] in priority order
+        self.__types = {}  # dict[str,(str,int)] with the type ids
+        for (literal, token_type) in literal_types:
+            assert len(literal) > 0
+            if literal not in self.__types:
+                self.__types[literal] = (token_type,
+                                         TOKEN_TYPES.intern(token_type))
+                self.__literal_types.append((literal, token_type))
+        # dict[bool,(dict[int,dict[str|bytes,str]],List[int])]
+        self.__tables = {binary: self.__table(binary)
+                         for binary in (False, True)}
         self.__lookups = None
 
+    def __table(self, binary):
+        table = {}
+        for (literal, _) in self.__literal_types:
+            entry = literal.encode('utf-8') if binary else literal
+            table.setdefault(len(entry), {})[entry] = literal
+        return (table, sorted(table, reverse=True))
+
+    @property
+    def literal_types(self):
+        return self.__literal_types
+
     @property
     def lookups(self):
         if not self.__lookups:
             self.__lookups = set()
-            for literal in self.literals:
+            for (literal, _) in self.__literal_types:
                 self.__lookups.add(literal[0])
         return self.__lookups
 
+    @property
+    def pattern(self):
+        # longest literals first, as the first alternative wins
+        literals = sorted((literal for (literal, _) in self.__literal_types),
+                          key=len, reverse=True)
+        return '(?:' + '|'.join(re.escape(literal)
+                                for literal in literals) + ')'
+
+    @property
+    def binary_pattern(self):
+        return self.pattern
+
+    def accept(self, tokenizer, end):
+        start = tokenizer.offset
+        backend = tokenizer.backend
+        (table, _) = self.__tables[backend.binary]
+        literal = table[end - start][backend.slice(start, end)]
+        tokenizer.offset = end
+        (token_type, type_id) = self.__types[literal]
+        return Token(token_type, literal, start, end, tokenizer.line_index,
+                     None, type_id)
+
     def recognize(self, tokenizer):
-        start_pos = tokenizer.position
-        for literal in self.literals:
-            if tokenizer.consume(literal):
-                return Token(self.token_type, literal,
-                             start_pos, tokenizer.position)
+        start = tokenizer.offset
+        backend = tokenizer.backend
+        (table, lengths) = self.__tables[backend.binary]
+        for length in lengths:
+            literal = table[length].get(backend.slice(start, start + length))
+            if literal is not None:
+                tokenizer.offset = start + length
+                (token_type, type_id) = self.__types[literal]
+                return Token(token_type, literal, start, start + length,
+                             tokenizer.line_index, None, type_id)
         # end of for, no matching literal found
         return None
 
 
+class LiteralSet(LiteralTable):
+    '''A set of literals of the same token type, the longest match wins.
+    '''
+    def __init__(self, token_type, *literals):
+        LiteralTable.__init__(self, [(literal, token_type)
+                                     for literal in literals])
+        self.token_type = token_type
+        self.type_id = TOKEN_TYPES.intern(token_type)
+        self.literals = literals
+
+
 class RegexpRule(TokenRule):
-    def __init__(self, token_type, regexp, lookups=None):
+    '''A token rule matching a regular expression at the current
+    offset of the input.
+
+    The match is anchored directly in the input buffer and cannot
+    extend past the end of the current line, unless `span_lines` is
+    set for patterns that legitimately match newlines.  With a binary
+    backend the match object of `build_token` is on (UTF-8) bytes.
+
+    The regexp is only matched on the bytes of a non-ASCII input if it
+    is equivalent there: its source is ASCII, without Unicode classes
+    (e.g. `\\w`) or case folding, unless the `re.ASCII` flag is set or
+    the rule is declared `utf8` explicitly.
+
+    A `build_token` overridden in the former signature `(match_obj,
+    parsed_str, start_pos, end_pos)`, with positions, is still called so
+    (and on str match objects only).
+    '''
+    def __init__(self, token_type, regexp, lookups=None, span_lines=False,
+                 utf8=False):
         TokenRule.__init__(self, token_type)
         self.regexp = re.compile(regexp)
+        self.__positional = positional_build_token(type(self))
+        try:  # the version of the regexp for the binary backends
+            self.binary_regexp = None if self.__positional else re.compile(
+                self.regexp.pattern.encode('utf-8'),
+                self.regexp.flags & ~re.UNICODE)
+        except re.error:  # e.g. a \u escape
+            self.binary_regexp = None
+        self.__utf8 = self.binary_regexp is not None\
+            and (utf8 or utf8_equivalent(self.regexp))
+        self.span_lines = span_lines
         self.__lookups = lookups
 
-    def build_token(self, match_obj, parsed_str, start_pos, end_pos):
+    def build_token(self, match_obj, parsed_str, start, end, index):
         raise NotImplementedError("Abstract method")
 
+    def make_token(self, match_obj, parsed_str, start, end, index):
+        '''Build the token with `build_token`, in its former signature
+        (with positions) if it is overridden so.
+        '''
+        if self.__positional:
+            return self.build_token(match_obj, parsed_str,
+                                    ParsePosition(start, index=index),
+                                    ParsePosition(end, index=index))
+        return self.build_token(match_obj, parsed_str, start, end, index)
+
     @property
     def lookups(self):
         return self.__lookups
 
+    @property
+    def pattern(self):
+        source = self.regexp.pattern
+        if BACKREFERENCE.search(source):
+            return None  # group numbers are shifted in a master pattern
+        flags = ''.join(letter for (flag, letter) in INLINE_FLAGS
+                        if self.regexp.flags & flag)
+        if flags:
+            return '(?' + flags + ':' + source + ')'
+        return '(?:' + source + ')'
+
+    @property
+    def binary_ready(self):
+        return self.binary_regexp is not None
+
+    @property
+    def utf8_ready(self):
+        return self.__utf8
+
+    @property
+    def binary_pattern(self):
+        # the rule is matched on the UTF-8 bytes in both modes
+        return self.pattern if self.binary_ready else None
+
+    def accept(self, tokenizer, _):
+        # the token is built from the own match object of the rule
+        return self.recognize(tokenizer)
+
+    def match(self, tokenizer):
+        '''Match the regexp (compiled for the backend) at the cursor.'''
+        if tokenizer.backend.binary:
+            return tokenizer.match(self.binary_regexp, self.span_lines)
+        return tokenizer.match(self.regexp, self.span_lines)
+
     def recognize(self, tokenizer):
-        start_pos = tokenizer.position
-        line = tokenizer.peek_line()
-        if line is None:
-            return None
-        match_obj = self.regexp.match(line)
+        start = tokenizer.offset
+        match_obj = self.match(tokenizer)
         if match_obj is None:
             return None
-        parsed_str = match_obj.group(0)  # entire match
-        ok = tokenizer.consume(parsed_str)
-        assert ok  # in case ...
-        return self.build_token(match_obj, parsed_str,
-                                start_pos, tokenizer.position)
+        end = tokenizer.match_end(match_obj)
+        parsed_str = tokenizer.substring(start, end)  # entire match
+        tokenizer.offset = end
+        return self.make_token(match_obj, parsed_str,
+                               start, end, tokenizer.line_index)
 
 
 class Regexp(RegexpRule):
-    def __init__(self, token_type, regexp, lookups=None):
-        RegexpRule.__init__(self, token_type, regexp, lookups)
+    '''A regular expression token rule.
+
+    An identifier-like rule may declare `keywords`, a dict from
+    lexemes to token types (or an iterable of lexemes that are their
+    own token type): a matched lexeme found in the table is promoted to
+    its keyword token type with a single lookup, instead of racing
+    with separate literal rules.
+    '''
+    def __init__(self, token_type, regexp, lookups=None, span_lines=False,
+                 keywords=None, utf8=False):
+        RegexpRule.__init__(self, token_type, regexp, lookups, span_lines,
+                            utf8)
+        if keywords is None:
+            self.keywords = {}
+        elif isinstance(keywords, dict):
+            self.keywords = dict(keywords)
+        else:
+            self.keywords = {keyword: keyword for keyword in keywords}
+        # the keywords looked up (without decoding) by binary backends
+        self.binary_keywords = {keyword.encode('utf-8'): token_type
+                                for (keyword, token_type)
+                                in self.keywords.items()}
+        # a subclass building its own tokens is given its match objects
+        self.__custom = type(self).build_token is not Regexp.build_token
+
+    def build_token(self, _, parsed_str, start, end, index):
+        token_type = self.keywords.get(parsed_str)
+        if token_type is None:
+            return Token(self.token_type, parsed_str, start, end, index,
+                         None, self.type_id)
+        return Token(token_type, parsed_str, start, end, index)
+
+    def lexeme_token(self, tokenizer, start, end):
+        tokenizer.offset = end
+        backend = tokenizer.backend
+        if not backend.lazy_values:
+            return self.build_token(None, backend.slice(start, end),
+                                    start, end, tokenizer.line_index)
+        if self.keywords:
+            keywords = self.binary_keywords if backend.binary\
+                else self.keywords
+            token_type = keywords.get(backend.slice(start, end))
+            if token_type is not None:
+                return Token(token_type, None, start, end,
+                             tokenizer.line_index, backend)
+        # the value is extracted on demand
+        return Token(self.token_type, None, start, end, tokenizer.line_index,
+                     backend, self.type_id)
 
-    def build_token(self, _, parsed_str, start_pos, end_pos):
-        return Token(self.token_type, parsed_str,
-                     start_pos, end_pos)
+    def recognize(self, tokenizer):
+        if self.__custom:
+            return RegexpRule.recognize(self, tokenizer)
+        match_obj = self.match(tokenizer)
+        if match_obj is None:
+            return None
+        return self.lexeme_token(tokenizer, tokenizer.offset,
+                                 tokenizer.match_end(match_obj))
+
+    def accept(self, tokenizer, end):
+        start = tokenizer.offset
+        if self.__custom:  # the token is built from a match object
+            return self.recognize(tokenizer)
+        if not self.span_lines\
+           and tokenizer.backend.find_newline(start, end) != -1:
+            # the line-bounded match may be shorter (or fail)
+            return self.recognize(tokenizer)
+        return self.lexeme_token(tokenizer, start, end)
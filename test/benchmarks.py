@@ -0,0 +1,684 @@
+'''Micro-benchmarks for the POP parser framework.
+
+Run from the test directory: python benchmarks.py
+'''
+
+import io
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+# run from the test directory: python benchmarks.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, "src"))
+
+from popparser import Grammar, codegen, parsers, tokens
+from popparser.llparser import LLParsing
+from popparser.table import TableParsing
+from popparser.tokenizer import Tokenizer, StrTokenizer
+
+from calculators import CalculatorEval
+from lambda_parser import LambdaParser
+from piparser import PiParser
+
+
+def bench(func, repeat=3):
+    '''Return the best wall-clock time (in seconds) of `repeat` runs.'''
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def tokenize_all(tokenizer):
+    count = 0
+    while True:
+        token = tokenizer.next()
+        if token.iseof or token.iserror:
+            return count
+        tokenizer.peek()  # every parser peeks before it consumes
+        count += 1
+
+
+def bench_tokenizer_scaling(sizes=(500, 1000, 2000, 4000)):
+    '''Tokenizing time should grow linearly with the input size.'''
+    print("Tokenizer scaling (calculator tokens, one expression per line)")
+    line = "(12 + 3) × 4 - 5 / 6\n"
+    previous = None
+    for size in sizes:
+        input_ = line * size
+
+        def run():
+            tokenizer = CalculatorEval.calculator_tokenizer()
+            tokenizer.from_string(input_)
+            tokenize_all(tokenizer)
+
+        elapsed = bench(run)
+        ratio = "" if previous is None\
+            else "  (x{0:.2f})".format(elapsed / previous)
+        print("  {0:>7} chars: {1:.4f}s{2}".format(len(input_),
+                                                  elapsed, ratio))
+        previous = elapsed
+
+
+def bench_long_line(sizes=(5000, 10000, 20000, 40000)):
+    '''Regexp tokens on a single (minified) line should scale linearly.'''
+    print("Long line scaling (identifiers on a single line)")
+    tokenizer = Tokenizer()
+    tokenizer.add_rule(tokens.Char('space', ' '))
+    tokenizer.add_rule(tokens.Regexp('ident', '[a-z][a-z0-9]*'))
+    previous = None
+    for size in sizes:
+        input_ = "abc de1 f " * size
+
+        def run():
+            tokenizer.from_string(input_)
+            tokenize_all(tokenizer)
+
+        elapsed = bench(run)
+        ratio = "" if previous is None\
+            else "  (x{0:.2f})".format(elapsed / previous)
+        print("  {0:>7} chars: {1:.4f}s{2}".format(len(input_),
+                                                  elapsed, ratio))
+        previous = elapsed
+
+
+def overlapping_tokenizer():
+    '''Regexp rules without lookups: all of them compete for each token.'''
+    tokenizer = Tokenizer()
+    tokenizer.add_trivia(tokens.Char('space', ' '))
+    tokenizer.add_rule(tokens.Regexp('date', r'[0-9]{4}-[0-9]{2}-[0-9]{2}'))
+    tokenizer.add_rule(tokens.Regexp('hex', r'0x[0-9a-f]+'))
+    tokenizer.add_rule(tokens.Regexp('float', r'[0-9]+\.[0-9]+'))
+    tokenizer.add_rule(tokens.Regexp('int', r'[0-9]+'))
+    tokenizer.add_rule(tokens.Regexp('name', r'[a-z_]+'))
+    return tokenizer
+
+
+def bench_compiled_lexer(size=2000):
+    '''Compare the interpreted and compiled modes of the tokenizer.'''
+    print("Compiled lexer (interpreted vs compiled)")
+    inputs = (("calculator", CalculatorEval.calculator_tokenizer,
+               "(12 + 3) × 4 - 5 / 6.25\n" * size),
+              ("pi-calculus", PiParser.pi_tokenizer,
+               "new(a) <gc> new(bla_9) tau skip end \t" * size),
+              ("overlapping", overlapping_tokenizer,
+               "2024-01-02 0x1f 3.25 42 level_name " * size))
+    for (name, make_tokenizer, input_) in inputs:
+        timings = []
+        for compiled in (False, True):
+            tokenizer = make_tokenizer()
+            if compiled:
+                tokenizer.compile()
+
+            def run():
+                tokenizer.from_string(input_)
+                tokenize_all(tokenizer)
+
+            timings.append(bench(run))
+        print("  {0:<12} interpreted: {1:.4f}s  compiled: {2:.4f}s"
+              .format(name, timings[0], timings[1]))
+
+
+def bench_wide_interval():
+    '''Registering a wide character class costs O(1).'''
+    print("Wide character classes")
+    input_ = "λx. ñandú + 北京 " * 1000
+
+    def run():
+        tokenizer = Tokenizer()
+        tokenizer.add_rule(tokens.CharSet('space', ' ', '.', '+'))
+        tokenizer.add_rule(tokens.CharInterval('char', '\u0080',
+                                               '\U0010ffff'))
+        tokenizer.add_rule(tokens.CharInterval('char', 'a', 'z'))
+        tokenizer.from_string(input_)
+        tokenize_all(tokenizer)
+
+    print("  registration and tokenizing: {0:.4f}s".format(bench(run)))
+    tokens.category_ranges()  # computed once per process
+
+    def run_categories():
+        tokenizer = Tokenizer()
+        tokenizer.add_rule(tokens.CharSet('space', ' ', '.', '+'))
+        tokenizer.add_rule(tokens.CharCategory('letter', 'L'))
+        tokenizer.from_string(input_)
+        tokenize_all(tokenizer)
+
+    print("  with a Unicode category: {0:.4f}s".format(
+        bench(run_categories)))
+
+
+KEYWORDS = ("if", "in", "int", "import", "is", "interface", "implements",
+            "else", "elif", "enum", "extends", "export", "except", "exec",
+            "for", "from", "final", "finally", "float", "false", "func",
+            "def", "del", "do", "double", "default", "defer", "delete",
+            "case", "catch", "char", "class", "const", "continue")
+
+
+def bench_keywords(size=2000):
+    '''Keyword-heavy input with dozens of literals per leading char.'''
+    print("Keyword literals (longest match tables)")
+    input_ = (" ".join(KEYWORDS) + " ") * size
+    for compiled in (False, True):
+        tokenizer = Tokenizer()
+        tokenizer.add_rule(tokens.Char('space', ' '))
+        for keyword in KEYWORDS:
+            tokenizer.add_rule(tokens.Literal(keyword, keyword))
+        if compiled:
+            tokenizer.compile()
+
+        def run():
+            tokenizer.from_string(input_)
+            tokenize_all(tokenizer)
+
+        print("  {0}: {1:.4f}s".format("compiled" if compiled
+                                       else "interpreted", bench(run)))
+
+
+def bench_keyword_promotion(size=2000):
+    '''Keyword literal rules vs. keywords promoted from identifiers.'''
+    print("Keyword promotion (pi-calculus keywords)")
+
+    def literal_tokenizer():
+        tokenizer = Tokenizer()
+        tokenizer.add_trivia(tokens.CharSet('space', ' ', '\t', '\r'))
+        tokenizer.add_rule(tokens.Char('lparen', '('))
+        tokenizer.add_rule(tokens.Char('rparen', ')'))
+        tokenizer.add_rule(tokens.Regexp('name', r'[a-zA-Z_][a-zA-Z0-9_]*'))
+        tokenizer.add_rule(tokens.LiteralSet('term', '0', 'nil', 'end'))
+        tokenizer.add_rule(tokens.LiteralSet('new', 'new', 'res'))
+        tokenizer.add_rule(tokens.Literal('gc', '<gc>'))
+        tokenizer.add_rule(tokens.LiteralSet('tau', 'tau', 'skip'))
+        return tokenizer
+
+    input_ = "new(a) res(b) tau skip nil end newton " * size
+    for (name, make_tokenizer) in (("literal rules", literal_tokenizer),
+                                   ("keyword table", PiParser.pi_tokenizer)):
+        tokenizer = make_tokenizer()
+
+        def run():
+            tokenizer.from_string(input_)
+            tokenize_all(tokenizer)
+
+        print("  {0}: {1:.4f}s".format(name, bench(run)))
+
+
+def bench_lookahead(size=20):
+    '''Count the tokens served by the lookahead buffer of LLParsing.'''
+    print("Lookahead buffer (calculator grammar)")
+    grammar = CalculatorEval.calculator_grammar()
+    input_ = " + ".join(["(12 + 3) × 4 - 5 / 6"] * size)
+    tokenizer = CalculatorEval.calculator_tokenizer()
+    parser = LLParsing(grammar)
+    parser.tokenizer = tokenizer
+    tokenizer.from_string(input_)
+    parser.parse()
+    print("  hits={0} misses={1}".format(parser.lookahead_hits,
+                                         parser.lookahead_misses))
+
+
+def bench_token_memory(size=1000):
+    '''Measure the memory held by each token (with its positions).'''
+    print("Token memory (calculator tokens)")
+    input_ = "(12 + 3) × 4 - 5 / 6\n" * size
+    tokenizer = CalculatorEval.calculator_tokenizer()
+    tokenizer.from_string(input_)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    recognized = []
+    while True:
+        token = tokenizer.next()
+        if token.iseof or token.iserror:
+            break
+        recognized.append(token)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    print("  {0} tokens: {1:.1f} bytes/token".format(len(recognized),
+                                                   size / len(recognized)))
+
+
+def bench_file_backend(size=20000):
+    '''Peak (Python) memory of tokenizing a file, read or mapped.'''
+    print("File backend (calculator tokens)")
+    with tempfile.NamedTemporaryFile('wb', delete=False) as input_file:
+        input_file.write(("(12 + 3) × 4 - 5 / 6\n" * size).encode('utf-8'))
+    tokenizer = CalculatorEval.calculator_tokenizer()
+
+    def read():
+        with open(input_file.name, encoding='utf-8') as text_file:
+            tokenizer.from_string(text_file.read())
+
+    def mapped():
+        tokenizer.from_file(input_file.name)
+
+    for (name, open_input) in (("from_string", read),
+                               ("from_file", mapped)):
+        tracemalloc.start()
+        open_input()
+        tokenize_all(tokenizer)
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        elapsed = bench(lambda: (open_input(), tokenize_all(tokenizer)))
+        print("  {0:<12} peak: {1:>8.1f} KiB  time: {2:.4f}s"
+              .format(name, peak / 1024, elapsed))
+    tokenizer.backend.close()
+    os.unlink(input_file.name)
+
+
+def bench_ascii_backend(size=4000):
+    '''Compare the str and bytes backends on an ASCII input.'''
+    print("ASCII input (str vs bytes backend)")
+    input_ = "(12 + 3) * 4 - 5 / 6.25\n" * size
+    for compiled in (False, True):
+        timings = []
+        for backend in (StrTokenizer, None):
+            tokenizer = CalculatorEval.calculator_tokenizer()
+            if compiled:
+                tokenizer.compile()
+
+            def run():
+                if backend is None:  # selected by from_string
+                    tokenizer.from_string(input_)
+                else:
+                    tokenizer.backend = backend(tokenizer, input_)
+                tokenize_all(tokenizer)
+
+            timings.append(bench(run))
+        print("  {0:<12} str: {1:.4f}s  bytes: {2:.4f}s"
+              .format("compiled" if compiled else "interpreted",
+                      timings[0], timings[1]))
+
+
+def bench_stream_backend(size=20000):
+    '''Peak (Python) memory of tokenizing a stream, committing each token.'''
+    print("Stream backend (calculator tokens)")
+    input_ = ("(12 + 3) × 4 - 5 / 6\n" * size).encode('utf-8')
+    tokenizer = CalculatorEval.calculator_tokenizer()
+    def read():
+        tokenizer.from_string(input_.decode('utf-8'))
+
+    def stream():
+        tokenizer.from_stream(io.BytesIO(input_), chunk_size=4096)
+
+    for (name, open_input) in (("from_string", read),
+                               ("from_stream", stream)):
+        def run():
+            open_input()
+            while not tokenizer.next().iseof:
+                tokenizer.commit(tokenizer.mark())
+
+        tracemalloc.start()
+        run()
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("  {0:<12} peak: {1:>8.1f} KiB  time: {2:.4f}s"
+              .format(name, peak / 1024, bench(run)))
+
+
+def parse_allocations(parse):
+    '''Return the peak traced memory of `parse()`, and the number of
+    memory blocks allocated by the parse and still alive with its result.
+    '''
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = parse()
+    (_, peak) = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before,
+                                                              'filename'))
+    assert not result.iserror
+    return (peak, blocks)
+
+
+def bench_parse_allocations(size=20, depth=6):
+    '''Memory allocated by parsing the calculator and lambda inputs.'''
+    print("Parse allocations")
+    calculator = CalculatorEval()
+    lambda_parser = LambdaParser()
+    lambda_input = "(λx:Bool. x:Bool y:Bool)"
+    for _ in range(depth):  # a term of size 2^depth
+        lambda_input = "(λf:Fun. {0} {0})".format(lambda_input)
+    inputs = (("calculator", calculator.parse_from_string,
+               " + ".join(["(12 + 3) × 4 - 5 / 6"] * size)),
+              ("lambda", lambda_parser.parse_from_string, lambda_input))
+    for (name, parse, input_) in inputs:
+        (peak, blocks) = parse_allocations(lambda: parse(input_))
+        elapsed = bench(lambda: parse(input_))
+        print("  {0:<12} peak: {1:>7.1f} KiB  blocks: {2:>6}  "
+              "time: {3:.4f}s".format(name, peak / 1024, blocks, elapsed))
+
+
+def bench_failure_paths(size=2000):
+    '''Optional elements in a repetition: one discarded error each,
+    unless predicted (compiled grammar).'''
+    print("Failure paths (optional signs in a repetition)")
+    tokenizer = Tokenizer()
+    tokenizer.add_rule(tokens.Char('sign', '-'))
+    tokenizer.add_rule(tokens.Regexp('number', '[0-9]+'))
+    tokenizer.add_trivia(tokens.Char('space', ' '))
+    input_ = "12 -3 45 6 " * size
+    for predicted in (False, True):
+        grammar = Grammar()
+        grammar.register('init', parsers.List(
+            parsers.Tuple().element(parsers.Optional(parsers.Token('sign')))
+                           .element(parsers.Token('number'))))
+        if predicted:
+            grammar.compile()
+        parser = LLParsing(grammar)
+        parser.tokenizer = tokenizer
+
+        def run():
+            tokenizer.from_string(input_)
+            parser.parse()
+
+        print("  {0:<10} {1} elements: {2:.4f}s"
+              .format("predicted" if predicted else "attempted",
+                      4 * size, bench(run)))
+
+
+def bench_compiled_grammar(depth=6):
+    '''Parsing with a grammar as registered, or compiled.'''
+    print("Compiled grammar (lambda terms)")
+    lambda_parser = LambdaParser()
+    input_ = "(λx:Bool. x:Bool y:Bool)"
+    for _ in range(depth):
+        input_ = "(λf:Fun. {0} {0})".format(input_)
+    for compiled in (False, True):
+        grammar = Grammar()
+        lambda_parser.prepare_grammar(grammar)
+        if compiled:
+            grammar.compile()
+        tokenizer = Tokenizer()
+        lambda_parser.prepare_tokenizer(tokenizer)
+        parser = LLParsing(grammar)
+        parser.tokenizer = tokenizer
+
+        def run():
+            tokenizer.from_string(input_)
+            parser.parse()
+
+        first = bench(run, repeat=1)
+        print("  {0:<12} first parse: {1:.4f}s  next: {2:.4f}s"
+              .format("compiled" if compiled else "registered",
+                      first, bench(run)))
+
+
+def bench_packrat_memo(size=500, depth=6):
+    '''Parsing without and with the memo of the grammar rules.'''
+    print("Packrat memo (optional rules, lambda terms)")
+    grammar = Grammar()
+    grammar.register('sign', parsers.Token('sign'))
+    grammar.register('number', parsers.Tuple()
+                     .element(parsers.Optional(grammar.ref('sign')))
+                     .element(parsers.Optional(grammar.ref('sign')))
+                     .element(parsers.Token('number')))
+    grammar.register('init', parsers.List(grammar.ref('number')))
+    tokenizer = Tokenizer()
+    tokenizer.add_rule(tokens.Char('sign', '-'))
+    tokenizer.add_rule(tokens.Regexp('number', '[0-9]+'))
+    tokenizer.add_trivia(tokens.Char('space', ' '))
+    lambda_grammar = Grammar()
+    lambda_parser = LambdaParser()
+    lambda_parser.prepare_grammar(lambda_grammar)
+    lambda_tokenizer = Tokenizer()
+    lambda_parser.prepare_tokenizer(lambda_tokenizer)
+    lambda_input = "(λx:Bool. x:Bool y:Bool)"
+    for _ in range(depth):
+        lambda_input = "(λf:Fun. {0} {0})".format(lambda_input)
+    for (name, grammar, tokenizer, input_) in \
+            (("optional", grammar, tokenizer, "12 -3 45 --6 " * size),
+             ("lambda", lambda_grammar, lambda_tokenizer, lambda_input)):
+        for memo in (False, True):
+            parser = LLParsing(grammar, memo=memo)
+            parser.tokenizer = tokenizer
+
+            def run():
+                tokenizer.from_string(input_)
+                parser.parse()
+
+            elapsed = bench(run)
+            print("  {0:<8} {1:<7} {2:.4f}s  hits: {3}  misses: {4}"
+                  .format(name, "memo" if memo else "no memo", elapsed,
+                          parser.memo_hits, parser.memo_misses))
+
+
+def bench_ordered_choice(size=1000):
+    '''Ordered choice of statements sharing their prefix (a call).'''
+    print("Ordered choice (statements starting with a call)")
+    tokenizer = Tokenizer()
+    tokenizer.add_rule(tokens.Regexp('ident', '[a-z]+'))
+    tokenizer.add_rule(tokens.Regexp('number', '[0-9]+'))
+    for (token_type, char) in (('assign', '='), ('lparen', '('),
+                               ('rparen', ')'), ('semi', ';'),
+                               ('dot', '.')):
+        tokenizer.add_rule(tokens.Char(token_type, char))
+    tokenizer.add_trivia(tokens.Char('space', ' '))
+    input_ = "f(1 2 3).x = 4; g(5 6); h(7) = 8; 9; " * size
+    for memo in (False, True):
+        grammar = Grammar()
+        grammar.register('call', parsers.Tuple()
+                         .element(parsers.Token('ident'))
+                         .element(parsers.List(parsers.Token('number'),
+                                               open='lparen',
+                                               close='rparen')))
+        grammar.register('field', parsers.Tuple().element(grammar.ref('call'))
+                         .skip(parsers.Token('dot'))
+                         .element(parsers.Token('ident')))
+        grammar.register('assign', parsers.OrderedChoice()
+                         .either(grammar.ref('field'))
+                         .orelse(grammar.ref('call')))
+        grammar.register('statement', parsers.OrderedChoice()
+                         .either(parsers.Tuple()
+                                 .element(grammar.ref('assign'))
+                                 .skip(parsers.Token('assign'))
+                                 .element(parsers.Token('number')))
+                         .orelse(grammar.ref('call'))
+                         .orelse(parsers.Token('number')))
+        grammar.entry = parsers.Repeat(parsers.Tuple()
+                                       .element(grammar.ref('statement'))
+                                       .skip(parsers.Token('semi')))
+        grammar.compile()
+        parser = LLParsing(grammar, memo=memo)
+        parser.tokenizer = tokenizer
+
+        def run():
+            tokenizer.from_string(input_)
+            parser.parse()
+
+        elapsed = bench(run)
+        print("  {0:<7} {1} statements: {2:.4f}s  hits: {3}  misses: {4}"
+              .format("memo" if memo else "no memo", 4 * size, elapsed,
+                      parser.memo_hits, parser.memo_misses))
+
+
+def bench_generated_parsers(size=20, depth=8):
+    '''The example grammars, interpreted (compiled) or generated.'''
+    print("Generated parsers (example grammars)")
+    lambda_parser = LambdaParser()
+
+    def lambda_grammar():
+        grammar = Grammar()
+        lambda_parser.prepare_grammar(grammar)
+        return grammar
+
+    def lambda_tokenizer():
+        tokenizer = Tokenizer()
+        lambda_parser.prepare_tokenizer(tokenizer)
+        return tokenizer
+
+    lambda_input = "(λx:Bool. x:Bool y:Bool)"
+    for _ in range(depth):
+        lambda_input = "(λf:Fun. {0} {0})".format(lambda_input)
+    examples = (("calculator", CalculatorEval.calculator_grammar,
+                 CalculatorEval.calculator_tokenizer,
+                 " + ".join(["(12 + 3) × 4 - 5 / 6"] * size)),
+                ("lambda", lambda_grammar, lambda_tokenizer, lambda_input),
+                ("pi", PiParser.pi_grammar, PiParser.pi_tokenizer,
+                 "new(a) <gc> " * (2 * size) + "end"))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for (name, make_grammar, make_tokenizer, input_) in examples:
+            timings = []
+            for generated in (False, True):
+                if generated:
+                    grammar = codegen.generate_grammar(make_grammar(),
+                                                       cache_dir)
+                else:
+                    grammar = make_grammar().compile()
+                tokenizer = make_tokenizer()
+                parser = LLParsing(grammar)
+                parser.tokenizer = tokenizer
+
+                def run():
+                    tokenizer.from_string(input_)
+                    assert not parser.parse().iserror
+
+                timings.append(bench(run))
+            print("  {0:<12} interpreted: {1:.4f}s  generated: {2:.4f}s"
+                  .format(name, *timings))
+        timings = []
+        for _ in range(2):  # the second generation hits the cache
+            timings.append(bench(lambda: codegen.generate_grammar(
+                CalculatorEval.calculator_grammar(), cache_dir), repeat=1))
+        print("  generation: {0:.4f}s  cached: {1:.4f}s".format(*timings))
+
+
+def bench_table_parsing(size=20, depth=8, nesting=20000):
+    '''The example grammars, parsed recursively or with the parse table
+    (and an input too deep for the recursive parser).'''
+    print("Table parsing (example grammars)")
+    lambda_parser = LambdaParser()
+
+    def lambda_tokenizer():
+        tokenizer = Tokenizer()
+        lambda_parser.prepare_tokenizer(tokenizer)
+        return tokenizer
+
+    lambda_input = "(λx:Bool. x:Bool y:Bool)"
+    for _ in range(depth):
+        lambda_input = "(λf:Fun. {0} {0})".format(lambda_input)
+    examples = (("calculator", CalculatorEval.calculator_grammar(),
+                 CalculatorEval.calculator_tokenizer,
+                 " + ".join(["(12 + 3) × 4 - 5 / 6"] * size)),
+                ("lambda", lambda_parser.grammar, lambda_tokenizer,
+                 lambda_input),
+                ("pi", PiParser.pi_grammar(), PiParser.pi_tokenizer,
+                 "new(a) <gc> " * (2 * size) + "end"),
+                ("deep lambda", lambda_parser.grammar, lambda_tokenizer,
+                 "(" * nesting + "x:A" + " y:B)" * nesting))
+    for (name, grammar, make_tokenizer, input_) in examples:
+        timings = []
+        for parsing in (LLParsing, TableParsing):
+            tokenizer = make_tokenizer()
+            parser = parsing(grammar)
+            parser.tokenizer = tokenizer
+
+            def run():
+                tokenizer.from_string(input_)
+                assert not parser.parse().iserror
+
+            try:
+                timings.append("{0:.4f}s".format(bench(run)))
+            except RecursionError:
+                timings.append("RecursionError")
+        print("  {0:<12} recursive: {1}  table: {2}".format(name, *timings))
+
+
+def bench_expression_driver(size=200, max_depth=2 ** 17):
+    '''Throughput of the calculator, and the deepest nesting parsed.'''
+    print("Expression driver (calculator)")
+    grammar = CalculatorEval.calculator_grammar().compile()
+    tokenizer = CalculatorEval.calculator_tokenizer()
+    parser = LLParsing(grammar)
+    parser.tokenizer = tokenizer
+
+    def parse(input_):
+        tokenizer.from_string(input_)
+        return parser.parse()
+
+    input_ = " + ".join(["(12 + 3) × 4 - 5 / 6"] * size)
+    elapsed = bench(lambda: parse(input_))
+    print("  throughput: {0:.0f} operators/s".format(5 * size / elapsed))
+    examples = (("sum chain", lambda depth: "+".join(["1"] * depth)),
+                ("parentheses", lambda depth: "(" * depth + "1" + ")" * depth),
+                ("prefix", lambda depth: "-" * depth + "1"))
+    for (name, make_input) in examples:
+        depth = 64
+        deepest = 0
+        while depth <= max_depth:
+            try:
+                assert not parse(make_input(depth)).iserror
+            except RecursionError:
+                break
+            deepest = depth
+            depth *= 2
+        print("  {0:<12} deepest: {1}{2}".format(
+            name, deepest, "+" if deepest == max_depth else ""))
+
+
+def bench_token_dispatch(size=2000, width=40):
+    '''A list of statements starting with `width` distinct keywords (with
+    long token type names), the spaces are forget parsers.'''
+    print("Token dispatch ({0} keywords)".format(width))
+    names = ["statement_keyword_{0}".format(i) for i in range(width)]
+    grammar = Grammar()
+    statement = parsers.Choice()
+    for name in names:
+        statement.orelse(parsers.Tuple().element(parsers.Token(name))
+                         .element(parsers.Token("number_literal")
+                                  .forget(parsers.Token("whitespace"))))
+    grammar.entry = parsers.Tuple()\
+                           .element(parsers.List(statement, sep="semicolon")
+                                    .forget(parsers.Token("whitespace")))\
+                           .element(parsers.EOF())
+    grammar.compile()
+
+    def make_tokenizer():
+        tokenizer = Tokenizer()
+        # the token types are equal but distinct strings
+        tokenizer.add_rule(tokens.Regexp(
+            "identifier", r"[a-z][a-z0-9_]*",
+            keywords={"kw{0}".format(i): "statement_keyword_{0}".format(i)
+                      for i in range(width)}))
+        tokenizer.add_rule(tokens.Regexp("number_literal", r"[0-9]+"))
+        tokenizer.add_rule(tokens.Char("semicolon", ";"))
+        tokenizer.add_rule(tokens.Regexp("whitespace", r"[ ]+"))
+        return tokenizer
+
+    input_ = ";".join(" kw{0} {1} ".format(i % width, i)
+                      for i in range(size))
+    timings = []
+    for parsing in (LLParsing, TableParsing):
+        tokenizer = make_tokenizer()
+        parser = parsing(grammar)
+        parser.tokenizer = tokenizer
+
+        def run():
+            tokenizer.from_string(input_)
+            assert not parser.parse().iserror
+
+        timings.append(bench(run))
+    print("  recursive: {0:.4f}s  table: {1:.4f}s".format(*timings))
+
+
+if __name__ == "__main__":
+    bench_tokenizer_scaling()
+    bench_long_line()
+    bench_compiled_lexer()
+    bench_wide_interval()
+    bench_keywords()
+    bench_keyword_promotion()
+    bench_lookahead()
+    bench_token_memory()
+    bench_file_backend()
+    bench_ascii_backend()
+    bench_stream_backend()
+    bench_parse_allocations()
+    bench_failure_paths()
+    bench_compiled_grammar()
+    bench_packrat_memo()
+    bench_ordered_choice()
+    bench_generated_parsers()
+    bench_table_parsing()
+    bench_expression_driver()
+    bench_token_dispatch()
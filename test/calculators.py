@@ -17,7 +17,7 @@ from popparser.tokenizer import Tokenizer
 
 class CalculatorEval:
     def __init__(self):
-        self.grammar = CalculatorEval.calculator_grammar()
+        self.grammar = CalculatorEval.calculator_grammar().compile()
 
     @staticmethod
     def calculator_tokenizer():
@@ -35,8 +35,8 @@ class CalculatorEval:
         tokenizer.add_rule(tokens.Char('div', '/'))
         tokenizer.add_rule(tokens.Char('div', '÷'))
 
-        # spaces
-        tokenizer.add_rule(tokens.CharSet('space', ' ', '\t', '\r'))
+        # spaces (trivia never reach the parsers)
+        tokenizer.add_trivia(tokens.CharSet('space', ' ', '\t', '\r'))
         tokenizer.add_rule(tokens.Char('newline', '\n'))
 
         # numbers
@@ -52,14 +52,9 @@ class CalculatorEval:
         grammar = Grammar()
 
         grammar.entry = parsers.Tuple().element(grammar.ref('expr'))\
-                                       .skip(grammar.ref('spaces'))\
                                        .skip(parsers.EOF())
 
-        spaces_parser = parsers.Repeat(parsers.Token('space'), minimum=0)
-        grammar.register('spaces', spaces_parser)
-
         expr_parser = expr.ExprParser()\
-            .skip_token('space')\
             .register('add', CalculatorEval.AddOperator())\
             .register('sub', CalculatorEval.SubOperator())\
             .register('mult', CalculatorEval.MultOperator())\
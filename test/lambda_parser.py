@@ -55,6 +55,7 @@ class LambdaParser:
     def __init__(self):
         self.grammar = Grammar()
         self.prepare_grammar(self.grammar)
+        self.grammar.compile()
 
     def prepare_tokenizer(self, tokenizer):
         # reserved symbols
@@ -60,8 +60,10 @@ class PiParser:
     def pi_tokenizer():
         tokenizer = Tokenizer()
 
+        # spaces (trivia never reach the parsers)
+        tokenizer.add_trivia(tokens.CharSet('space', ' ', '\t', '\r'))
+
         # punctuation
-        tokenizer.add_rule(tokens.CharSet('space', ' ', '\t', '\r'))
         tokenizer.add_rule(tokens.Char('lparen', '('))
         tokenizer.add_rule(tokens.Char('rparen', ')'))
         tokenizer.add_rule(tokens.Char('lbracket', '['))
@@ -69,15 +71,19 @@ class PiParser:
         tokenizer.add_rule(tokens.Char('bang', '!'))
         tokenizer.add_rule(tokens.Char('what', '?'))
 
-        # identifiers
+        # identifiers and keywords
         tokenizer.add_rule(tokens.Regexp('name',
-                                         r'[a-zA-Z_][a-zA-Z0-9_]*'))
+                                         r'[a-zA-Z_][a-zA-Z0-9_]*',
+                                         keywords={'nil': 'term',
+                                                   'end': 'term',
+                                                   'new': 'new',
+                                                   'res': 'new',
+                                                   'tau': 'tau',
+                                                   'skip': 'tau'}))
 
         # process elements
-        tokenizer.add_rule(tokens.LiteralSet('term', '0', 'nil', 'end'))
-        tokenizer.add_rule(tokens.LiteralSet('new', 'new', 'res'))
+        tokenizer.add_rule(tokens.Char('term', '0'))
         tokenizer.add_rule(tokens.Literal('gc', '<gc>'))
-        tokenizer.add_rule(tokens.LiteralSet('tau', 'tau', 'skip'))
 
         tokenizer.add_rule(tokens.Regexp('output',
                                          r'([a-zA-Z_][a-zA-Z0-9_]*)!([a-zA-Z_][a-zA-Z0-9_]*)'))
@@ -90,10 +96,6 @@ class PiParser:
     def pi_grammar():
         grammar = Grammar()
 
-        # spaces
-        spaces_parser = parsers.Repeat(parsers.Token('space'), minimum=0)
-        grammar.register('spaces', spaces_parser)
-        
         # end of process
         grammar.register('term', parsers.Token('term'))
 
@@ -102,7 +104,6 @@ class PiParser:
                                          .skip(parsers.Token('lparen'))\
                                          .element(parsers.Token('name'))\
                                          .skip(parsers.Token('rparen'))\
-                                         .skip(grammar.ref('spaces'))\
                                          .element(grammar.ref('expr'))
 
         def restrict_xform_content(result):
@@ -114,7 +115,6 @@ class PiParser:
 
         # GC process
         gc_parser = parsers.Tuple().skip(parsers.Token('gc'))\
-                                   .skip(grammar.ref('spaces'))\
                                    .element(grammar.ref('expr'))
 
         def gc_xform_content(result):
@@ -125,7 +125,6 @@ class PiParser:
         
         # process expression parser
         expr_parser = expr.ExprParser()\
-                          .skip_token('space')\
                           .register('term', PiParser.TermAtom())\
                           .register('new', expr.parsers.Embed(restrict_parser))\
                           .register('gc', expr.parsers.Embed(gc_parser))
@@ -133,7 +132,6 @@ class PiParser:
         grammar.register('expr', expr_parser)
 
         grammar.entry = parsers.Tuple().element(grammar.ref('expr'))\
-                                       .skip(grammar.ref('spaces'))\
                                        .skip(parsers.EOF())
         
         return grammar
@@ -145,7 +143,7 @@ class PiParser:
     @staticmethod
     def parse_from_string(string):
         tokenizer = PiParser.pi_tokenizer()
-        parser = LLParsing(PiParser.pi_grammar())
+        parser = LLParsing(PiParser.pi_grammar().compile())
         parser.tokenizer = tokenizer
         tokenizer.from_string(string)
         return parser.parse()
@@ -10,15 +10,28 @@ if __name__ == "__main__":
     sys.path.append("../src")
 
 
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import random
+import sys
+import tempfile
 import unittest
+import warnings
 
 
-from popparser import Tokenizer
+from popparser import ParseException, Tokenizer, codegen
+from popparser.tokenizer import BytesTokenizer, StrTokenizer, Token
 from popparser.grammar import Grammar
-from popparser.llparser import LLParsing
+from popparser.llparser import LLParsing, ParsePosition
+from popparser.table import TableParsing
 import popparser.parsers as parse
 import popparser.tokens as tok
 
+from calculators import CalculatorEval
+from lambda_parser import LambdaParser
+from piparser import PiParser
+
 
 class TestTokens(unittest.TestCase):
     def test_char_token(self):
@@ -55,6 +68,320 @@ class TestTokens(unittest.TestCase):
         eof_tok = tokens.next()
         self.assertTrue(eof_tok.iseof)
 
+    def test_lazy_positions(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('word', '[a-z]+'))
+        tokens.add_rule(tok.Char('newline', '\n'))
+        tokens.from_string("ab\n\ncde")
+        words = [tokens.next() for _ in range(4)]
+        self.assertTrue(words[2].start == 3)
+        self.assertTrue(str(words[1].end_pos) == 'line=2, char=1')
+        self.assertTrue(str(words[3].start_pos) == 'line=3, char=1')
+        self.assertTrue(str(words[3].end_pos) == 'line=3, char=4')
+        self.assertTrue(words[3].end_pos == ParsePosition(7, 3, 4))
+
+    def test_lazy_values(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('word', '[a-zλ]+'))
+        tokens.add_trivia(tok.Char('space', ' '))
+        for input_ in ("ab cd", "λb cd"):
+            tokens.from_string(input_)
+            token = tokens.next()
+            self.assertTrue(token.source is tokens.backend)
+            self.assertFalse(hasattr(token, '__dict__'))
+            tokens.from_string("xyz")  # the token keeps its own input
+            self.assertTrue(token.value == input_[:2])
+            self.assertTrue(token.value is token.value)
+
+    def test_regexp_lines(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('text', '[a-z\\s]+'))
+        tokens.from_string("ab c\nde")
+        self.assertTrue(tokens.next().value == 'ab c')
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('text', '[a-z\\s]+', span_lines=True))
+        tokens.from_string("ab c\nde")
+        self.assertTrue(tokens.next().value == 'ab c\nde')
+        self.assertTrue(tokens.next().iseof)
+
+    def test_compiled_mode(self):
+        def tokenize(tokens, input_):
+            tokens.from_string(input_)
+            result = []
+            while not tokens.at_eof:
+                token = tokens.next()
+                result.append((token.token_type, token.value))
+                if token.iserror:
+                    tokens.forward()
+            return result
+
+        class Digit(tok.CharPredicate):  # no pattern: not compilable
+            lookups = None
+
+            def predicate(self, char):
+                return char.isdigit()
+
+        def make_tokens():
+            tokens = Tokenizer()
+            tokens.add_rule(tok.LiteralSet('kw', 'if', 'else'))
+            tokens.add_rule(tok.Regexp('ident', '[a-z]+'))
+            tokens.add_rule(tok.CharSet('space', ' ', '\n'))
+            tokens.add_rule(tok.Regexp('text', '#[a-z\\s]+', lookups={'#'}))
+            tokens.add_rule(Digit('digit'))
+            return tokens
+
+        input_ = "if x else\nelsewhere 42 ?#ab\ncd"
+        expected = tokenize(make_tokens(), input_)
+        self.assertTrue(expected[0] == ('kw', 'if'))
+        self.assertTrue(('digit', '4') in expected)
+        self.assertTrue(('text', '#ab') in expected)
+        self.assertTrue(tokenize(make_tokens().compile(), input_) == expected)
+
+    def test_range_lookups(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.CharInterval('any', '\u0100', '\U0010ffff'))
+        tokens.add_rule(tok.CharInterval('lower', 'a', 'z'))
+        tokens.add_rule(tok.Char('x', 'x'))
+        tokens.add_rule(tok.Char('y', 'y'))
+        tokens.add_rule(tok.CharCategory('digit', 'Nd'))
+        tokens.add_rule(tok.CharCategory('letter', 'L'))
+        input_ = "xY7λ\u0663"
+        expected = ['lower', 'letter', 'digit', 'any', 'any']
+        for compiled in (False, True):
+            if compiled:
+                tokens.compile()
+            tokens.from_string(input_)
+            types = [tokens.next().token_type for _ in input_]
+            self.assertTrue(types == expected)
+            self.assertTrue(tokens.next().iseof)
+
+    def test_longest_literal(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.LiteralSet('kw', 'new', 'newer', 'n'))
+        tokens.add_rule(tok.Literal('assign', '='))
+        tokens.add_rule(tok.Literal('eq', '=='))
+        tokens.add_rule(tok.Literal('arrow', '=>'))
+        tokens.add_rule(tok.Literal('eq2', '=='))  # shadowed by 'eq'
+        tokens.add_rule(tok.Char('space', ' '))
+        input_ = "newer=== new=>n"
+        expected = [('kw', 'newer'), ('eq', '=='), ('assign', '='),
+                    ('space', ' '), ('kw', 'new'), ('arrow', '=>'),
+                    ('kw', 'n')]
+        for compiled in (False, True):
+            if compiled:
+                tokens.compile()
+            tokens.from_string(input_)
+            result = [(token.token_type, token.value)
+                      for token in (tokens.next() for _ in expected)]
+            self.assertTrue(result == expected)
+            self.assertTrue(tokens.next().iseof)
+
+    def test_keyword_promotion(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('name', '[a-z]+',
+                                   keywords={'new': 'new', 'nil': 'term'}))
+        tokens.add_rule(tok.Regexp('upper', '[A-Z]+', keywords=['END']))
+        tokens.add_rule(tok.Char('space', ' '))
+        input_ = "newton new nil END ENDS"
+        expected = [('name', 'newton'), ('new', 'new'), ('term', 'nil'),
+                    ('END', 'END'), ('upper', 'ENDS')]
+        for compiled in (False, True):
+            if compiled:
+                tokens.compile()
+            tokens.from_string(input_)
+            result = []
+            while not tokens.at_eof:
+                token = tokens.next()
+                if token.token_type != 'space':
+                    result.append((token.token_type, token.value))
+            self.assertTrue(result == expected)
+
+    def test_trivia(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('word', '[a-z]+'))
+        tokens.add_trivia(tok.CharSet('space', ' ', '\n'))
+        tokens.add_trivia(tok.Regexp('comment', '#[^\\n]*'))
+        input_ = "ab # comment\n  cd  "
+        tokens.from_string(input_)
+        self.assertTrue([tokens.next().value for _ in range(2)]
+                        == ['ab', 'cd'])
+        self.assertTrue(tokens.next().iseof)
+        tokens.keep_trivia = True
+        tokens.from_string(input_)
+        self.assertTrue(tokens.next().trivia == ())
+        token = tokens.next()
+        self.assertTrue(token.value == 'cd')
+        self.assertTrue([trivia.token_type for trivia in token.trivia]
+                        == ['space', 'comment', 'space', 'space', 'space'])
+        self.assertTrue(len(tokens.next().trivia) == 2)
+
+    def test_mark_restore(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Literal('ab', 'ab'))
+        tokens.add_rule(tok.Char('newline', '\n'))
+        tokens.from_string("ab\nab")
+        tokens.next()
+        mark = tokens.mark()
+        self.assertTrue(tokens.next().token_type == 'newline')
+        self.assertTrue(tokens.position.line_pos == 2)
+        tokens.restore(mark)
+        self.assertTrue(tokens.position.offset == 2)
+        self.assertTrue(tokens.position.line_pos == 1)
+        self.assertTrue(tokens.next().token_type == 'newline')
+        token = tokens.next()
+        tokens.commit(mark)
+        self.assertTrue(token.start_pos.line_pos == 2)
+        self.assertTrue(token.end_pos.char_pos == 3)
+
+    def test_file_backend(self):
+        with tempfile.NamedTemporaryFile('wb', delete=False) as input_file:
+            input_file.write("if λx\n  else\n".encode('utf-8'))
+        tokens = Tokenizer()
+        tokens.add_rule(tok.LiteralSet('kw', 'if', 'else'))
+        tokens.add_rule(tok.CharSet('lambda', 'λ', '\\'))
+        tokens.add_rule(tok.Regexp('ident', '[a-z]+'))
+        tokens.add_trivia(tok.CharSet('space', ' ', '\n'))
+        try:
+            for compiled in (False, True):
+                if compiled:
+                    tokens.compile()
+                tokens.from_file(input_file.name)
+                result = [tokens.next() for _ in range(5)]
+                self.assertTrue([(token.token_type, token.value)
+                                 for token in result[:4]]
+                                == [('kw', 'if'), ('lambda', 'λ'),
+                                    ('ident', 'x'), ('kw', 'else')])
+                # the offsets count bytes
+                self.assertTrue(result[2].start == 5)
+                self.assertTrue(result[3].start_pos.line_pos == 2)
+                self.assertTrue(result[3].start_pos.char_pos == 3)
+                self.assertTrue(result[4].iseof)
+                tokens.backend.close()
+            # the file is decoded if a rule cannot lex its bytes
+            tokens.add_rule(tok.Regexp('word', r'\w+'))
+            with tokens.from_file(input_file.name) as backend:
+                self.assertTrue(isinstance(backend, StrTokenizer))
+                self.assertTrue([tokens.next().value for _ in range(3)]
+                                == ['if', 'λ', 'x'])
+            with tempfile.NamedTemporaryFile('wb', delete=False) as ascii_file:
+                ascii_file.write(b"if x")
+            with tokens.from_file(ascii_file.name) as backend:
+                self.assertTrue(tokens.next().value == 'if')
+            self.assertTrue(backend.data.closed)
+            os.unlink(ascii_file.name)
+        finally:
+            os.unlink(input_file.name)
+
+    def test_bytes_backend(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('name', '[a-z]+', keywords=['new']))
+        tokens.add_rule(tok.Char('lambda', 'λ'))
+        tokens.add_trivia(tok.Char('space', ' '))
+        tokens.from_string("new newer")
+        self.assertTrue(isinstance(tokens.backend, BytesTokenizer))
+        self.assertTrue(tokens.next().token_type == 'new')
+        self.assertTrue(tokens.next().value == 'newer')
+        tokens.from_bytes("λab new".encode('utf-8'))
+        self.assertTrue([(token.token_type, token.value, token.end)
+                         for token in (tokens.next() for _ in range(3))]
+                        == [('lambda', 'λ', 2), ('name', 'ab', 4),
+                            ('new', 'new', 8)])
+        # the cursor moves by characters, over their bytes
+        tokens.from_bytes("aλ€𝄞b".encode('utf-8'))
+        self.assertTrue(tokens.forwards(4) and tokens.offset == 10)
+        self.assertTrue(tokens.backward() and tokens.offset == 6)
+        self.assertTrue(tokens.peek_char() == '𝄞')
+        self.assertTrue(tokens.backwards(2) and tokens.offset == 1)
+        self.assertTrue(tokens.peek_char() == 'λ')
+        self.assertFalse(tokens.backwards(2) or tokens.forwards(5))
+        self.assertTrue(tokens.offset == 1)
+        self.assertTrue(tokens.forwards(-1) and tokens.offset == 0)
+        # a stray continuation byte is a character of its own
+        tokens.from_bytes(b"a\x80b")
+        self.assertTrue(tokens.forwards(2) and tokens.backward())
+        self.assertTrue(tokens.offset == 1)
+        # a regexp that cannot be matched on bytes
+        greek = tok.Regexp('greek', '[\\u03b1-\\u03c9]+')
+        self.assertRaises(ValueError, tokens.add_rule, greek)
+        tokens = Tokenizer()
+        tokens.add_rule(greek)
+        tokens.from_string("new")
+        self.assertTrue(isinstance(tokens.backend, StrTokenizer))
+        self.assertRaises(ValueError, tokens.from_bytes, b"new")
+
+    def test_utf8_bytes(self):
+        def tokenize(rule, input_):
+            tokens = Tokenizer()
+            tokens.add_rule(rule)
+            tokens.add_trivia(tok.Char('space', ' '))
+            result = []
+            for (load, data) in ((tokens.from_string, input_),
+                                 (tokens.from_bytes, input_.encode('utf-8'))):
+                load(data)
+                values = []
+                token = tokens.next()
+                while not token.iseof and not token.iserror:
+                    values.append((token.token_type, token.value))
+                    token = tokens.next()
+                result.append((values, token.iseof))
+            return (tokens, result)
+
+        for rule in (tok.Regexp('word', r'\w+'),
+                     tok.Regexp('greek', '[α-ω]+'),
+                     tok.Regexp('name', '[a-zé]+', keywords=['été']),
+                     tok.Regexp('name', '(?i)[a-z]+')):
+            (tokens, (by_string, by_bytes)) = tokenize(rule, "été αβ café")
+            self.assertFalse(rule.utf8_ready)
+            self.assertTrue(by_bytes == by_string)
+            # the data is decoded, the offsets count characters
+            self.assertTrue(isinstance(tokens.backend, StrTokenizer))
+        # the bytes are matched if the rule is equivalent there
+        rule = tok.Regexp('name', '[a-z]+')
+        (tokens, (by_string, by_bytes)) = tokenize(rule, "ab cd")
+        self.assertTrue(rule.utf8_ready and by_bytes == by_string)
+        self.assertTrue(isinstance(tokens.backend, BytesTokenizer))
+        self.assertTrue(tok.Regexp('word', r'\w+', utf8=True).utf8_ready)
+
+    def test_build_token(self):
+        class Number(tok.Regexp):
+            def build_token(self, match_obj, parsed_str, start, end, index):
+                return Token(self.token_type, int(match_obj.group(1)),
+                             start, end, index)
+
+        class Pair(tok.RegexpRule):  # the former signature, with positions
+            def build_token(self, match_obj, parsed_str, start_pos, end_pos):
+                return Token(self.token_type, match_obj.group(2),
+                             start_pos, end_pos)
+
+        tokens = Tokenizer()
+        tokens.add_rule(Number('number', '#([0-9]+)'))
+        tokens.add_trivia(tok.Char('space', ' '))
+        for data in ("#12 #3", b"#12 #3"):  # the lazy (binary) backends
+            if isinstance(data, str):
+                tokens.from_string(data)
+            else:
+                tokens.from_bytes(data)
+            self.assertTrue(isinstance(tokens.backend, BytesTokenizer))
+            self.assertTrue([tokens.next().value for _ in range(2)]
+                            == [12, 3])
+        tokens = Tokenizer()
+        tokens.add_rule(Number('number', '#([0-9]+)'))
+        tokens.add_rule(Pair('pair', '([a-z]+)=([a-z]+)'))
+        tokens.add_trivia(tok.CharSet('space', ' ', '\n'))
+        tokens.from_string("#12 a=b\n x=yz")
+        found = [tokens.next() for _ in range(3)]
+        # the former signature is given str match objects
+        self.assertTrue(isinstance(tokens.backend, StrTokenizer))
+        self.assertTrue([token.value for token in found] == [12, 'b', 'yz'])
+        self.assertTrue(found[2].start_pos.line_pos == 2
+                        and found[2].start_pos.char_pos == 2)
+        self.assertTrue(tokens.next().iseof)
+        # the tokens built with positions
+        token = Token('name', 'x', ParsePosition(4, 2, 3),
+                      ParsePosition(5, 2, 4))
+        self.assertTrue(token.start == 4 and token.end == 5)
+        self.assertTrue(token.end_pos == ParsePosition(5, 2, 4))
+
 
 class TestSimpleParsers(unittest.TestCase):
     def test_token_parser(self):
@@ -79,5 +406,622 @@ class TestSimpleParsers(unittest.TestCase):
         self.assertTrue(res.content[2].content.value == 'world')
         self.assertTrue(res.content[3].content.iseof)
 
+    def test_lookahead_buffer(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Literal('hello', 'hello'))
+        tokens.add_rule(tok.CharSet('space', ' ', '\t', '\r'))
+        grammar = Grammar()
+        grammar.register('init', parse.Tuple()
+                         .element(parse.List(parse.Token('hello'))
+                                  .forget(parse.Token('space')))
+                         .skip(parse.EOF())
+                         .forget(parse.Token('space')))
+        llparser = LLParsing(grammar)
+        llparser.tokenizer = tokens
+        tokens.from_string("hello hello hello")
+        res = llparser.parse()
+        self.assertFalse(res.iserror)
+        self.assertTrue(len(res.content.content) == 3)
+        # each of the 6 tokens (with EOF) is recognized exactly once
+        self.assertTrue(llparser.lookahead_misses == 6)
+        self.assertTrue(llparser.lookahead_hits > 6)
+
+    def test_stream_window(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('word', '[a-zé]+'))
+        tokens.add_rule(tok.Char('newline', '\n'))
+        grammar = Grammar()
+        line = parse.Tuple().element(parse.Token('word'))\
+                            .element(parse.Token('newline'))
+        grammar.register('init', parse.Repeat(line, commit=True))
+        llparser = LLParsing(grammar)
+        llparser.tokenizer = tokens
+        input_ = "abc\nété\n" * 200
+        for stream in (io.StringIO(input_),
+                       io.BytesIO(input_.encode('utf-8'))):
+            tokens.from_stream(stream, chunk_size=16, lookahead=16)
+            result = llparser.parse()
+            self.assertTrue(tokens.at_eof)
+            self.assertTrue(tokens.position.line_pos == 401)
+            self.assertTrue(tokens.position.char_pos == 1)
+            # the committed lines are released, with their newlines
+            self.assertTrue(len(tokens.backend.window) <= 64)
+            self.assertTrue(len(tokens.line_index.newlines) <= 16)
+            self.assertRaises(ValueError, tokens.substring, 0, 1)
+            self.assertRaises(ValueError, lambda: result.start_pos.line_pos)
+        # the lookahead is bounded on an input without newlines
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('word', '[a-z]+'))
+        tokens.add_trivia(tok.Char('space', ' '))
+        tokens.from_stream(io.BytesIO(b"abc " * 5000), chunk_size=16,
+                           lookahead=16)
+        tokens.next()
+        self.assertTrue(len(tokens.backend.window) <= 48)
+        tokens.from_stream(io.BytesIO(b"abc " * 5000), chunk_size=16,
+                           lookahead=16)
+        window = 0
+        while not tokens.next().iseof:
+            tokens.commit(tokens.mark())
+            window = max(window, len(tokens.backend.window))
+        self.assertTrue(window <= 64)
+        # a long token is matched across the chunks
+        tokens.from_stream(io.StringIO("a" * 100 + " b"), chunk_size=16,
+                           lookahead=16)
+        self.assertTrue(tokens.next().value == "a" * 100)
+        self.assertTrue(tokens.next().value == "b")
+        # a repetition that is not a commit point keeps the input
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('word', '[a-zé]+'))
+        tokens.add_rule(tok.Char('newline', '\n'))
+        grammar = Grammar()
+        grammar.entry = parse.Repeat(line, minimum=1)
+        llparser = LLParsing(grammar)
+        llparser.tokenizer = tokens
+        tokens.from_stream(io.StringIO(input_), chunk_size=16)
+        result = llparser.parse()
+        self.assertTrue(tokens.substring(0, 3) == 'abc')
+        self.assertTrue(result.content[-1].end_pos.line_pos == 401)
+
+    def test_shared_results(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Literal('hello', 'hello'))
+        llparser = LLParsing(Grammar())
+        llparser.tokenizer = tokens
+        tokens.from_string("hello")
+        optional = parse.Optional(parse.Token('world'))
+        empty = optional.parse(llparser)
+        self.assertTrue(empty.content is None)
+        self.assertTrue(optional.parse(llparser) is empty)
+        self.assertTrue(tokens.position is tokens.position)
+        llparser.next_token()
+        self.assertTrue(llparser.next_token() is tokens.next())
+        self.assertFalse(hasattr(empty, '__dict__'))
+        # the shared result cannot be modified, e.g. by a transformation
+        self.assertRaises(AttributeError, setattr, empty, 'content', [])
+        optional.xform_result = lambda result: setattr(result, 'content', 1)
+        self.assertRaises(AttributeError, optional.parse, llparser)
+        optional.xform_result = None
+        optional.xform_content = lambda result: []
+        self.assertTrue(optional.parse(llparser).content == [])
+        self.assertTrue(optional.parse(llparser) is not empty
+                        and empty.content is None)
+
+    def test_lazy_errors(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Literal('hello', 'hello'))
+        tokens.add_rule(tok.Literal('world', 'world'))
+        tokens.add_trivia(tok.Char('space', ' '))
+        grammar = Grammar()
+        grammar.register('init', parse.Tuple()
+                         .element(parse.Token('hello'))
+                         .element(parse.Optional(parse.Token('hello')))
+                         .element(parse.Choice()
+                                  .either(parse.Token('hello'))
+                                  .orelse(parse.EOF())))
+        llparser = LLParsing(grammar)
+        llparser.tokenizer = tokens
+        tokens.from_string("hello world")
+        error = llparser.parse()
+        self.assertTrue(error.iserror)
+        self.assertTrue(error.expected == ('hello', '<<EOF>>'))
+        self.assertTrue(error.content == "Unexpected token type 'world' "
+                        "expecting: 'hello', or '<<EOF>>'")
+        self.assertTrue(error.start_pos.offset == 6)
+        # the message is formatted once, and can be replaced
+        self.assertTrue(error.content is error.content)
+        error.content = "Expecting 'hello'"
+        self.assertTrue(str(error).endswith(": Expecting 'hello'"))
+        # the failed optional 'hello' is aggregated at the same offset
+        self.assertTrue(llparser.furthest_failure
+                        == (6, {'hello', '<<EOF>>'}))
+
+    def test_compiled_grammar(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Literal('hello', 'hello'))
+        tokens.add_rule(tok.Literal('world', 'world'))
+        tokens.add_trivia(tok.Char('space', ' '))
+        grammar = Grammar()
+        grammar.register('hello', parse.Token('hello'))
+        grammar.register('greeting', grammar.ref('hello'))
+        grammar.register('word', parse.Choice().either(grammar.ref('hello'))
+                         .orelse(parse.Token('world')))
+        grammar.entry = parse.Tuple().element(grammar.ref('greeting'))\
+                                     .element(parse.List(grammar.ref('word')))
+        self.assertTrue(grammar.compile() is grammar)
+        # the references are replaced by the referenced parsers
+        self.assertTrue(grammar.fetch('greeting') is grammar.fetch('hello'))
+        self.assertRaises(ParseException, grammar.register, 'x',
+                          parse.EOF())
+        llparser = LLParsing(grammar)
+        llparser.tokenizer = tokens
+        tokens.from_string("hello world hello")
+        result = llparser.parse()
+        self.assertTrue([word.content.value
+                         for word in result.content[1].content]
+                        == ['world', 'hello'])
+        grammar = Grammar()
+        grammar.entry = parse.Optional(grammar.ref('missing'))
+        self.assertRaises(ParseException, grammar.compile)
+
+    def test_grammar_analysis(self):
+        tokens = Tokenizer()
+        for word in ('hello', 'world', 'bye'):
+            tokens.add_rule(tok.Literal(word, word))
+        tokens.add_trivia(tok.Char('space', ' '))
+        grammar = Grammar()
+        greeting = parse.Tuple().element(parse.Optional(parse.Token('hello')))\
+                                .element(parse.Token('world'))
+        # the first branch starts with an optional
+        grammar.register('words', parse.Choice().either(greeting)
+                         .orelse(parse.Token('bye')))
+        grammar.entry = parse.Tuple().element(parse.List(grammar.ref('words')))\
+                                     .element(parse.EOF())
+        grammar.compile(strict=True)
+        analysis = grammar.analysis
+        self.assertTrue(analysis.first(greeting) == {'hello', 'world'})
+        self.assertTrue(not analysis.nullable(greeting))
+        self.assertTrue(analysis.follow(greeting)
+                        == {'hello', 'world', 'bye', '<<EOF>>'})
+        self.assertTrue(analysis.conflicts == [])
+        llparser = LLParsing(grammar)
+        llparser.tokenizer = tokens
+        tokens.from_string("world bye hello world")
+        result = llparser.parse()
+        self.assertTrue(not result.iserror)
+        self.assertTrue(len(result.content[0].content) == 3)
+        # an optional 'hello' followed by 'hello'
+        grammar = Grammar()
+        grammar.entry = parse.Tuple().element(parse.Optional(parse.Token('hello')))\
+                                     .element(parse.Token('hello'))
+        self.assertRaises(ParseException, grammar.compile, True)
+        self.assertTrue(not grammar.compiled)
+        grammar.compile()
+        self.assertTrue(len(grammar.analysis.conflicts) == 1)
+        # branches forgetting the same token type do not collide
+        tokens = Tokenizer()
+        for (token_type, char) in (('a', 'a'), ('b', 'b'), ('space', ' ')):
+            tokens.add_rule(tok.Char(token_type, char))
+        for strict in (False, True):
+            grammar = Grammar()
+            grammar.entry = parse.Choice()\
+                .either(parse.Token('a').forget(parse.Token('space')))\
+                .orelse(parse.Token('b').forget(parse.Token('space')))
+            grammar.compile(strict)
+            self.assertTrue(grammar.analysis.first(grammar.entry)
+                            == {'a', 'b'})
+            llparser = LLParsing(grammar)
+            llparser.tokenizer = tokens
+            tokens.from_string("b")
+            self.assertTrue(llparser.parse().content.value == 'b')
+        # a forgotten token still predicts the parser that skips it
+        grammar = Grammar()
+        optional = parse.Optional(parse.Token('a')
+                                  .forget(parse.Token('space')))
+        grammar.entry = parse.Tuple().element(optional)\
+                                     .element(parse.Token('b'))
+        grammar.compile()
+        self.assertTrue(optional.prediction == {'a', 'space'})
+        llparser = LLParsing(grammar)
+        llparser.tokenizer = tokens
+        tokens.from_string(" ab")
+        self.assertTrue(llparser.parse().content[0].content.value == 'a')
+
+    def test_packrat_memo(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Char('sign', '-'))
+        tokens.add_rule(tok.Regexp('number', '[0-9]+'))
+        tokens.add_trivia(tok.Char('space', ' '))
+        grammar = Grammar()
+        grammar.register('sign', parse.Token('sign'))
+        grammar.register('number', parse.Tuple()
+                         .element(parse.Optional(grammar.ref('sign')))
+                         .element(parse.Optional(grammar.ref('sign')))
+                         .element(parse.Token('number')))
+        grammar.entry = parse.List(grammar.ref('number'))
+        results = []
+        for memo in (False, True):
+            llparser = LLParsing(grammar, memo=memo, memo_size=4)
+            llparser.tokenizer = tokens
+            tokens.from_string("1 -2 --3 4")
+            results.append([str(number.content[-1].content.value)
+                            for number in llparser.parse().content])
+            if memo:
+                # the failed 'sign' is replayed by the second optional,
+                # before '1', '4' and the end of input
+                self.assertTrue(llparser.memo_hits == 3)
+                self.assertTrue(llparser.memo_misses > 0)
+                self.assertTrue(llparser.memo_entries <= 4)
+            else:
+                self.assertTrue(llparser.memo_misses == 0)
+        self.assertTrue(results[0] == results[1] == ['1', '2', '3', '4'])
+
+    def test_ordered_choice(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('ident', '[a-z]+'))
+        tokens.add_rule(tok.Regexp('number', '[0-9]+'))
+        tokens.add_rule(tok.Char('assign', '='))
+        tokens.add_rule(tok.Char('lparen', '('))
+        tokens.add_rule(tok.Char('rparen', ')'))
+        tokens.add_rule(tok.Char('semi', ';'))
+        tokens.add_trivia(tok.Char('space', ' '))
+        grammar = Grammar()
+        grammar.register('name', parse.Token('ident'))
+        # both statements start with a name
+        call = parse.Tuple().element(grammar.ref('name'))\
+                            .skip(parse.Token('lparen'))\
+                            .element(parse.Repeat(parse.Token('number')))\
+                            .skip(parse.Token('rparen'))
+        grammar.register('call', call)
+        grammar.register('def', parse.Tuple().element(call)
+                         .skip(parse.Token('assign'))
+                         .element(parse.Token('number')))
+        grammar.register('assign', parse.Tuple().element(grammar.ref('name'))
+                         .skip(parse.Token('assign'))
+                         .element(parse.Token('number')))
+        # the statements (but numbers) start with a name
+        grammar.register('statement', parse.OrderedChoice()
+                         .either(grammar.ref('def'))
+                         .orelse(grammar.ref('call'))
+                         .orelse(grammar.ref('assign'))
+                         .orelse(parse.Token('number')))
+        grammar.entry = parse.Repeat(parse.Tuple()
+                                     .element(grammar.ref('statement'))
+                                     .skip(parse.Token('semi')), commit=True)
+        self.assertRaises(parse.Choice.StateError, parse.Choice()
+                          .either(grammar.ref('call')).orelse,
+                          grammar.ref('assign'))
+        for memo in (False, True):
+            llparser = LLParsing(grammar, memo=memo)
+            llparser.tokenizer = tokens
+            # the input is released on the commits of the statements,
+            # but not in speculations
+            tokens.from_stream(io.StringIO("f(1 2); x = 3; 4; g() = 5;"),
+                               chunk_size=1)
+            llparser.parse()
+            self.assertTrue(llparser.speculation == 0)
+            self.assertTrue(tokens.at_eof)
+            if memo:
+                # the names parsed by the failed branches are replayed
+                self.assertTrue(llparser.memo_hits == 3)
+        tokens.from_string("x = ;")
+        llparser.tokenizer = tokens
+        result = grammar.fetch('statement').parse(llparser)
+        self.assertTrue(result.iserror)
+        # the error of the assignment, that went the furthest
+        self.assertTrue(result.end_pos.offset == 3)
+        self.assertTrue(llparser.furthest_failure == (4, {'number'}))
+        self.assertTrue(llparser.position.offset == 0)
+
+    def test_generated_parser(self):
+        def make_grammar():
+            grammar = Grammar()
+            grammar.register('number', parse.Token('number'))
+            grammar.register('signed', parse.Tuple()
+                             .element(parse.Optional(parse.Token('sign')))
+                             .element(grammar.ref('number')))
+            grammar.register('call', parse.Tuple().element(parse.Token('ident'))
+                             .element(parse.List(grammar.ref('signed'),
+                                                 open='lparen', close='rparen',
+                                                 sep='comma')))
+            grammar.register('statement', parse.OrderedChoice()
+                             .either(grammar.ref('call'))
+                             .orelse(parse.Token('ident'))
+                             .orelse(grammar.ref('signed')))
+            grammar.fetch('number').xform_content = \
+                lambda result: int(result.content.value)
+            grammar.entry = parse.Tuple()\
+                .element(parse.List(grammar.ref('statement'), sep='semi'))\
+                .skip(parse.EOF())\
+                .forget(parse.Token('newline'))
+            return grammar
+
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('ident', '[a-z]+'))
+        tokens.add_rule(tok.Regexp('number', '[0-9]+'))
+        for (token_type, char) in (('sign', '-'), ('lparen', '('),
+                                   ('rparen', ')'), ('comma', ','),
+                                   ('semi', ';'), ('newline', '\n')):
+            tokens.add_rule(tok.Char(token_type, char))
+        tokens.add_trivia(tok.Char('space', ' '))
+
+        def parse_with(grammar, input_):
+            llparser = LLParsing(grammar)
+            llparser.tokenizer = tokens
+            tokens.from_string(input_)
+            result = llparser.parse()
+            if result.iserror:
+                return (result.content, llparser.furthest_failure)
+            return [statement.content if isinstance(statement.content, int)
+                    else repr(statement.content)
+                    for statement in result.content.content]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            generated = codegen.generate_grammar(make_grammar(), cache_dir)
+            self.assertTrue(len(os.listdir(cache_dir)) >= 1)
+            # the same structure has the same fingerprint
+            codegen.generate_grammar(make_grammar(), cache_dir)
+            self.assertTrue(len([name for name in os.listdir(cache_dir)
+                                 if name.endswith('.py')]) == 1)
+        interpreted = make_grammar()
+        for input_ in ("f(1, -2);\nx; -3\n", "f(1,", "f(1) g", "-"):
+            self.assertTrue(parse_with(generated, input_)
+                            == parse_with(interpreted, input_))
+        # the transformation of the numbers is applied
+        self.assertTrue('content=7,' in parse_with(generated, "7; x")[0])
+        # the fingerprint is the one of the structure, before generating
+        self.assertTrue(codegen.CodeGenerator(make_grammar()).fingerprint
+                        == codegen.CodeGenerator(make_grammar()).fingerprint)
+        other = make_grammar()
+        other.fetch('signed').element(parse.Token('number'))
+        self.assertTrue(codegen.CodeGenerator(other).fingerprint
+                        != codegen.CodeGenerator(make_grammar()).fingerprint)
+        # the embedded operands call the generated parsers
+        generator = codegen.CodeGenerator(PiParser.pi_grammar())
+        self.assertTrue(".parse_embedded(self, token, node_"
+                        in generator.source)
+        generated = codegen.generate_grammar(PiParser.pi_grammar())
+        for input_ in ("new(a) <gc> end", "new(a) <gc"):
+            results = []
+            for grammar in (PiParser.pi_grammar(), generated):
+                llparser = LLParsing(grammar)
+                llparser.tokenizer = PiParser.pi_tokenizer()
+                llparser.tokenizer.from_string(input_)
+                result = llparser.parse()
+                results.append((result.iserror, repr(result.content)))
+            self.assertTrue(results[0] == results[1])
+
+    def test_table_parsing(self):
+        grammar = Grammar()
+        grammar.register('number', parse.Token('number'))
+        grammar.register('nested', parse.Tuple().skip(parse.Token('lparen'))
+                         .element(grammar.ref('value'))
+                         .element(parse.Optional(parse.Token('number')))
+                         .skip(parse.Token('rparen')))
+        grammar.register('value', parse.Choice().either(grammar.ref('number'))
+                         .orelse(grammar.ref('nested')))
+        grammar.fetch('number').xform_content = \
+            lambda result: int(result.content.value)
+        grammar.fetch('nested').xform_content = \
+            lambda result: result.content[0].content + 1
+        grammar.entry = parse.Tuple().element(grammar.ref('value'))\
+                                     .skip(parse.EOF())
+
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Regexp('number', '[0-9]+'))
+        tokens.add_rule(tok.Char('lparen', '('))
+        tokens.add_rule(tok.Char('rparen', ')'))
+        tokens.add_trivia(tok.Char('space', ' '))
+
+        def parse_with(parsing, input_):
+            llparser = parsing(grammar)
+            llparser.tokenizer = tokens
+            tokens.from_string(input_)
+            result = llparser.parse()
+            if result.iserror:
+                return (result.content, llparser.furthest_failure)
+            return (result.content.content, result.end_pos.offset)
+
+        for input_ in ("1", "((1) 2)", "((1 2) 3", "(1))", "()", ""):
+            self.assertTrue(parse_with(TableParsing, input_)
+                            == parse_with(LLParsing, input_))
+        # the nesting is not bounded by the recursion limit
+        depth = 5000
+        self.assertTrue(parse_with(TableParsing,
+                                   "(" * depth + "0" + ")" * depth)
+                        == (depth, 2 * depth + 1))
+        # the entry of an uncompiled grammar is a reference to a rule
+        lambda_parser = LambdaParser()
+        lambda_grammar = Grammar()
+        lambda_parser.prepare_grammar(lambda_grammar)
+        self.assertFalse(lambda_grammar.compiled)
+        llparser = TableParsing(lambda_grammar)
+        llparser.tokenizer = Tokenizer()
+        lambda_parser.prepare_tokenizer(llparser.tokenizer)
+        llparser.tokenizer.from_string("(" * depth + "x:T" + " y:T)" * depth)
+        self.assertFalse(llparser.parse().iserror)
+
+    def test_expression_driver(self):
+        calculator = CalculatorEval()
+
+        def evaluate(input_):
+            result = calculator.parse_from_string(input_)
+            if result.iserror:
+                return result.content
+            return result.content.content
+
+        # the operators bind by priority, left-associative
+        self.assertTrue(evaluate("2 * 3 + 4") == 10)
+        self.assertTrue(evaluate("3 × 6/2 × 3") == 27)
+        self.assertTrue(evaluate("8 - 2 - 1") == 5)
+        self.assertTrue(evaluate("-2 * (3 + 4)") == -14)
+        self.assertTrue(evaluate("1 / 0 + 2") == "Division by zero")
+        self.assertTrue(evaluate("1 2") == "Expecting '<<EOF>>' token")
+        # the nesting is not bounded by the recursion limit
+        depth = 5000
+        self.assertTrue(evaluate("+".join(["1"] * depth)) == depth)
+        self.assertTrue(evaluate("(" * depth + "1" + ")" * depth) == 1)
+        self.assertTrue(evaluate("-" * depth + "1") == 1)
+
+    def test_embed_expr_parser(self):
+        grammar = PiParser.pi_grammar()
+        embed = grammar.fetch('expr').expressions['gc']
+        xform_content = embed.parser.xform_content
+        seen = []
+
+        def record(result):
+            embedding = embed.expr_parser(llparser)
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                # the former attribute, for the parse of the thread
+                seen.append(embed.expr_parser.llparser is llparser
+                            and embedding is not None)
+            self.assertTrue(caught[0].category is DeprecationWarning)
+            return xform_content(result)
+
+        def fail(result):
+            raise RuntimeError("in the embedded parser")
+
+        for parsing in (LLParsing, TableParsing):
+            del seen[:]
+            embed.parser.xform_content = record
+            llparser = parsing(grammar)
+            llparser.tokenizer = PiParser.pi_tokenizer()
+            llparser.tokenizer.from_string("<gc> <gc> end")
+            self.assertTrue(not llparser.parse().iserror)
+            self.assertTrue(seen == [True, True])
+            self.assertTrue(embed.expr_parser(llparser) is None)
+            # the embedding parsers are left on errors
+            failing = PiParser.pi_grammar()
+            failing_embed = failing.fetch('expr').expressions['gc']
+            failing_embed.parser.xform_content = fail
+            llparser = parsing(failing)
+            llparser.tokenizer = PiParser.pi_tokenizer()
+            llparser.tokenizer.from_string("<gc> <gc> end")
+            try:
+                llparser.parse()
+                self.assertTrue(False)
+            except RuntimeError:
+                pass
+            self.assertTrue(failing_embed.current_embedding() is None)
+            self.assertTrue(failing_embed.expr_parser(llparser) is None)
+
+    def test_concurrent_parses(self):
+        lambda_parser = LambdaParser()
+
+        def lambda_grammar():
+            grammar = Grammar()
+            lambda_parser.prepare_grammar(grammar)
+            return grammar
+
+        def lambda_tokenizer():
+            tokenizer = Tokenizer()
+            lambda_parser.prepare_tokenizer(tokenizer)
+            return tokenizer
+
+        # (make grammar, make tokenizer, inputs): the grammars are shared
+        # by the threads, and not compiled beforehand
+        examples = [(CalculatorEval.calculator_grammar,
+                     CalculatorEval.calculator_tokenizer,
+                     ["(1 + 2) * (3 - {0})".format(i) for i in range(8)]
+                     + ["((4 / {0}) + (2 * 3)) / 2".format(i)
+                        for i in range(4)]),
+                    (PiParser.pi_grammar, PiParser.pi_tokenizer,
+                     ["new(a) " * i + "<gc> end" for i in range(8)]),
+                    (lambda_grammar, lambda_tokenizer,
+                     ["(λx:Bool. x:Bool y:{0})".format("T" * i)
+                      for i in range(8)] + ["(λx. x"])]
+
+        def parse_with(parsing, grammar, make_tokenizer, input_):
+            llparser = parsing(grammar)
+            llparser.tokenizer = make_tokenizer()
+            llparser.tokenizer.from_string(input_)
+            result = llparser.parse()
+            if result.iserror:
+                return (result.content, llparser.furthest_failure)
+            return repr(result.content)
+
+        expected = {}
+        for (make_grammar, make_tokenizer, inputs) in examples:
+            for input_ in inputs:
+                expected[input_] = parse_with(LLParsing, make_grammar(),
+                                              make_tokenizer, input_)
+        shared = [(make_grammar(), make_tokenizer, inputs)
+                  for (make_grammar, make_tokenizer, inputs) in examples]
+        jobs = [(parsing, grammar, make_tokenizer, input_)
+                for (grammar, make_tokenizer, inputs) in shared
+                for input_ in inputs
+                for parsing in (LLParsing, TableParsing)] * 20
+        random.Random(0).shuffle(jobs)
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # many thread switches in a parse
+        try:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(lambda job: parse_with(*job),
+                                            jobs))
+        finally:
+            sys.setswitchinterval(switch_interval)
+        for (job, result) in zip(jobs, results):
+            self.assertTrue(result == expected[job[3]])
+
+    def test_token_types(self):
+        token_types = Tokenizer().token_types
+        self.assertTrue(token_types is Grammar().token_types)
+        hello = token_types.intern('hello')
+        self.assertTrue(token_types.intern('hello') == hello)
+        self.assertTrue(token_types.name(hello) == 'hello')
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Literal('hello', 'hello'))
+        tokens.add_rule(tok.Char('space', ' '))
+        grammar = Grammar()
+        grammar.entry = parse.Tuple()\
+                             .element(parse.Choice()
+                                      .either(parse.Token('hello'))
+                                      .orelse(parse.Token('world')))\
+                             .element(parse.EOF())\
+                             .forget(parse.Token('space'))
+        for parsing in (LLParsing, TableParsing):
+            llparser = parsing(grammar)
+            llparser.tokenizer = tokens
+            tokens.from_string(" hello ")
+            res = llparser.parse()
+            self.assertFalse(res.iserror)
+            self.assertTrue(res.content[0].content.type_id == hello)
+        # a token type registered after the dispatch tables are built
+        late_type = 'late{0}'.format(len(token_types))
+        tokens.add_rule(tok.Char(late_type, '!'))
+        for parsing in (LLParsing, TableParsing):
+            llparser = parsing(grammar)
+            llparser.tokenizer = tokens
+            tokens.from_string("!")
+            res = llparser.parse()
+            self.assertTrue(res.iserror)
+            self.assertTrue("Unexpected token type '" + late_type + "'"
+                            in str(res))
+            # not a forget parser either
+            tokens.from_string("hello !")
+            self.assertTrue(llparser.parse().iserror)
+            self.assertTrue(llparser.furthest_failure
+                            == (6, frozenset({'<<EOF>>'})))
+
+    def test_put_back_token(self):
+        tokens = Tokenizer()
+        tokens.add_rule(tok.Literal('hello', 'hello'))
+        tokens.add_rule(tok.Char('space', ' '))
+        llparser = LLParsing(Grammar())
+        llparser.tokenizer = tokens
+        tokens.from_string("hello hello")
+        hello = llparser.next_token()
+        space = llparser.next_token()
+        llparser.put_back_token(space)
+        llparser.put_back_token(hello)
+        # the tokenizer cursor does not move back
+        self.assertTrue(tokens.position.offset == 6)
+        self.assertTrue(llparser.position.offset == 0)
+        self.assertTrue(llparser.peek_token() is hello)
+        self.assertTrue(llparser.next_token() is hello)
+        self.assertTrue(llparser.next_token() is space)
+        self.assertTrue(llparser.next_token().start_pos.offset == 6)
+
 if __name__ == '__main__':
     unittest.main()